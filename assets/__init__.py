@@ -1 +1,3 @@
-from .standard import Asset, Equity, Bond, Derivative, Option
\ No newline at end of file
+from .standard import Asset, Equity, Bond, Derivative, Option
+from .marketdata import MarketDataStore
+from .portfolio import OptionBook, OptionRow
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+
+
+class MarketDataStore(object):
+    """ Daily closes and volumes for a universe of tickers held as dates x tickers matrices, loaded in bulk from a local
+    columnar store (a directory of NumPy arrays, memory-mapped, or a Parquet file). Last price, realized vol and ADV
+    are computed for many tickers in one vectorized pass over the lookback window and cached per
+    (ticker, date, lookback), so refreshing a universe is one file scan instead of one request per ticker.
+    """
+    fields = ('close', 'adj_close', 'volume')
+
+    def __init__(self, tickers, dates, close, volume, adj_close=None):
+        """
+        :param tickers: sequence of tickers (one per column)
+        :param dates: increasing sequence of trading dates (one per row)
+        :param close: dates x tickers matrix of closing prices (NaN where missing)
+        :param volume: dates x tickers matrix of traded volumes
+        :param adj_close: optional dates x tickers matrix of dividend/split-adjusted closes used for returns (defaults
+            to close)
+        """
+        self.tickers = np.asarray(tickers).astype(str)
+        self.dates = np.asarray(dates, dtype='datetime64[D]')
+        self.close = close
+        self.volume = volume
+        self.adj_close = close if adj_close is None else adj_close
+        try:
+            assert self.close.shape == self.volume.shape == self.adj_close.shape == (len(self.dates), len(self.tickers))
+        except AssertionError:
+            raise ValueError('close, adj_close and volume must be dates x tickers matrices')
+        self.columns = dict((ticker, i) for i, ticker in enumerate(self.tickers))
+        self._cache = dict()
+
+    @classmethod
+    def from_npy(cls, directory, mmap_mode='r'):
+        """ Loads a store saved by MarketDataStore.save_npy. The price and volume matrices are memory-mapped, so only
+        the rows of a lookback window are read from disk.
+        :param directory: directory holding tickers.npy, dates.npy, close.npy, volume.npy and optionally adj_close.npy
+        :param mmap_mode: numpy memory-map mode (None reads the arrays into memory)
+        """
+        def load(name, mode=mmap_mode):
+            return np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode)
+
+        adj_close = load('adj_close') if os.path.exists(os.path.join(directory, 'adj_close.npy')) else None
+        return cls(load('tickers', None), load('dates', None), load('close'), load('volume'), adj_close)
+
+    @classmethod
+    def from_parquet(cls, path):
+        """ Loads a long-format Parquet file with one row per (date, ticker) and columns date, ticker, close, volume
+        and optionally adj_close. Requires pandas and a Parquet engine (pyarrow or fastparquet).
+        """
+        import pandas as pd
+        frame = pd.read_parquet(path)
+        fields = [f for f in cls.fields if f in frame.columns]
+        wide = frame.pivot_table(index='date', columns='ticker', values=fields, aggfunc='last').sort_index()
+        tickers = wide['close'].columns
+        matrices = dict((f, wide[f].reindex(columns=tickers).to_numpy(dtype=float)) for f in fields)
+        return cls(tickers.to_numpy(), wide.index.to_numpy(), matrices['close'], matrices['volume'],
+                   matrices.get('adj_close'))
+
+    def save_npy(self, directory):
+        """ Writes the store as a directory of .npy files readable by MarketDataStore.from_npy """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        np.save(os.path.join(directory, 'tickers.npy'), self.tickers)
+        np.save(os.path.join(directory, 'dates.npy'), self.dates)
+        for field in self.fields:
+            if field == 'adj_close' and self.adj_close is self.close:
+                continue
+            np.save(os.path.join(directory, field + '.npy'), np.asarray(getattr(self, field), dtype=float))
+
+    def stats(self, tickers=None, value_date=None, lookback=63):
+        """ Last close, annualized realized vol and average daily volume over the lookback window ending on value_date
+        :param tickers: sequence of tickers (defaults to every ticker in the store)
+        :param value_date: last date of the window (defaults to the last date in the store)
+        :param lookback: number of daily returns in the window (the window holds lookback + 1 trading days)
+        :return: dict of price, vol and adv arrays aligned with tickers
+        """
+        tickers = self.tickers if tickers is None else np.asarray(tickers).astype(str)
+        date = self.dates[-1] if value_date is None else np.datetime64(value_date, 'D')
+        missing = [t for t in dict.fromkeys(tickers) if (t, date, lookback) not in self._cache]
+        if missing:
+            self._compute(missing, date, lookback)
+        rows = [self._cache[(t, date, lookback)] for t in tickers]
+        return dict(zip(('price', 'vol', 'adv'), np.array(rows, dtype=float).reshape(-1, 3).T))
+
+    def get(self, ticker, value_date=None, lookback=63):
+        """ (price, vol, adv) of a single ticker """
+        stats = self.stats([ticker], value_date, lookback)
+        return float(stats['price'][0]), float(stats['vol'][0]), float(stats['adv'][0])
+
+    def refresh(self, equities, value_date=None, lookback=63):
+        """ Sets the price, vol and ADV of every Equity in one pass over the store """
+        stats = self.stats([e.ticker for e in equities], value_date, lookback)
+        for equity, price, vol, adv in zip(equities, stats['price'], stats['vol'], stats['adv']):
+            equity.price, equity.vol, equity.adv = float(price), float(vol), float(adv)
+
+    def clear_cache(self):
+        self._cache.clear()
+
+    def _compute(self, tickers, date, lookback):
+        try:
+            columns = [self.columns[t] for t in tickers]
+        except KeyError as e:
+            raise KeyError('No market data for %s' % e.args[0])
+        end = int(np.searchsorted(self.dates, date, side='right'))
+        if not end:
+            raise ValueError('No market data on or before %s' % date)
+        start = max(end - lookback - 1, 0)
+        # one contiguous block of rows, then the requested columns of that block
+        adj = np.asarray(self.adj_close[start:end], dtype=float)[:, columns]
+        volume = np.asarray(self.volume[start:end], dtype=float)[:, columns]
+        close = np.asarray(self.close[start:end], dtype=float)[:, columns]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = adj[1:] / adj[:-1] - 1
+            vol = np.sqrt(self.moments(returns, ddof=1)[1] * 252)
+            adv = self.moments(volume)[0]
+        price = self.last_valid(close)
+        for t, p, v, a in zip(tickers, price, vol, adv):
+            self._cache[(t, date, lookback)] = (p, v, a)
+
+    @staticmethod
+    def moments(values, ddof=0):
+        """ Mean and variance of each column over its non-NaN values (NaN when there are too few values) """
+        valid = np.isfinite(values)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0.).sum(axis=0) / count
+            variance = np.where(valid, (values - mean)**2, 0.).sum(axis=0) / (count - ddof)
+        return mean, np.where(count > ddof, variance, np.nan)
+
+    @staticmethod
+    def last_valid(values):
+        """ Last non-NaN value of each column (NaN if the column is empty) """
+        valid = np.isfinite(values)
+        last = len(values) - 1 - np.argmax(valid[::-1], axis=0)
+        return np.where(valid.any(axis=0), values[last, np.arange(values.shape[1])], np.nan)
+
+    def __repr__(self):
+        return "<MarketDataStore: %d tickers x %d dates>" % (len(self.tickers), len(self.dates))
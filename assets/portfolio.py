@@ -0,0 +1,191 @@
+import datetime
+import numpy as np
+
+from ..curves import YieldCurve
+
+
+class OptionBook(object):
+    """ Columnar book of vanilla options. Strikes, maturities, call and American flags, rates and the index of each
+    option's underlying are held in NumPy arrays (about 30 bytes per contract instead of one Option object each), and
+    OptionBook[i] returns a lightweight OptionRow view. calc_prices sends the book in chunks to a pricer's vectorized
+    price_batch kernel when it has one.
+    """
+    def __init__(self, underlyings, underlying, strike, maturity, call=True, American=False, rfr=0., tickers=None):
+        """
+        :param underlyings: list of underlying Equity instances
+        :param underlying: array of indices into underlyings, one per option
+        :param strike: array of strikes
+        :param maturity: array of maturity dates (anything numpy converts to datetime64[D])
+        :param call: boolean array where True is a call and False is a put
+        :param American: boolean array where True allows early exercise
+        :param rfr: array of continuously-compounded risk-free rates, any of which may be a YieldCurve (held in
+            curves and priced one row at a time; their entries of the rfr column are NaN)
+        :param tickers: optional array of option tickers
+        """
+        self.underlyings = list(underlyings)
+        self.strike = np.asarray(strike, dtype=float)
+        size = len(self.strike)
+        self.underlying = np.broadcast_to(np.asarray(underlying, dtype=np.int32), size).copy()
+        self.maturity = np.broadcast_to(np.asarray(maturity, dtype='datetime64[D]'), size).copy()
+        self.call = np.broadcast_to(np.asarray(call, dtype=bool), size).copy()
+        self.American = np.broadcast_to(np.asarray(American, dtype=bool), size).copy()
+        try:
+            self.rfr = np.broadcast_to(np.asarray(rfr, dtype=float), size).copy()
+            self.curves = {}
+        except TypeError:
+            if isinstance(rfr, YieldCurve): rfr = [rfr] * size
+            rates = list(np.broadcast_to(np.asarray(rfr, dtype=object), size))
+            self.curves = dict((i, r) for i, r in enumerate(rates) if isinstance(r, YieldCurve))
+            self.rfr = np.array([np.nan if isinstance(r, YieldCurve) else r for r in rates], dtype=float)
+        self.tickers = None if tickers is None else np.asarray(tickers).astype(str)
+        try:
+            assert size == 0 or 0 <= self.underlying.min() and self.underlying.max() < len(self.underlyings)
+        except AssertionError:
+            raise ValueError('underlying indices must point into underlyings')
+
+    @classmethod
+    def from_options(cls, options):
+        """ Builds a book from a sequence of Option instances """
+        underlyings, index = [], {}
+        for option in options:
+            if id(option.underlying) not in index:
+                index[id(option.underlying)] = len(underlyings)
+                underlyings.append(option.underlying)
+        return cls(underlyings,
+                   [index[id(o.underlying)] for o in options],
+                   [o.strike for o in options],
+                   [o.maturity for o in options],
+                   call=[o.call for o in options],
+                   American=[o.American for o in options],
+                   rfr=[o.rfr for o in options],
+                   tickers=[o.ticker for o in options])
+
+    def __len__(self):
+        return len(self.strike)
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError('OptionBook index out of range')
+        return OptionRow(self, i % len(self))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield OptionRow(self, i)
+
+    def market_data(self):
+        """ Spot, vol and dividend yield of each option's underlying, read from the underlyings when called
+        :return: (S, vol, div) arrays aligned with the options
+        """
+        spot = np.array([u.price for u in self.underlyings], dtype=float)
+        vol = np.array([u.vol for u in self.underlyings], dtype=float)
+        div = np.array([u.div or 0. for u in self.underlyings], dtype=float)
+        return spot[self.underlying], vol[self.underlying], div[self.underlying]
+
+    def calc_prices(self, pricer, greeks=False, valuation_date=None, chunk_size=10000):
+        """ Prices every option in the book
+        :param pricer: any Pricer; pricers with a price_batch kernel (BlackScholesPricer, LatticeOptionPricer) price
+            chunk_size options per call, others price one OptionRow at a time (as do the options whose rate is a
+            YieldCurve)
+        :param greeks: boolean where True also returns a dict of greek arrays
+        :param valuation_date: optional valuation_date override
+        :param chunk_size: number of options per kernel call, which bounds the memory of lattice kernels
+        :return: array of prices (unrounded when priced by a price_batch kernel) or (prices, greeks)
+        """
+        if not valuation_date: valuation_date = datetime.date.today()
+        if not self.batchable(pricer):
+            return self._calc_rows(pricer, greeks, valuation_date)
+        spot, vol, div = self.market_data()
+        T = (self.maturity - np.datetime64(valuation_date, 'D')).astype(float) / 365.
+        prices, greek = np.empty(len(self)), {}
+        batch = np.arange(len(self))
+        if self.curves:
+            batch = batch[~np.isnan(self.rfr)]
+        for start in range(0, len(batch), chunk_size):
+            rows = batch[start:start + chunk_size]
+            result = pricer.price_batch(spot[rows], self.strike[rows], T[rows], self.rfr[rows], vol[rows], div[rows],
+                                        self.call[rows], greeks=greeks, American=self.American[rows])
+            if greeks:
+                result, chunk_greeks = result
+                for name, values in chunk_greeks.items():
+                    greek.setdefault(name, np.full(len(self), np.nan))[rows] = values
+            prices[rows] = result
+        if self.curves:
+            self._calc_rows(pricer, greeks, valuation_date, sorted(self.curves), prices, greek)
+        return (prices, greek) if greeks else prices
+
+    @staticmethod
+    def batchable(pricer):
+        return hasattr(pricer, 'price_batch')
+
+    def _calc_rows(self, pricer, greeks, valuation_date, rows=None, prices=None, greek=None):
+        """ Prices the given rows (default: every row) one OptionRow at a time, into prices and greek if provided """
+        if rows is None: rows = range(len(self))
+        if prices is None: prices, greek = np.empty(len(self)), {}
+        for i in rows:
+            row = OptionRow(self, i)
+            result = pricer.price(row, row.underlying, row.rfr, greeks=greeks, valuation_date=valuation_date)
+            if greeks:
+                result, row_greeks = result
+                for name, value in row_greeks.items():
+                    greek.setdefault(name, np.full(len(self), np.nan))[i] = value
+            prices[i] = result
+        return (prices, greek) if greeks else prices
+
+    def __repr__(self):
+        return "<OptionBook: %d options>" % len(self)
+
+
+class OptionRow(object):
+    """ View of one option of an OptionBook. It exposes the Option interface (strike, maturity, call, American, rfr,
+    underlying, parity, exercise_value, calc_price) without copying the row, so per-option pricers can price it
+    directly.
+    """
+    __slots__ = ('book', 'index')
+
+    def __init__(self, book, index):
+        self.book = book
+        self.index = index
+
+    @property
+    def ticker(self):
+        return None if self.book.tickers is None else str(self.book.tickers[self.index])
+
+    @property
+    def strike(self):
+        return float(self.book.strike[self.index])
+
+    @property
+    def maturity(self):
+        return self.book.maturity[self.index].astype(datetime.date)
+
+    @property
+    def call(self):
+        return bool(self.book.call[self.index])
+
+    @property
+    def American(self):
+        return bool(self.book.American[self.index])
+
+    @property
+    def rfr(self):
+        curve = self.book.curves.get(self.index)
+        return curve if curve is not None else float(self.book.rfr[self.index])
+
+    @property
+    def underlying(self):
+        return self.book.underlyings[self.book.underlying[self.index]]
+
+    def parity(self, price):
+        if self.call:
+            return np.maximum(0, price - self.strike)
+        else:
+            return np.maximum(0, self.strike - price)
+
+    def exercise_value(self, price):
+        return self.parity(price)
+
+    def calc_price(self, pricer, greeks=False):
+        return pricer.price(asset=self, underlying=self.underlying, rfr=self.rfr, greeks=greeks)
+
+    def __repr__(self):
+        return "<OptionRow: %s>" % (self.ticker or self.index)
@@ -1,10 +1,11 @@
 __author__ = 'exleym'
 
-from pandas.tseries.offsets import BDay
-import pandas_datareader.data as web
 import datetime
 import numpy as np
 
+from .marketdata import MarketDataStore
+from ..cache import invalidate
+
 
 class Asset(object):
     def __init__(self, ticker, name, price=None):
@@ -21,6 +22,7 @@ class Asset(object):
 
     def set_price(self, price):
         self.price = float(price)
+        invalidate(self)
 
 
 class Equity(Asset):
@@ -34,6 +36,17 @@ class Equity(Asset):
         return "<Equity: %s>" % self.ticker
 
     def set_stock_data(self, source='yahoo', value_date=None, lookback=63):
+        """ Sets price, vol and ADV from lookback days of history ending on value_date
+        :param source: a MarketDataStore (local bulk data, cached) or the name of a pandas_datareader source
+        :param value_date: last date of the history (defaults to today, or the last date of the store)
+        :param lookback: number of daily returns used for vol and ADV
+        """
+        if isinstance(source, MarketDataStore):
+            self.price, self.vol, self.adv = source.get(self.ticker, value_date, lookback)
+            return
+        # pandas and pandas_datareader are only needed here, so they are not imported with the package
+        from pandas.tseries.offsets import BDay
+        import pandas_datareader.data as web
         colmap = {'yahoo': 'Adj Close', 'google': 'Close'}
         if not value_date:
             value_date = datetime.datetime.today()
@@ -45,9 +58,11 @@ class Equity(Asset):
 
     def set_vol(self, vol):
         self.vol = float(vol)
+        invalidate(self)
 
     def set_dividend(self, div):
         self.div = float(div)
+        invalidate(self)
 
 
 class Bond(Asset):
@@ -76,33 +91,73 @@ class Derivative(Asset):
     def __repr__(self):
         return "<Derivative: %s>" % self.ticker
 
-    def calc_price(self, pricer, greeks=False):
+    def calc_price(self, pricer, greeks=False, cache=None):
+        """
+        :param pricer: Pricer instance
+        :param greeks: boolean where True returns price and the greeks and false returns price.
+        :param cache: optional PricingCache, which returns the stored result when nothing has changed since the last
+            call with the same pricer
+        """
+        if cache is not None:
+            return cache.price(pricer, self, self.underlying, self.rfr, greeks=greeks)
         return pricer.price(asset=self, underlying=self.underlying, rfr=self.rfr, greeks=greeks)
 
+    def parity(self, price):
+        """ Value of the derivative if it were exercised or converted at the given underlying prices. Subclasses
+        implement it with array operations (np.where, np.minimum, np.clip, ...) so that pricers can evaluate it on a
+        whole lattice slice, price grid or matrix of simulated paths in one call. The base class has no payoff and
+        returns None, which the numerical pricers reject with a TypeError.
+        :param price: underlying price (float or ndarray)
+        :return: payoff with the same shape as price, or None
+        """
+        return None
+
+    def exercise_value(self, price):
+        """ Value received on early exercise at the given underlying prices: parity, modified in turn by each feature
+        of the derivative that changes the early-exercise payoff.
+        :param price: underlying price (float or ndarray)
+        :return: early-exercise value with the same shape as price (None when there is no parity payoff)
+        """
+        value = self.parity(price)
+        if value is None: return None
+        for feature in self.features.values():
+            value = feature.exercise_value(self, price, value)
+        return value
+
 
 class Mandatory(Derivative):
-    def __init__(self, ticker, name, underlying, par, r1, r2, rfr, spread=None, maturity=None):
-        super(Mandatory, self).__init__(ticker, name, underlying, maturity, rfr)
+    def __init__(self, ticker, name, underlying, par, r1, r2, rfr, spread=None, maturity=None, American=True,
+                 coupons=None, pay_dates=None):
+        """
+        :param par: issue price, received in shares at maturity when the stock is between k1 and k2
+        :param r1: maximum conversion ratio (shares per mandatory below k1 = par / r1)
+        :param r2: minimum conversion ratio (shares per mandatory above k2 = par / r2)
+        :param spread: credit spread over the risk-free rate used to discount the coupons
+        :param coupons: optional sequence of coupon cash amounts, one per pay date
+        :param pay_dates: sequence of coupon payment dates, aligned with coupons
+        """
+        super(Mandatory, self).__init__(ticker, name, underlying, rfr=rfr, maturity=maturity)
+        self.American = American
         self.par = par
         self.spread = spread
         self.r1 = r1
         self.r2 = r2
         self.k1 = par / r1
         self.k2 = par / r2
+        self.coupons = list(coupons) if coupons is not None else []
+        self.pay_dates = list(pay_dates) if pay_dates is not None else []
+        try:
+            assert len(self.coupons) == len(self.pay_dates)
+        except AssertionError:
+            raise ValueError('coupons and pay_dates must have the same length')
 
-    def parity(self, price, EEPenalty=None):
-        if price < self.k2:
-            if EEPenalty:
-                return EEPenalty.parity(price)
-            return min(self.r1 * price, self.par)
-        else:
-            return self.r2 * price
+    def parity(self, price):
+        # r1 shares below k1, par between k1 and k2, r2 shares above k2
+        price = np.asarray(price, dtype=float)
+        return np.where(price < self.k2, np.minimum(self.r1 * price, self.par), self.r2 * price)
 
     def ee_parity(self, price):
-        if self.features.has_key('EEPenalty'):
-            ee_penalty = self.features['EEPenalty']
-            return self.parity(price, ee_penalty)
-        return self.parity(price)
+        return self.exercise_value(price)
 
 
 class Option(Derivative):
@@ -0,0 +1 @@
+from .suite import Benchmark, BENCHMARKS, run, save, load, compare, convergence, plot_convergence
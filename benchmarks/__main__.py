@@ -0,0 +1,55 @@
+""" Command-line entry point of the benchmark suite.
+
+    python -m simpaq.benchmarks --save baseline.json            # record a baseline
+    python -m simpaq.benchmarks --compare baseline.json         # exits with status 1 on any regression
+    python -m simpaq.benchmarks --quick --only DCF.price LSM.calc --plot convergence.png
+"""
+import argparse
+import sys
+
+from .suite import BENCHMARKS, run, save, load, compare, convergence, plot_convergence
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m simpaq.benchmarks', description='simpaq benchmark suite')
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS), help='benchmarks to run (default: all)')
+    parser.add_argument('--quick', action='store_true', help='run the small size sweeps only')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs per size (the fastest is recorded)')
+    parser.add_argument('--save', metavar='PATH', help='write the records to a JSON baseline')
+    parser.add_argument('--compare', metavar='PATH', help='compare the records against a JSON baseline')
+    parser.add_argument('--time-tolerance', type=float, default=0.5, help='relative wall time increase allowed')
+    parser.add_argument('--memory-tolerance', type=float, default=0.25, help='relative peak memory increase allowed')
+    parser.add_argument('--error-tolerance', type=float, default=0.1, help='relative error increase allowed')
+    parser.add_argument('--plot', metavar='PATH', help='save convergence-versus-cost curves (requires matplotlib)')
+    args = parser.parse_args(argv)
+
+    print('%-32s %16s %12s %14s %12s' % ('benchmark', 'size', 'wall time', 'peak memory', 'error'))
+
+    def log(record):
+        error = '-' if record['error'] is None else '%.3g' % record['error']
+        print('%-32s %16s %11.4gs %12.1fkB %12s' % (record['benchmark'], '%s=%s' % (record['size_name'],
+                                                    record['size']), record['wall_time'],
+                                                    record['peak_memory'] / 1024., error))
+        sys.stdout.flush()
+
+    records = run(args.only, quick=args.quick, repeat=args.repeat, log=log)
+    print('\nconvergence (size, wall time, error):')
+    for name, curve in convergence(records).items():
+        print('  %s: %s' % (name, ', '.join('(%s, %.3gs, %.3g)' % point for point in curve)))
+    if args.save:
+        save(records, args.save)
+    if args.plot:
+        plot_convergence(records, args.plot)
+    if args.compare:
+        regressions = compare(records, load(args.compare), time_tolerance=args.time_tolerance,
+                              memory_tolerance=args.memory_tolerance, error_tolerance=args.error_tolerance)
+        for regression in regressions:
+            print('REGRESSION %s' % regression)
+        if regressions:
+            return 1
+        print('no regressions against %s' % args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
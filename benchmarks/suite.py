@@ -0,0 +1,309 @@
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+
+from ..assets import Equity, Option
+from ..pricers import BlackScholesPricer, LatticeOptionPricer, MCOptionPricer, DCF
+from ..processes import TREES, MonteCarlo
+from ..solvers import LSM
+
+# market of every pricing benchmark: a one-year out-of-the-money put on a dividend-paying stock
+SPOT, STRIKE, RATE, VOL, DIV, T = 40., 44., 0.06, 0.2, 0.01, 1.
+_references = {}
+
+
+class Benchmark(object):
+    """ One timed operation run across a sweep of problem sizes (time steps, paths, book size, ...). build(size)
+    returns the operation as a function of no arguments, and a function giving the error of its result against a
+    reference (or None when the operation has no reference).
+    """
+    def __init__(self, name, build, sizes, quick_sizes=None, size_name='n', description=None):
+        """
+        :param name: name of the benchmark (key of its records)
+        :param build: function of the size returning (operation, error function)
+        :param sizes: sizes swept by a full run
+        :param quick_sizes: optional smaller sweep for quick runs (defaults to the two smallest sizes)
+        :param size_name: name of the size parameter (e.g. 'n', 'm' or 'book')
+        :param description: optional one-line description
+        """
+        self.name = name
+        self.build = build
+        self.sizes = list(sizes)
+        self.quick_sizes = list(quick_sizes or self.sizes[:2])
+        self.size_name = size_name
+        self.description = description
+
+    def measure(self, size, repeat=3):
+        """ Times the operation at one size
+        :param size: problem size
+        :param repeat: number of timed runs (the fastest one is recorded)
+        :return: dict of benchmark, size, size_name, wall_time (seconds), peak_memory (bytes traced by tracemalloc
+            during one more run) and error (None without a reference)
+        """
+        operation, error = self.build(size)
+        # the first run warms up the caches and imports and gives the result whose error is recorded
+        result = operation()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            operation()
+            times.append(time.perf_counter() - start)
+        tracemalloc.start()
+        try:
+            operation()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return {'benchmark': self.name, 'size': size, 'size_name': self.size_name, 'wall_time': min(times),
+                'peak_memory': peak, 'error': None if error is None else float(error(result))}
+
+    def __repr__(self):
+        return "<Benchmark: %s over %s=%s>" % (self.name, self.size_name, self.sizes)
+
+
+def run(benchmarks=None, quick=False, repeat=3, log=None):
+    """ Runs benchmarks across their size sweeps
+    :param benchmarks: optional list of benchmark names (defaults to every benchmark in BENCHMARKS)
+    :param quick: boolean where True runs the quick (small) size sweeps
+    :param repeat: number of timed runs per size
+    :param log: optional function called with each record as it is measured
+    :return: list of records (see Benchmark.measure)
+    """
+    records = []
+    for name in benchmarks or list(BENCHMARKS):
+        benchmark = BENCHMARKS[name]
+        for size in benchmark.quick_sizes if quick else benchmark.sizes:
+            record = benchmark.measure(size, repeat=repeat)
+            records.append(record)
+            if log: log(record)
+    return records
+
+
+def save(records, path):
+    """ Writes records to a JSON baseline, along with the machine and library versions they were measured on """
+    document = {'machine': machine(), 'records': records}
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=1, sort_keys=True)
+
+
+def load(path):
+    """ Records of a JSON baseline written by save """
+    with open(path) as f:
+        return json.load(f)['records']
+
+
+def machine():
+    return {'date': datetime.datetime.now().isoformat(), 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'processor': platform.processor(),
+            'byteorder': sys.byteorder}
+
+
+def compare(records, baseline, time_tolerance=0.5, memory_tolerance=0.25, error_tolerance=0.1, min_time=1e-3):
+    """ Regressions of records against a baseline, matched on benchmark and size (sizes missing from either side are
+    skipped). Wall times are noisy, so they only count as a regression beyond both a relative tolerance and min_time.
+    :param records: list of records (see run)
+    :param baseline: list of baseline records (see load)
+    :param time_tolerance: relative increase in wall time allowed
+    :param memory_tolerance: relative increase in peak memory allowed
+    :param error_tolerance: relative increase in error against the reference allowed
+    :param min_time: absolute increase in wall time (seconds) below which no time regression is reported
+    :return: list of messages, one per regression (empty when there is none)
+    """
+    previous = dict(((r['benchmark'], r['size']), r) for r in baseline)
+    regressions = []
+    for record in records:
+        base = previous.get((record['benchmark'], record['size']))
+        if base is None:
+            continue
+        label = '%s %s=%s' % (record['benchmark'], record['size_name'], record['size'])
+        if record['wall_time'] > base['wall_time'] * (1 + time_tolerance) + min_time:
+            regressions.append('%s: wall time %.4gs, baseline %.4gs' % (label, record['wall_time'], base['wall_time']))
+        if record['peak_memory'] > base['peak_memory'] * (1 + memory_tolerance):
+            regressions.append('%s: peak memory %d bytes, baseline %d bytes' % (label, record['peak_memory'],
+                                                                                 base['peak_memory']))
+        if record['error'] is not None and base['error'] is not None and \
+                record['error'] > base['error'] * (1 + error_tolerance) + 1e-12:
+            regressions.append('%s: error %.3g, baseline %.3g' % (label, record['error'], base['error']))
+    return regressions
+
+
+def convergence(records):
+    """ Convergence-versus-cost curves of the benchmarks that have a reference
+    :param records: list of records (see run)
+    :return: OrderedDict of benchmark name to a list of (size, wall_time, error), in increasing size
+    """
+    curves = OrderedDict()
+    for record in records:
+        if record['error'] is not None:
+            curves.setdefault(record['benchmark'], []).append((record['size'], record['wall_time'], record['error']))
+    for name in curves:
+        curves[name].sort()
+    return curves
+
+
+def plot_convergence(records, path):
+    """ Saves a log-log plot of error against wall time for every benchmark with a reference (requires matplotlib) """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots(figsize=(8, 6))
+    for name, curve in convergence(records).items():
+        sizes, times, errors = zip(*curve)
+        ax.loglog(times, np.maximum(errors, 1e-16), marker='o', label=name)
+    ax.set_xlabel('wall time (s)')
+    ax.set_ylabel('absolute error against reference')
+    ax.grid(True, which='both', alpha=0.3)
+    ax.legend()
+    fig.savefig(path, bbox_inches='tight')
+    plt.close(fig)
+
+
+def _option(American=False):
+    underlying = Equity(ticker='BENCH', name='Benchmark', price=SPOT, vol=VOL, div=DIV)
+    maturity = datetime.date.today() + datetime.timedelta(days=int(round(365 * T)))
+    return Option(ticker='BENCH P44', name='Benchmark put', underlying=underlying, strike=STRIKE, rfr=RATE,
+                  maturity=maturity, call=False, American=American)
+
+
+def _reference(American):
+    """ Black-Scholes price of the put, or a 5000-step Leisen-Reimer lattice price of the American put (computed once)
+    """
+    if American not in _references:
+        if American:
+            option = _option(True)
+            _, slices = LatticeOptionPricer(n=5001, tree='lr').rollback(option, option.underlying, T, RATE)
+            _references[American] = float(slices[0][0])
+        else:
+            _references[American] = float(BlackScholesPricer().price_batch(SPOT, STRIKE, T, RATE, VOL, DIV, False))
+    return _references[American]
+
+
+def _book(size, seed=0):
+    """ Random book of options on the benchmark stock: strikes 70-130% of spot, one month to three years """
+    rng = np.random.default_rng(seed)
+    return (np.full(size, SPOT), SPOT * rng.uniform(0.7, 1.3, size), rng.uniform(1. / 12, 3., size),
+            np.full(size, RATE), rng.uniform(0.1, 0.5, size), np.full(size, DIV), rng.random(size) < 0.5)
+
+
+def _black_scholes(size):
+    S, K, T_, rfr, vol, div, call = _book(size)
+    pricer = BlackScholesPricer()
+
+    def operation():
+        return pricer.price_batch(S, K, T_, rfr, vol, div, call, greeks=True)
+
+    def error(result):
+        # put-call parity residual of the book, priced both ways
+        prices = result[0]
+        other = pricer.price_batch(S, K, T_, rfr, vol, div, ~call)
+        calls, puts = np.where(call, prices, other), np.where(call, other, prices)
+        return np.abs(calls - puts - S * np.exp(-div * T_) + K * np.exp(-rfr * T_)).max()
+    return operation, error
+
+
+def _lattice(American):
+    def build(size):
+        option = _option(American)
+        pricer = LatticeOptionPricer(n=size)
+
+        def operation():
+            return float(pricer.rollback(option, option.underlying, T, RATE)[1][0][0])
+        return operation, lambda value: abs(value - _reference(American))
+    return build
+
+
+def _lattice_book(size):
+    S, K, T_, rfr, vol, div, call = _book(size)
+    pricer = LatticeOptionPricer(n=100)
+    return lambda: pricer.price_batch(S, K, T_, rfr, vol, div, call, greeks=True, American=True), None
+
+
+def _monte_carlo(American, n):
+    def build(size):
+        option = _option(American)
+        pricer = MCOptionPricer(m=size, n=n, seed=1)
+
+        def operation():
+            option.calc_price(pricer)
+            return pricer.last_result['price']
+        return operation, lambda value: abs(value - _reference(American))
+    return build
+
+
+def _tree(size):
+    underlying = _option().underlying
+
+    def operation():
+        tree = TREES['crr'](underlying, T=T, num_nodes=size, rfr=RATE, vol=VOL)
+        tree.initialize()
+        return tree
+
+    def error(tree):
+        # the discounted risk-neutral expectation of the terminal prices is the spot less the dividends
+        values = tree.prices(size)
+        for step in range(size - 1, -1, -1):
+            values = tree.expect(values, step)
+        return abs(float(values[0]) - SPOT * np.exp(-DIV * T))
+    return operation, error
+
+
+def _paths(size):
+    underlying = _option().underlying
+    process = MonteCarlo(underlying, T, RATE, size, num_steps=10, seed=1)
+
+    def error(paths):
+        # relative error of the mean terminal price against the forward
+        return abs(paths[:, -1].mean() / (SPOT * np.exp((RATE - DIV) * T)) - 1)
+    return process.initialize, error
+
+
+def _dcf(size):
+    value_date = datetime.date.today()
+    pay_dates = [value_date + datetime.timedelta(days=int(91.3125 * (i + 1))) for i in range(40)]
+    cash_flows = np.full((size, 40), 1.25)
+    cash_flows[:, -1] += 100.
+    rate = 0.05
+    pricer = DCF()
+    times = np.array([(d - value_date).days / 365.25 for d in pay_dates])
+
+    def error(prices):
+        return np.abs(prices - np.dot(cash_flows, (1 + rate) ** -times)).max()
+    return lambda: pricer.price(value_date, cash_flows, pay_dates, rate), error
+
+
+def _lsm(size):
+    lsm = LSM([lambda x: x, lambda x: x**2, lambda x: x**3])
+    x = np.random.default_rng(2).uniform(0.5, 1.5, size)
+    # an exact cubic, so the regression recovers its coefficients up to rounding
+    coefficients = np.array([2., -0.5, 0.1, 1.])
+    y = np.dot(lsm.basis(x), coefficients)
+    return lambda: lsm.calc(y, x), lambda fitted: np.abs(fitted - coefficients).max()
+
+
+BENCHMARKS = OrderedDict((b.name, b) for b in [
+    Benchmark('BlackScholesPricer.price_batch', _black_scholes, [10**3, 10**4, 10**5, 10**6], size_name='book',
+              description='prices and greeks of a random book, error is the put-call parity residual'),
+    Benchmark('LatticeOptionPricer.european', _lattice(False), [25, 50, 100, 200, 400, 800, 1600],
+              [25, 50, 100], description='CRR lattice, error against Black-Scholes'),
+    Benchmark('LatticeOptionPricer.american', _lattice(True), [25, 50, 100, 200, 400, 800, 1600],
+              [25, 50, 100], description='CRR lattice, error against a 5001-step Leisen-Reimer lattice'),
+    Benchmark('LatticeOptionPricer.price_batch', _lattice_book, [100, 1000, 10000], size_name='book',
+              description='100-step American book with greeks'),
+    Benchmark('MCOptionPricer.european', _monte_carlo(False, 10), [2**12, 2**14, 2**16, 2**18, 2**20],
+              size_name='m', description='10 time steps, error against Black-Scholes'),
+    Benchmark('MCOptionPricer.american', _monte_carlo(True, 50), [2**12, 2**14, 2**16, 2**18],
+              size_name='m', description='Longstaff-Schwartz over 50 exercise dates, error against the lattice'),
+    Benchmark('Tree.initialize', _tree, [100, 400, 1600, 3200],
+              description='CRR tree, error of the discounted expected terminal price against the spot'),
+    Benchmark('MonteCarlo.initialize', _paths, [10**4, 10**5, 10**6], size_name='m',
+              description='10 time steps, relative error of the mean terminal price against the forward'),
+    Benchmark('DCF.price', _dcf, [10, 1000, 100000], size_name='book',
+              description='10-year quarterly bonds sharing one schedule, error against a direct sum'),
+    Benchmark('LSM.calc', _lsm, [10**4, 10**5, 10**6], size_name='samples',
+              description='cubic regression, error in the recovered coefficients'),
+])
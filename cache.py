@@ -0,0 +1,165 @@
+import datetime
+import hashlib
+import time
+import weakref
+from collections import OrderedDict
+import numpy as np
+
+# every live PricingCache, so that Asset.set_price, set_vol and set_dividend can invalidate them all
+_caches = weakref.WeakSet()
+
+
+class PricingCache(object):
+    """ LRU cache of pricing results, with an optional time-to-live. Results are keyed on a stable hash (SHA-1) of the
+    contract terms and features of the asset, the market data of its underlying (price, vol, dividend), the rate or
+    curve, the valuation date and the class and parameters of the pricer, so a result is only reused when every input
+    is unchanged. Asset.set_price, set_vol and set_dividend drop the entries of the asset from every cache.
+    """
+    excluded = ('pricer', 'last_result')
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        """
+        :param maxsize: maximum number of results held (least recently used results are evicted first)
+        :param ttl: optional time-to-live of a result in seconds
+        :param clock: function returning the current time in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._index = dict()
+        _caches.add(self)
+
+    def price(self, pricer, asset, underlying, rfr, greeks=False, valuation_date=None, **kwargs):
+        """ Returns the cached result of pricer.price for these inputs, pricing and storing it on a miss
+        :param pricer: Pricer instance
+        :param asset: asset to be priced
+        :param underlying: underlying asset
+        :param rfr: risk-free rate (float) or YieldCurve
+        :param greeks: boolean where True returns price and the greeks and false returns price.
+        :param valuation_date: optional valuation_date override (defaults to today, which is part of the key)
+        :param kwargs: any other keyword arguments of pricer.price (part of the key)
+        :return: price or (price & greeks), as returned by pricer.price
+        """
+        if not valuation_date: valuation_date = datetime.date.today()
+        key = self.key(pricer, asset, underlying, rfr, greeks, valuation_date, kwargs)
+        result = self.get(key)
+        if result is None:
+            result = pricer.price(asset, underlying, rfr, greeks=greeks, valuation_date=valuation_date, **kwargs)
+            self.put(key, result, assets=(asset, underlying))
+        return (result[0], dict(result[1])) if greeks else result
+
+    def get(self, key):
+        """ Cached result for key, or None on a miss (including an expired result) """
+        entry = self._entries.get(key)
+        if entry is not None and self.ttl is not None and self.clock() > entry[1]:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, result, assets=()):
+        """ Stores result under key
+        :param assets: assets whose market data the result depends on (invalidated by their setters)
+        """
+        if key in self._entries:
+            self._remove(key)
+        expires = self.clock() + self.ttl if self.ttl is not None else None
+        ids = tuple(set(id(a) for a in assets if a is not None))
+        self._entries[key] = (result, expires, ids)
+        for i in ids:
+            self._index.setdefault(i, set()).add(key)
+        while len(self._entries) > self.maxsize:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, asset):
+        """ Drops every result that depends on asset """
+        for key in list(self._index.get(id(asset), ())):
+            self._remove(key)
+
+    def clear(self):
+        self._entries.clear()
+        self._index.clear()
+
+    def stats(self):
+        """ dict of hits, misses, hit_rate, evictions (LRU) and size """
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': float(self.hits) / lookups if lookups else 0.,
+                'evictions': self.evictions, 'size': len(self._entries)}
+
+    def _remove(self, key):
+        _, _, ids = self._entries.pop(key)
+        for i in ids:
+            keys = self._index.get(i)
+            keys.discard(key)
+            if not keys:
+                del self._index[i]
+
+    @classmethod
+    def key(cls, *parts):
+        """ Stable hash of any mix of assets, pricers, curves, arrays, dates and plain values. Objects are hashed by
+        class and public attributes (recursively, including the __slots__ of slotted views such as OptionRow), not by
+        identity, so equal inputs give the same key in any process. Objects with no such state raise a TypeError
+        rather than falling back to their repr, which need not tell two different objects apart.
+        """
+        return hashlib.sha1(repr(cls.fingerprint(parts)).encode()).hexdigest()
+
+    @classmethod
+    def fingerprint(cls, obj, seen=None):
+        if seen is None: seen = set()
+        if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, datetime.date, datetime.timedelta)):
+            return obj
+        if isinstance(obj, np.generic):
+            return obj.item()
+        if isinstance(obj, np.ndarray):
+            return 'ndarray', obj.dtype.str, obj.shape, hashlib.sha1(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        if isinstance(obj, (list, tuple)):
+            return tuple(cls.fingerprint(x, seen) for x in obj)
+        if isinstance(obj, dict):
+            return tuple(sorted((repr(k), cls.fingerprint(v, seen)) for k, v in obj.items()))
+        if isinstance(obj, (set, frozenset)):
+            return 'set', tuple(sorted(repr(cls.fingerprint(x, seen)) for x in obj))
+        if isinstance(obj, type):
+            return 'type', obj.__module__, obj.__name__
+        if id(obj) in seen:
+            return 'ref', type(obj).__name__
+        if hasattr(obj, '__dict__'):
+            state = dict(vars(obj))
+        else:
+            slots = cls.slot_names(obj)
+            if not slots:
+                raise TypeError('PricingCache cannot fingerprint %s, which has no attributes or __slots__'
+                                % type(obj).__name__)
+            state = dict((name, getattr(obj, name, None)) for name in slots)
+        seen.add(id(obj))
+        state = dict((k, v) for k, v in state.items() if not k.startswith('_') and k not in cls.excluded)
+        return type(obj).__name__, cls.fingerprint(state, seen)
+
+    @staticmethod
+    def slot_names(obj):
+        """ Names of the __slots__ declared by the class of obj and its bases """
+        names = []
+        for klass in type(obj).__mro__:
+            slots = getattr(klass, '__slots__', ())
+            names.extend([slots] if isinstance(slots, str) else slots)
+        return names
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return "<PricingCache: %d/%d results>" % (len(self._entries), self.maxsize)
+
+
+def invalidate(asset):
+    """ Drops the results that depend on asset from every live PricingCache """
+    for cache in list(_caches):
+        cache.invalidate(asset)
@@ -0,0 +1 @@
+from .yieldcurve import YieldCurve, as_curve
@@ -0,0 +1,138 @@
+import numpy as np
+
+
+class YieldCurve(object):
+    """ Continuously-compounded term structure of interest rates built from pillar zero rates (or forward rates).
+    Discount factors between pillars are interpolated either log-linearly (piecewise-constant forwards) or with the
+    monotone-convex method of Hagan & West (2006), which gives continuous forwards without the overshoot of splines.
+    Every method takes whole arrays of times, so pricers can pull all the rates a lattice or simulation needs in a
+    single call. Beyond the last pillar the instantaneous forward rate is held flat.
+    """
+    INTERPOLATIONS = ('log_linear', 'monotone_convex')
+
+    def __init__(self, times, rates, forward=False, interpolation='log_linear'):
+        """
+        :param times: increasing array of pillar times (in years, > 0)
+        :param rates: array of continuously-compounded zero rates to each pillar, or of forward rates over the interval
+            ending at each pillar if forward is True
+        :param forward: boolean where True reads rates as forward rates
+        :param interpolation: 'log_linear' or 'monotone_convex'
+        """
+        try:
+            assert interpolation in self.INTERPOLATIONS
+        except AssertionError:
+            raise KeyError('interpolation must be one of %s' % ', '.join(self.INTERPOLATIONS))
+        times = np.atleast_1d(np.asarray(times, dtype=float))
+        rates = np.atleast_1d(np.asarray(rates, dtype=float))
+        if times.shape != rates.shape or times[0] <= 0 or (np.diff(times) <= 0).any():
+            raise ValueError('YieldCurve needs one rate per pillar and strictly increasing, positive pillar times')
+        self.times = times
+        self.interpolation = interpolation
+        self._spans = np.diff(times, prepend=0.)
+        # integral of the instantaneous forward rate from 0 to each pillar (= zero rate * time)
+        self._integral = np.cumsum(rates * self._spans) if forward else rates * times
+        self.zeros = self._integral / times
+        self.forwards = np.diff(self._integral, prepend=0.) / self._spans
+        self._nodes = self.instantaneous_nodes() if interpolation == 'monotone_convex' else None
+
+    @classmethod
+    def flat(cls, rate, interpolation='log_linear'):
+        """ Curve with the same continuously-compounded rate at every maturity """
+        return cls([1.], [rate], interpolation=interpolation)
+
+    def discount(self, t):
+        """ Discount factors to each time in t """
+        return np.exp(-self.integral(t))
+
+    def zero(self, t):
+        """ Continuously-compounded zero rates to each time in t (the short rate at t = 0) """
+        t = np.asarray(t, dtype=float)
+        short = self._nodes[0] if self._nodes is not None else self.forwards[0]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(t > 0, self.integral(t) / t, short)
+
+    def forward(self, start, end):
+        """ Continuously-compounded forward rates between each pair of start and end times """
+        start, end = np.asarray(start, dtype=float), np.asarray(end, dtype=float)
+        return (self.integral(end) - self.integral(start)) / (end - start)
+
+    def steps(self, n, dt):
+        """ Forward rates and one-step discount factors over n consecutive time steps of length dt starting today
+        :return: (array of n forward rates, array of n discount factors)
+        """
+        exponents = np.diff(self.integral(dt * np.arange(n + 1)))
+        return exponents / dt, np.exp(-exponents)
+
+    def shift(self, spread):
+        """ Curve with every zero (and forward) rate shifted by spread """
+        return YieldCurve(self.times, self.zeros + spread, interpolation=self.interpolation)
+
+    def integral(self, t):
+        """ Integral of the instantaneous forward rate from 0 to each time in t, i.e. -log of the discount factor """
+        t = np.asarray(t, dtype=float)
+        i = np.clip(np.searchsorted(self.times, t), 0, len(self.times) - 1)
+        start = np.r_[0., self.times][i]
+        base = np.r_[0., self._integral][i]
+        result = base + self.forwards[i] * (t - start)
+        if self._nodes is None:
+            return result
+        x = np.clip((t - start) / self._spans[i], 0., 1.)
+        fd = self.forwards[i]
+        result = result + self._spans[i] * self.monotone_convex(x, self._nodes[i] - fd, self._nodes[i + 1] - fd)
+        return np.where(t > self.times[-1], self._integral[-1] + self._nodes[-1] * (t - self.times[-1]), result)
+
+    def instantaneous_nodes(self):
+        """ Instantaneous forward rates at today and at each pillar (Hagan & West, 2006) """
+        if len(self.times) == 1:
+            return np.r_[self.forwards, self.forwards]
+        spans, fd = self._spans, self.forwards
+        interior = (spans[:-1] * fd[1:] + spans[1:] * fd[:-1]) / (spans[:-1] + spans[1:])
+        return np.r_[fd[0] - 0.5 * (interior[0] - fd[0]), interior, fd[-1] - 0.5 * (interior[-1] - fd[-1])]
+
+    @staticmethod
+    def monotone_convex(x, g0, g1):
+        """ Integral from 0 to x of the monotone-convex adjustment g to the discrete forward over one interval, where
+        g0 and g1 are the adjustments at the two ends of the interval (Hagan & West, 2006, section 4). The integral over
+        the whole interval is zero, so pillar discount factors are repriced exactly.
+        """
+        def cube(over, width):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return np.where(width != 0, np.maximum(over, 0.)**3 / width**2, 0.)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            eta3 = (g1 + 2 * g0) / (g1 - g0)
+            eta4 = 3 * g1 / (g1 - g0)
+            eta5 = g1 / (g0 + g1)
+            level = -g0 * g1 / (g0 + g1)
+        regions = [(g0 == 0) & (g1 == 0),
+                   ((g0 < 0) & (-0.5 * g0 <= g1) & (g1 <= -2 * g0)) | ((g0 > 0) & (-0.5 * g0 >= g1) & (g1 >= -2 * g0)),
+                   ((g0 < 0) & (g1 > -2 * g0)) | ((g0 > 0) & (g1 < -2 * g0)),
+                   ((g0 > 0) & (0 > g1) & (g1 > -0.5 * g0)) | ((g0 < 0) & (0 < g1) & (g1 < -0.5 * g0))]
+        integrals = [0.,
+                     g0 * (x - 2 * x**2 + x**3) + g1 * (x**3 - x**2),
+                     g0 * x + (g1 - g0) * cube(x - eta3, 1 - eta3) / 3,
+                     g1 * x + (g0 - g1) * (eta4 - cube(eta4 - x, eta4)) / 3]
+        # remaining region: g0 and g1 have the same sign, g dips to level between them
+        other = (level * x + (g0 - level) * (eta5 - cube(eta5 - x, eta5)) / 3 +
+                 (g1 - level) * cube(x - eta5, 1 - eta5) / 3)
+        return np.select(regions, integrals, np.nan_to_num(other))
+
+    def __eq__(self, other):
+        return isinstance(other, YieldCurve) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def _key(self):
+        return self.interpolation, self.times.tobytes(), self.zeros.tobytes()
+
+    def __repr__(self):
+        return "<YieldCurve: %d pillars, %s>" % (len(self.times), self.interpolation)
+
+
+def as_curve(rfr):
+    """ Returns rfr unchanged if it is already a YieldCurve, otherwise a flat curve at the (float) rate rfr """
+    return rfr if isinstance(rfr, YieldCurve) else YieldCurve.flat(rfr)
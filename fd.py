@@ -11,35 +11,151 @@ __author__ = 'exley'
 """
 
 import numpy as np
+from scipy.linalg import solve_banded
+
+from .curves import as_curve
 
 
 class FiniteDifference(object):
+    """ Crank-Nicolson solver for the Black-Scholes PDE on a (possibly non-uniform) grid of stock prices. Each time step
+    is a single tridiagonal (banded) solve, so a step costs O(M) for M price nodes. Early exercise is handled with the
+    penalty method of Forsyth & Vetzal, which only adds a diagonal term and keeps every solve tridiagonal.
+    """
     def __init__(self, Asset, T, dt=1/252., s0=None, vol=None, rfr=None):
+        """
+        :param Asset: underlying asset whose price follows the PDE
+        :param T: time to maturity of the derivative
+        :param dt: time step between columns of the lattice
+        :param s0: optional spot override (defaults to Asset.price)
+        :param vol: optional volatility override (defaults to Asset.vol)
+        :param rfr: continuously-compounded risk-free rate (float) or YieldCurve
+        """
         self.Asset = Asset
         self.T = T
         self.dt = dt
-        self.num_nodes = int(np.floor(float(T) / float(dt)))
-        self.vol = vol
-        self.rfr = rfr
-
-    # TODO: Figure out how this is done in a properly calibrated FD model.
-    def initialize(self, M=100, N=None, dS=0.05):
-        """ Initialize creates a rectangular lattice of M*N nodes, where rows represent
-            a stock level and columns represent a point in time.
-            :param M:   <int>   Number of rows in lattice
-            :param N:   <int>   Number of columns in lattice, will default to T / dt
-            :param dS:  <float> Size of stock jump between nodes as % of stock price.
+        self.num_nodes = max(int(np.floor(float(T) / float(dt))), 1)
+        self.s0 = s0 or Asset.price
+        self.vol = vol or Asset.vol
+        self.div = Asset.div or 0.
+        self.curve = as_curve(rfr or 0.)
+        self.rfr = float(self.curve.zero(T))
+        self.forwards = None
+        self.prices = None
+        self.values = None
+        self.previous = None
+
+    def initialize(self, M=100, N=None, centre=None, concentration=0.1, width=5.):
+        """ Initialize creates the grid of M stock prices, concentrated around centre with a sinh transform, and the
+            N time steps between now and T.
+            :param M:   <int>   Number of rows (stock prices) in lattice
+            :param N:   <int>   Number of columns (time steps) in lattice, will default to T / dt
+            :param centre:  <float> Stock price the grid is concentrated around (usually the strike); defaults to s0
+            :param concentration:   <float> Width of the concentrated region as a fraction of centre. Smaller values
+                                            pack more nodes near centre; None gives a uniform grid.
+            :param width:   <float> Number of standard deviations (of log-price at T) covered above the spot
         """
         if not N:
             N = self.num_nodes
-        self.lattice = np.zeros((M, N))
-        self.prices = None
+        self.num_nodes = N
+        self.dt = float(self.T) / N
+        self.forwards = self.curve.steps(N, self.dt)[0]
+        centre = centre or self.s0
+        upper = max(self.s0, centre) * np.exp(width * self.vol * np.sqrt(self.T))
+        if concentration:
+            scale = concentration * centre
+            grid = np.linspace(np.arcsinh(-centre / scale), np.arcsinh((upper - centre) / scale), M)
+            self.prices = centre + scale * np.sinh(grid)
+            self.prices[0] = 0.
+        else:
+            self.prices = np.linspace(0., upper, M)
 
-        # TODO: create array of stock prices and array of future dates
-        # TODO: define boundary conditions for lattice
-        # TODO: populate interior nodes
-        
-        
+    def operator(self, rate=None):
+        """ Tridiagonal discretisation of L = 0.5 vol^2 S^2 d2/dS2 + (r - q) S d/dS - r on the non-uniform grid. S = 0
+        is an exact boundary (dV/dt = rV) and the top row assumes the value is linear in S.
+        :param rate: risk-free rate r (defaults to the zero rate to T)
+        :return: (lower, diagonal, upper) coefficient arrays of length M; lower[i] multiplies V[i-1], upper[i] V[i+1]
+        """
+        if rate is None: rate = self.rfr
+        S = self.prices
+        lower, diag, upper = np.zeros(len(S)), np.zeros(len(S)), np.zeros(len(S))
+        h_down, h_up = S[1:-1] - S[:-2], S[2:] - S[1:-1]
+        diffusion = self.vol**2 * S[1:-1]**2
+        drift = (rate - self.div) * S[1:-1]
+        lower[1:-1] = (diffusion - drift * h_up) / (h_down * (h_down + h_up))
+        upper[1:-1] = (diffusion + drift * h_down) / (h_up * (h_down + h_up))
+        diag[1:-1] = (-diffusion + drift * (h_up - h_down)) / (h_down * h_up) - rate
+        top_drift = (rate - self.div) * S[-1] / (S[-1] - S[-2])
+        lower[-1] = -top_drift
+        diag[0] = -rate
+        diag[-1] = top_drift - rate
+        return lower, diag, upper
 
+    def solve(self, payoff, exercise=None, rannacher=2, penalty=1e8, max_iter=50):
+        """ Rolls the terminal payoff back to today
+        :param payoff: array of values at maturity on the price grid
+        :param exercise: optional array of early-exercise values on the price grid (American features)
+        :param rannacher: number of initial fully-implicit steps, which damp the oscillations a kinked payoff causes
+            in Crank-Nicolson gamma
+        :param penalty: penalty factor enforcing V >= exercise
+        :param max_iter: maximum number of penalty iterations per time step
+        :return: array of values today on the price grid
+        """
+        values = np.asarray(payoff, dtype=float)
+        rate = None
+        for step in range(self.num_nodes):
+            # rolling back from maturity, so step 0 covers the last time step of the forward curve
+            if self.forwards[-1 - step] != rate:
+                rate = self.forwards[-1 - step]
+                lower, diag, upper = self.operator(rate)
+            theta = 1. if step < rannacher else 0.5
+            explicit = values + (1 - theta) * self.dt * self.apply(lower, diag, upper, values)
+            banded = np.vstack([np.r_[0., -theta * self.dt * upper[:-1]],
+                                1 - theta * self.dt * diag,
+                                np.r_[-theta * self.dt * lower[1:], 0.]])
+            self.previous = values
+            if exercise is None:
+                values = solve_banded((1, 1), banded, explicit)
+            else:
+                values = self.penalized(banded, explicit, exercise, values < exercise, penalty, max_iter)
+        self.values = values
+        return values
 
+    @staticmethod
+    def apply(lower, diag, upper, values):
+        """ Multiplies a vector by the tridiagonal operator """
+        result = diag * values
+        result[1:] += lower[1:] * values[:-1]
+        result[:-1] += upper[:-1] * values[1:]
+        return result
 
+    @staticmethod
+    def penalized(banded, rhs, exercise, active, penalty, max_iter):
+        """ Penalty iteration for max(V, exercise): nodes where V < exercise get a large diagonal term pulling them
+        onto the exercise value. The active set usually settles in one to three banded solves.
+        """
+        for _ in range(max_iter):
+            weights = penalty * active
+            system = banded.copy()
+            system[1] += weights
+            values = solve_banded((1, 1), system, rhs + weights * exercise)
+            updated = values < exercise
+            if np.array_equal(updated, active):
+                break
+            active = updated
+        return values
+
+    def interpolate(self, values, S=None):
+        """ Value, delta and gamma at S from the quadratic through the three grid nodes nearest to S
+        :param values: array of values on the price grid
+        :param S: stock price (defaults to s0)
+        :return: (value, delta, gamma)
+        """
+        S = S or self.s0
+        i = int(np.clip(np.searchsorted(self.prices, S), 1, len(self.prices) - 2))
+        x0, x1, x2 = self.prices[i - 1:i + 2]
+        v0, v1, v2 = values[i - 1:i + 2]
+        d01, d12 = (v1 - v0) / (x1 - x0), (v2 - v1) / (x2 - x1)
+        gamma = 2 * (d12 - d01) / (x2 - x0)
+        delta = d01 + 0.5 * gamma * (2 * S - x0 - x1)
+        value = v0 + d01 * (S - x0) + 0.5 * gamma * (S - x0) * (S - x1)
+        return value, delta, gamma
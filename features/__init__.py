@@ -0,0 +1 @@
+from .standard import Feature, EEPenalty
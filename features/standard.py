@@ -0,0 +1,46 @@
+import numpy as np
+
+
+class Feature(object):
+    """ Embedded feature of a derivative: a contractual term that changes the relationship between the derivative and
+    its underlying. Features are attached with Asset.add_feature under their code, and modify the payoffs that pricers
+    read from the asset (for now, the early-exercise value of Derivative.exercise_value).
+    """
+    code = None
+
+    def exercise_value(self, asset, price, value):
+        """ Adjusts the early-exercise value of asset at the given underlying prices
+        :param asset: derivative the feature is attached to
+        :param price: underlying price (float or ndarray)
+        :param value: early-exercise value before this feature (same shape as price)
+        :return: early-exercise value after this feature (features without an exercise term return value unchanged)
+        """
+        return value
+
+    def __repr__(self):
+        return "<%s>" % self.__class__.__name__
+
+
+class EEPenalty(Feature):
+    """ Early-conversion penalty of a mandatory convertible. Below the upper strike (k2) a holder converting early
+    receives ratio shares (typically the minimum ratio r2) less a make-whole penalty instead of the maturity payoff;
+    above k2 the conversion ratio is r2 whether or not the holder converts early.
+    """
+    code = 'EEPenalty'
+
+    def __init__(self, ratio, penalty=0.):
+        """
+        :param ratio: number of shares received on early conversion
+        :param penalty: cash amount deducted from the shares' value on early conversion
+        """
+        self.ratio = ratio
+        self.penalty = penalty
+
+    def parity(self, price):
+        return np.maximum(self.ratio * np.asarray(price, dtype=float) - self.penalty, 0.)
+
+    def exercise_value(self, asset, price, value):
+        return np.where(np.asarray(price) < asset.k2, self.parity(price), value)
+
+    def __repr__(self):
+        return "<EEPenalty: ratio=%s, penalty=%s>" % (self.ratio, self.penalty)
@@ -16,6 +16,7 @@ class Pricer(object):
     def __repr__(self):
         return "<Pricer>"
 
-from .numerical import LatticeOptionPricer, MCOptionPricer
+from .numerical import LatticeOptionPricer, MCOptionPricer, FDOptionPricer
 from .analytic import BlackScholesPricer, DCF
-
+from .implied import ImpliedVolSolver
+from .scenarios import ScenarioEngine, ScenarioCube
@@ -1,11 +1,11 @@
 
 import datetime
 import numpy as np
-import scipy.stats as stats
+from scipy.special import ndtr
 
 from . import Pricer
+from ..curves import YieldCurve
 from .numerical import DCF
-from ..assets.standard import Option
 
 
 class BlackScholesPricer(Pricer):
@@ -16,11 +16,12 @@ class BlackScholesPricer(Pricer):
         """
         :param asset: derivative asset to be priced with lattice model
         :param underlying: underlying asset upon which the derivative is based
-        :param rfr: currently a float. this needs to become a class that can handle forward curves, get data, etc
+        :param rfr: continuously-compounded risk-free rate (float) or YieldCurve, in which case the zero rate to
+            maturity is used (rho is then the sensitivity to a parallel shift of the curve)
         :param greeks: boolean where True returns price and the greeks and false returns price.
         :param save: to be implemented later; boolean where True saves to a database.
         :param valuation_date: optional valuation_date override
-        :return:
+        :return: price rounded to 3 decimals
         """
         # Check that asset is European
         if asset.American: raise TypeError('You cannot use Black-Scholes Pricers on American Options')
@@ -29,18 +30,73 @@ class BlackScholesPricer(Pricer):
         if not vol: vol = underlying.vol
         if not valuation_date: valuation_date = datetime.date.today()
 
-        # Calculate time to maturity (T), d1, and d2
+        # Calculate time to maturity (T) and price through the vectorized kernel
         T = (asset.maturity - valuation_date).days / 365.
-        d1 = self.d1(underlying.price, asset.strike, T, rfr, vol)
+        if isinstance(rfr, YieldCurve): rfr = rfr.zero(T)
+        result = self.price_batch(underlying.price, asset.strike, T, rfr, vol, underlying.div or 0., asset.call,
+                                  greeks=greeks)
+        if greeks:
+            value, greek = result
+            return round(float(value), 3), dict((k, float(v)) for k, v in greek.items())
+        return round(float(result), 3)
+
+    def price_batch(self, S, K, T, rfr, vol, div=0., call=True, greeks=False, American=False):
+        """ Price a whole book of European options in a single vectorized pass. All inputs are broadcast against
+        each other, so scalars can be mixed with aligned arrays (e.g. one spot for a strip of strikes).
+        :param S: array of underlying prices
+        :param K: array of strikes
+        :param T: array of times to maturity (in years)
+        :param rfr: array of continuously-compounded risk-free rates, or a YieldCurve (zero rates to each T)
+        :param vol: array of volatilities
+        :param div: array of continuous dividend yields (defaults to 0)
+        :param call: boolean array where True is a call and False is a put
+        :param greeks: boolean where True also returns a dict of greek arrays (see BlackScholesPricer.greeks)
+        :param American: boolean array of early-exercise flags, which must all be False
+        :return: unrounded array of prices or (prices, greeks)
+        """
+        if np.any(American): raise TypeError('You cannot use Black-Scholes Pricers on American Options')
+        if isinstance(rfr, YieldCurve): rfr = rfr.zero(T)
+        S, K, T, rfr, vol, div, call = np.broadcast_arrays(*[np.asarray(x, dtype=float) for x in
+                                                             (S, K, T, rfr, vol, div)] + [np.asarray(call, bool)])
+        terms = self._terms(S, K, T, rfr, vol, div, call)
+        prices = terms['sign'] * (S * terms['df_q'] * terms['n_d1'] - K * terms['df_r'] * terms['n_d2'])
+        if greeks:
+            return prices, self.greeks(S, K, T, rfr, vol, div, terms)
+        return prices
+
+    def _terms(self, S, K, T, rfr, vol, div, call):
+        """ Intermediate terms shared by the price and every greek, so a full greek set costs one extra pdf """
+        sign = np.where(call, 1., -1.)
+        sqrt_t = np.sqrt(T)
+        d1 = self.d1(S, K, T, rfr - div, vol)
         d2 = self.d2(d1, vol, T)
-
-        # Return Call or Put Option price
-        if asset.call:
-            return round(stats.norm.cdf(d1) * underlying.price -
-                         stats.norm.cdf(d2) * asset.strike * np.exp(-rfr * T), 3)
-        else:
-            return round(stats.norm.cdf(-d2) * asset.strike * np.exp(-rfr * T) -
-                         stats.norm.cdf(-d1) * underlying.price, 3)
+        return {'sign': sign,
+                'sqrt_t': sqrt_t,
+                'd1': d1,
+                'd2': d2,
+                'n_d1': ndtr(sign * d1),
+                'n_d2': ndtr(sign * d2),
+                'df_r': np.exp(-rfr * T),
+                'df_q': np.exp(-div * T)}
+
+    @staticmethod
+    def greeks(S, K, T, rfr, vol, div, terms):
+        """ Closed-form sensitivities built from the terms already computed for the price.
+        :param terms: dict returned by BlackScholesPricer._terms for the same inputs
+        :return: dict of arrays: delta, gamma, vega (per 1.00 of vol), theta (per year), rho (per 1.00 of rate) and
+            div_rho (per 1.00 of dividend yield)
+        """
+        sign, sqrt_t = terms['sign'], terms['sqrt_t']
+        spot_leg = S * terms['df_q']
+        strike_leg = K * terms['df_r']
+        pdf_leg = spot_leg * np.exp(-0.5 * terms['d1']**2) / np.sqrt(2 * np.pi)
+        return {'delta': sign * terms['df_q'] * terms['n_d1'],
+                'gamma': pdf_leg / (S * S * vol * sqrt_t),
+                'vega': pdf_leg * sqrt_t,
+                'theta': -pdf_leg * vol / (2 * sqrt_t) + sign * (div * spot_leg * terms['n_d1'] -
+                                                                 rfr * strike_leg * terms['n_d2']),
+                'rho': sign * T * strike_leg * terms['n_d2'],
+                'div_rho': -sign * T * spot_leg * terms['n_d1']}
 
     def d1(self, S, K, T, rfr, vol):
         return (1 / (vol * np.sqrt(T))) * (np.log(S / K) + (rfr + 0.5 * vol**2) * T)
@@ -50,39 +106,113 @@ class BlackScholesPricer(Pricer):
 
 
 class BlackScholesMandyPricer(Pricer):
-    """ Prices Mandatory convertible as a basket of two options and a fixed-income cash flow """
+    """ Prices European mandatory convertibles as a portfolio of a zero-coupon par amount, r2 calls struck at k2, minus
+    r1 puts struck at k1, plus the coupon stream:
+
+        V = par * exp(-rT) + r2 * C(k2) - r1 * P(k1) + PV(coupons)
+
+    price_portfolio values many mandatories at once: both option legs of every mandatory go through a single batched
+    Black-Scholes pass, and the coupon streams are discounted as one cash flow matrix on their merged pay dates.
+    """
     def __init__(self):
         super(BlackScholesMandyPricer, self).__init__()
 
     def price(self, asset, underlying, rfr, spread=None, vol=None, greeks=False, save=False, valuation_date=None):
-        if not spread:
+        """
+        :param asset: Mandatory instance (European)
+        :param underlying: underlying equity of the mandatory
+        :param rfr: continuously-compounded risk-free rate (float) or YieldCurve
+        :param spread: optional credit spread override used to discount the coupons (defaults to asset.spread)
+        :param vol: optional volatility override (defaults to underlying.vol)
+        :param greeks: boolean where True returns price and the greeks and false returns price.
+        :param save: to be implemented later; boolean where True saves to a database.
+        :param valuation_date: optional valuation_date override
+        :return: price rounded to 3 decimals, or (price, greeks)
+        """
+        result = self.price_portfolio([asset], rfr=rfr, spread=spread, vol=vol, underlyings=[underlying],
+                                      greeks=greeks, valuation_date=valuation_date)
+        if greeks:
+            value, greek = result
+            return round(float(value[0]), 3), dict((k, float(v[0])) for k, v in greek.items())
+        return round(float(result[0]), 3)
+
+    def price_portfolio(self, assets, rfr=None, spread=None, vol=None, underlyings=None, greeks=False,
+                        valuation_date=None):
+        """ Prices a list of European mandatories in one vectorized pass
+        :param assets: sequence of Mandatory instances
+        :param rfr: optional risk-free rate (float or YieldCurve) for every mandatory (defaults to each asset.rfr)
+        :param spread: optional credit spread for every mandatory (defaults to each asset.spread); coupons are
+            discounted continuously at rfr + spread (a YieldCurve's zero rates plus the spread)
+        :param vol: optional volatility override for every mandatory (defaults to each underlying's vol)
+        :param underlyings: optional underlyings aligned with assets (defaults to each asset.underlying)
+        :param greeks: boolean where True also returns a dict of greek arrays (delta, gamma, vega, theta, rho and
+            div_rho, combining both option legs, the par amount and the coupons)
+        :param valuation_date: optional valuation_date override
+        :return: unrounded array of prices or (prices, greeks)
+        """
+        if any(a.American for a in assets):
+            raise TypeError('You cannot use Black-Scholes Pricers on American Mandatories')
+        if not valuation_date: valuation_date = datetime.date.today()
+        if underlyings is None: underlyings = [a.underlying for a in assets]
+        rates = [a.rfr if rfr is None else rfr for a in assets]
+        spreads = np.array([self.credit_spread(a, spread) for a in assets], dtype=float)
+        S = np.array([u.price for u in underlyings], dtype=float)
+        sigma = np.array([vol or u.vol for u in underlyings], dtype=float)
+        div = np.array([u.div or 0. for u in underlyings], dtype=float)
+        T = np.array([(a.maturity - valuation_date).days for a in assets]) / 365.
+        zero = np.array([r.zero(t) if isinstance(r, YieldCurve) else r for r, t in zip(rates, T)], dtype=float)
+        par = np.array([a.par for a in assets], dtype=float)
+        # upside calls on k2 and downside puts on k1 of every mandatory in a single Black-Scholes pass
+        strikes = np.concatenate([[a.k2 for a in assets], [a.k1 for a in assets]])
+        weights = np.concatenate([[a.r2 for a in assets], [-a.r1 for a in assets]])
+        call = np.repeat([True, False], len(assets))
+        legs = BlackScholesPricer().price_batch(np.tile(S, 2), strikes, np.tile(T, 2), np.tile(zero, 2),
+                                                np.tile(sigma, 2), np.tile(div, 2), call, greeks=greeks)
+        legs, leg_greeks = legs if greeks else (legs, None)
+        bond = par * np.exp(-zero * T)
+        coupons, coupon_rho, coupon_theta = self.coupon_leg(assets, rates, spreads, valuation_date)
+        prices = bond + self.combine(weights * legs) + coupons
+        if not greeks:
+            return prices
+        greek = dict((k, self.combine(weights * v)) for k, v in leg_greeks.items())
+        greek['theta'] += zero * bond + coupon_theta
+        greek['rho'] += coupon_rho - T * bond
+        return prices, greek
+
+    @staticmethod
+    def combine(values):
+        """ Sums the call leg (first half) and put leg (second half) of each mandatory """
+        half = len(values) // 2
+        return values[:half] + values[half:]
+
+    @staticmethod
+    def credit_spread(asset, spread=None):
+        if spread is None: spread = asset.spread
+        if spread is None:
             try:
-                assert asset.spread
+                assert not asset.coupons
             except AssertionError:
                 raise ValueError('Must pass spread argument of type float if Mandatory.spread is undefined')
-            spread = asset.spread
-
-        if not valuation_date:
-            valuation_date = datetime.date.today()
-
-        upside_option = Option('Upside', 'Mandy Upside Option',
-                               underlying=underlying,
-                               strike=asset.k2,
-                               rfr=rfr,
-                               maturity=asset.maturity,
-                               call=True,
-                               American=False)
-        downside_option = Option('Downside', 'Mandy Downside Option',
-                                 underlying=underlying,
-                                 strike=asset.k1,
-                                 maturity=asset.maturity,
-                                 call=False,
-                                 American=False)
-
-        upside_price, upside_greeks = upside_option.calc_price(BlackScholesPricer, greeks=greeks)
-        downside_price, downside_greeks = downside_option.calc_price(BlackScholesPricer, greeks=greeks)
-        coupon_value = DCF().price(valuation_date, asset.coupons, asset.pay_dates, spread + rfr)
-        greek = None
-        if greeks:
-            greek = {}
-        return upside_price + downside_price + coupon_value + asset.par, greek
+            spread = 0.
+        return spread
+
+    @staticmethod
+    def coupon_leg(assets, rates, spreads, valuation_date):
+        """ Present value of the remaining coupons of every mandatory, with its rate and time sensitivities
+        :return: (present values, rho per 1.00 of rate, theta per year) arrays aligned with assets
+        """
+        matrix, schedule = DCF.schedule_matrix([a.coupons for a in assets], [a.pay_dates for a in assets])
+        times = DCF.year_fractions(valuation_date, schedule)
+        matrix = np.where(times > 0, matrix, 0.)
+        # continuously-compounded zero rates to each pay date: flat rates for every row at once, then the curve rows
+        zeros = np.repeat(np.array([0. if isinstance(rate, YieldCurve) else rate for rate in rates],
+                                   dtype=float)[:, np.newaxis], len(times), axis=1)
+        for i, rate in enumerate(rates):
+            if isinstance(rate, YieldCurve): zeros[i] = rate.zero(times)
+        # d(log factor)/d(valuation time) of each cash flow; d(log factor)/d(rate) is -times
+        carry = zeros + spreads[:, np.newaxis]
+        values = matrix * np.exp(-carry * times)
+        return values.sum(axis=1), -(values * times).sum(axis=1), (values * carry).sum(axis=1)
+
+    def __repr__(self):
+        return "<BlackScholesMandyPricer>"
@@ -0,0 +1,173 @@
+import numpy as np
+
+from ..curves import YieldCurve
+from .analytic import BlackScholesPricer
+
+
+class ImpliedVolSolver(object):
+    """ Vectorized implied volatility. European quotes are inverted against Black-Scholes for the whole quote array at
+    once: a rational (Corrado-Miller) initial guess followed by Halley iterations with analytic vega and volga, kept
+    inside a per-quote bracket and falling back to bisection when a step leaves it. American quotes are inverted
+    against the batched lattice of a LatticeOptionPricer with a bracketed Illinois (modified regula falsi) search,
+    warm-started from the European implied vol of the same quote, which is an upper bound on the American one.
+    Only the quotes that have not converged are repriced at each iteration.
+    """
+    def __init__(self, lattice=None, tol=1e-8, max_iter=100, vol_bounds=(1e-4, 5.)):
+        """
+        :param lattice: LatticeOptionPricer, required to invert American quotes
+        :param tol: price tolerance (absolute, in currency units) for a quote to be flagged as converged
+        :param max_iter: maximum number of iterations
+        :param vol_bounds: (lowest, highest) volatility searched
+        """
+        self.lattice = lattice
+        self.tol = tol
+        self.max_iter = max_iter
+        self.vol_bounds = vol_bounds
+        self.black_scholes = BlackScholesPricer()
+
+    def solve(self, price, S, K, T, rfr, div=0., call=True, American=False):
+        """ Implied volatilities of a book of option quotes. All inputs are broadcast against each other.
+        :param price: array of option prices
+        :param S: array of underlying prices
+        :param K: array of strikes
+        :param T: array of times to maturity (in years)
+        :param rfr: array of continuously-compounded risk-free rates, or a YieldCurve (zero rates to each T)
+        :param div: array of continuous dividend yields (defaults to 0)
+        :param call: boolean array where True is a call and False is a put
+        :param American: boolean array where True inverts the quote against the lattice
+        :return: dict of arrays: vol (NaN where the quote has no implied vol within vol_bounds), converged (boolean),
+            iterations and residual (model price minus quote)
+        """
+        if isinstance(rfr, YieldCurve): rfr = rfr.zero(T)
+        price, S, K, T, rfr, div, call, American = np.broadcast_arrays(
+            *[np.asarray(x, dtype=float) for x in (price, S, K, T, rfr, div)] +
+            [np.asarray(call, bool), np.asarray(American, bool)])
+        shape = price.shape
+        args = [np.ravel(x) for x in (price, S, K, T, rfr, div, call)]
+        result = self.european(*args)
+        american = np.ravel(American)
+        if american.any():
+            if self.lattice is None:
+                raise ValueError('A LatticeOptionPricer is required to invert American quotes')
+            rows = np.flatnonzero(american)
+            upper = result['vol'][rows]
+            sub = self.american(*[x[rows] for x in args], guess=upper)
+            for k, v in sub.items():
+                result[k][rows] = v
+        return dict((k, v.reshape(shape)) for k, v in result.items())
+
+    def european(self, price, S, K, T, rfr, div, call):
+        """ Black-Scholes implied vols of 1-d quote arrays (see ImpliedVolSolver.solve) """
+        lowest, highest = self.vol_bounds
+        lo, hi = np.full(len(price), lowest), np.full(len(price), highest)
+        vol = np.clip(self.initial_guess(price, S, K, T, rfr, div, call), lowest, highest)
+        residual = np.full(len(price), np.nan)
+        iterations = np.zeros(len(price), dtype=int)
+        converged = np.zeros(len(price), dtype=bool)
+        # quotes outside the no-arbitrage bounds have no implied vol
+        lower, upper = self.bounds(S, K, T, rfr, div, call)
+        active = np.flatnonzero((price > lower) & (price < upper))
+        for _ in range(self.max_iter):
+            if not len(active):
+                break
+            a = [x[active] for x in (S, K, T, rfr, div, call)]
+            sigma = vol[active]
+            model, greek = self.black_scholes.price_batch(a[0], a[1], a[2], a[3], sigma, a[4], a[5], greeks=True)
+            f = model - price[active]
+            residual[active] = f
+            iterations[active] += 1
+            done = np.abs(f) < self.tol
+            converged[active[done]] = True
+            # the price increases with vol, so each evaluation tightens the bracket
+            hi[active] = np.where(f > 0, sigma, hi[active])
+            lo[active] = np.where(f < 0, sigma, lo[active])
+            vega = greek['vega']
+            d1 = self.black_scholes.d1(a[0], a[1], a[2], a[3] - a[4], sigma)
+            volga = vega * d1 * self.black_scholes.d2(d1, sigma, a[2]) / sigma
+            with np.errstate(divide='ignore', invalid='ignore'):
+                newton = f / vega
+                step = newton / (1 - 0.5 * newton * volga / vega)
+            new = sigma - step
+            inside = np.isfinite(new) & (new > lo[active]) & (new < hi[active])
+            vol[active] = np.where(inside, new, 0.5 * (lo[active] + hi[active]))
+            vol[active[done]] = sigma[done]
+            active = active[~done]
+        vol[~converged & ~np.isfinite(residual)] = np.nan
+        return {'vol': vol, 'converged': converged, 'iterations': iterations, 'residual': residual}
+
+    def american(self, price, S, K, T, rfr, div, call, guess=None):
+        """ Lattice implied vols of 1-d American quote arrays, warm-started from guess (e.g. the European implied vols
+        of the same quotes, which bound the American implied vols from above)
+        """
+        lowest, highest = self.vol_bounds
+        count = len(price)
+        iterations = np.zeros(count, dtype=int)
+        converged = np.zeros(count, dtype=bool)
+        args = (S, K, T, rfr, div, call)
+
+        def error(rows, sigma):
+            iterations[rows] += 1
+            return self.lattice.price_batch(*[x[rows] for x in args[:4]] + [sigma, div[rows], call[rows]],
+                                            American=True) - price[rows]
+
+        hi = np.where(np.isfinite(guess), guess, highest) if guess is not None else np.full(count, highest)
+        hi = np.clip(hi, lowest, highest)
+        everything = np.arange(count)
+        f_hi = error(everything, hi)
+        # push the upper end up until it prices above the quote (a lattice can price a little below Black-Scholes)
+        rows = np.flatnonzero((f_hi < 0) & (hi < highest))
+        while len(rows):
+            hi[rows] = np.minimum(1.5 * hi[rows] + 0.01, highest)
+            f_hi[rows] = error(rows, hi[rows])
+            rows = rows[(f_hi[rows] < 0) & (hi[rows] < highest)]
+        lo = np.maximum(0.8 * hi, lowest)
+        f_lo = error(everything, lo)
+        rows = np.flatnonzero((f_lo > 0) & (lo > lowest))
+        while len(rows):
+            hi[rows], f_hi[rows] = lo[rows], f_lo[rows]
+            lo[rows] = np.maximum(0.5 * lo[rows], lowest)
+            f_lo[rows] = error(rows, lo[rows])
+            rows = rows[(f_lo[rows] > 0) & (lo[rows] > lowest)]
+        vol = np.where(np.abs(f_lo) < np.abs(f_hi), lo, hi)
+        residual = np.where(np.abs(f_lo) < np.abs(f_hi), f_lo, f_hi)
+        converged[:] = np.abs(residual) < self.tol
+        bracketed = (f_lo <= 0) & (f_hi >= 0)
+        active = np.flatnonzero(bracketed & ~converged)
+        side = np.zeros(count, dtype=int)
+        while len(active) and iterations[active].max() < self.max_iter:
+            a_lo, a_hi, a_flo, a_fhi = lo[active], hi[active], f_lo[active], f_hi[active]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                sigma = a_hi - a_fhi * (a_hi - a_lo) / (a_fhi - a_flo)
+            sigma = np.where(np.isfinite(sigma) & (sigma > a_lo) & (sigma < a_hi), sigma, 0.5 * (a_lo + a_hi))
+            f = error(active, sigma)
+            vol[active], residual[active] = sigma, f
+            above = f > 0
+            # Illinois: halve the function value of an end point that is kept twice in a row
+            f_lo[active] = np.where(above, np.where(side[active] == 1, 0.5 * a_flo, a_flo), f)
+            f_hi[active] = np.where(above, f, np.where(side[active] == -1, 0.5 * a_fhi, a_fhi))
+            lo[active] = np.where(above, a_lo, sigma)
+            hi[active] = np.where(above, sigma, a_hi)
+            side[active] = np.where(above, 1, -1)
+            done = (np.abs(f) < self.tol) | (hi[active] - lo[active] < 1e-12)
+            converged[active[done]] = np.abs(f[done]) < self.tol
+            active = active[~done]
+        vol[~bracketed] = np.nan
+        return {'vol': vol, 'converged': converged, 'iterations': iterations, 'residual': residual}
+
+    @staticmethod
+    def bounds(S, K, T, rfr, div, call):
+        """ No-arbitrage (lower, upper) bounds of European option prices """
+        spot, strike = S * np.exp(-div * T), K * np.exp(-rfr * T)
+        lower = np.maximum(np.where(call, spot - strike, strike - spot), 0.)
+        return lower, np.where(call, spot, strike)
+
+    @staticmethod
+    def initial_guess(price, S, K, T, rfr, div, call):
+        """ Corrado-Miller (1996) rational approximation of the implied vol, applied to the call price given by
+        put-call parity for puts
+        """
+        spot, strike = S * np.exp(-div * T), K * np.exp(-rfr * T)
+        call_price = np.where(call, price, price + spot - strike)
+        half = call_price - 0.5 * (spot - strike)
+        root = np.sqrt(np.maximum(half**2 - (spot - strike)**2 / np.pi, 0.))
+        return np.sqrt(2 * np.pi / T) / (spot + strike) * (half + root)
@@ -8,39 +8,174 @@ __author__ = 'exleym'
     MCPricer
 """
 import datetime
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
 from . import Pricer
-from ..processes import Tree, MonteCarlo
-from ..solvers import LSM
+from ..curves import YieldCurve, as_curve
+from ..assets import Equity
+from ..processes import Tree, TREES, MonteCarlo
+from ..solvers import LSM, RunningStats
+from ..fd import FiniteDifference
 
 
 class DCF(object):
-    def __init__(self):
-        pass
+    """ Discounted cash flow engine. Year fractions (Actual/365.25) are computed for a whole schedule at once in
+    datetime64, and both the year fractions and the discount-factor vectors are kept in class-level LRU caches, so
+    revaluing the same schedules across a spread or rate ladder skips the date arithmetic entirely.
+    """
+    cache_size = 256
+    _times = OrderedDict()
+    _factors = OrderedDict()
 
     def price(self, value_date, cash_flows, pay_dates, discount_rate):
-        price = 0
-        for cf, dt in zip(cash_flows, pay_dates):
-            T = (dt - value_date).days / 365.25
-            price += self.discount(cf, T, discount_rate)
-        return price
+        """
+        :param value_date: valuation date
+        :param cash_flows: array of cash flows, or a matrix with one row per instrument sharing the same pay_dates
+        :param pay_dates: sequence (or datetime64 array) of payment dates
+        :param discount_rate: annually-compounded discount rate, an array of rates (e.g. a spread ladder), or a
+            YieldCurve
+        :return: present value; an array when cash_flows is a matrix and/or discount_rate is an array
+        """
+        factors = self.discount_factors(value_date, pay_dates, discount_rate)
+        price = np.dot(np.asarray(cash_flows, dtype=float), factors.T)
+        return float(price) if np.ndim(price) == 0 else price
+
+    def price_portfolio(self, value_date, cash_flows, pay_dates, discount_rate):
+        """ Prices many instruments with their own schedules in one matrix product. The schedules are merged into a
+        single sorted set of pay dates, discounted once.
+        :param cash_flows: list of cash flow arrays, one per instrument
+        :param pay_dates: list of pay date sequences, aligned with cash_flows
+        :param discount_rate: annually-compounded discount rate, an array of rates, or a YieldCurve
+        :return: array of present values (instruments x rates when discount_rate is an array)
+        """
+        matrix, schedule = self.schedule_matrix(cash_flows, pay_dates)
+        return np.dot(matrix, self.discount_factors(value_date, schedule, discount_rate).T)
+
+    @staticmethod
+    def schedule_matrix(cash_flows, pay_dates):
+        """ Lays out many cash flow schedules on their merged, sorted pay dates
+        :param cash_flows: list of cash flow arrays, one per instrument
+        :param pay_dates: list of pay date sequences, aligned with cash_flows
+        :return: (instruments x pay dates matrix of cash flows, datetime64 array of the merged pay dates)
+        """
+        dates = [np.asarray(d, dtype='datetime64[D]') for d in pay_dates]
+        if not dates:
+            return np.zeros((0, 0)), np.array([], dtype='datetime64[D]')
+        schedule, position = np.unique(np.concatenate(dates), return_inverse=True)
+        rows = np.repeat(np.arange(len(dates)), [len(d) for d in dates])
+        matrix = np.zeros((len(dates), len(schedule)))
+        np.add.at(matrix, (rows, position), np.concatenate([np.asarray(c, dtype=float) for c in cash_flows]))
+        return matrix, schedule
+
+    @classmethod
+    def year_fractions(cls, value_date, pay_dates):
+        """ Actual/365.25 year fractions from value_date to each pay date (cached per value date and schedule) """
+        key = (value_date, cls._schedule_key(pay_dates))
+        times = cls._lookup(cls._times, key)
+        if times is None:
+            days = np.asarray(pay_dates, dtype='datetime64[D]') - np.datetime64(value_date, 'D')
+            times = cls._store(cls._times, key, days.astype(np.float64) / 365.25)
+        return times
+
+    @classmethod
+    def discount_factors(cls, value_date, pay_dates, discount_rate):
+        """ Discount factors for each pay date (cached per value date, rate or curve, and schedule)
+        :return: array of discount factors, or a rates x pay dates matrix when discount_rate is an array
+        """
+        if isinstance(discount_rate, (float, YieldCurve)):
+            rate_key = discount_rate
+        else:
+            rate_key = cls._schedule_key(np.asarray(discount_rate))
+        key = (value_date, rate_key, cls._schedule_key(pay_dates))
+        factors = cls._lookup(cls._factors, key)
+        if factors is None:
+            times = cls.year_fractions(value_date, pay_dates)
+            if isinstance(discount_rate, YieldCurve):
+                factors = discount_rate.discount(times)
+            else:
+                factors = cls.discount(1., times, np.asarray(discount_rate, dtype=float)[..., np.newaxis])
+            factors = cls._store(cls._factors, key, factors)
+        return factors
 
     @staticmethod
     def discount(cf, T, discount_rate):
         return cf * (1 / (1 + discount_rate))**T
 
+    @classmethod
+    def clear_cache(cls):
+        cls._times.clear()
+        cls._factors.clear()
+
+    @staticmethod
+    def _schedule_key(pay_dates):
+        if isinstance(pay_dates, np.ndarray):
+            return pay_dates.dtype.str, pay_dates.shape, pay_dates.tobytes()
+        return tuple(pay_dates)
 
-class LatticeOptionPricer(Pricer):
-    def __init__(self, n):
-        super(LatticeOptionPricer, self).__init__()
+    @classmethod
+    def _lookup(cls, cache, key):
+        value = cache.get(key)
+        if value is not None:
+            cache.move_to_end(key)
+        return value
+
+    @classmethod
+    def _store(cls, cache, key, value):
+        value.flags.writeable = False
+        cache[key] = value
+        while len(cache) > cls.cache_size:
+            cache.popitem(last=False)
+        return value
+
+
+class LatticePricer(Pricer):
+    """ Base class for lattice pricers. Sub-classes provide backpropagate; this class builds the tree, rolls it back and
+    reads the greeks off the first nodes of the lattice in the same pass.
+    """
+    def __init__(self, n, rolling=True, bump_greeks=False, vol_bump=0.01, rate_bump=0.0001, tree='crr',
+                 richardson=False, smooth=False):
+        """
+        :param n: number of time steps in the lattice
+        :param rolling: boolean where True keeps only the current time slice of values in memory (O(n)) and False
+            builds the full n x n value tree (O(n^2)), which is only useful for inspecting the lattice
+        :param bump_greeks: boolean where True adds vega and rho to the greeks from paired (up/down) bumps that reuse
+            the same lattice shape. This costs four extra rollbacks.
+        :param vol_bump: absolute volatility bump used for vega
+        :param rate_bump: absolute rate bump used for rho
+        :param tree: tree family, one of processes.TREES: 'crr' (Cox-Ross-Rubinstein), 'lr' (Leisen-Reimer), 'tian'
+            or 'trinomial'
+        :param richardson: boolean where True extrapolates the price (and greeks) from lattices with n and n/2 steps.
+            Raw CRR and Tian trees oscillate with the parity of n, so they can only be extrapolated when smoothed.
+        :param smooth: boolean where True the subclass smooths the last step of the lattice (see LatticeOptionPricer)
+        """
+        super(LatticePricer, self).__init__()
+        try:
+            assert tree in TREES
+        except AssertionError:
+            raise KeyError('tree must be one of %s' % ', '.join(sorted(TREES)))
+        try:
+            assert not (richardson and TREES[tree].oscillates and not smooth)
+        except AssertionError:
+            raise ValueError("richardson=True needs a tree whose error shrinks smoothly with n: use tree='lr' or "
+                             "'trinomial', or smooth=True, rather than a raw '%s' tree" % tree)
         self.n = n
-        
-    def price(self, asset, underlying, rfr, greeks=False, save=False, valuation_date=None):
-        """ calculate the price of an option using a binomial lattice to calculate early exercises
+        self.rolling = rolling
+        self.bump_greeks = bump_greeks
+        self.vol_bump = vol_bump
+        self.rate_bump = rate_bump
+        self.tree = tree
+        self.richardson = richardson
+        self.smooth = smooth
+
+    def price(self, asset, underlying, rfr, vol=None, greeks=False, save=False, valuation_date=None):
+        """ calculate the price of an option using a lattice to calculate early exercises
         :param asset: derivative asset to be priced with lattice model
         :param underlying: underlying asset upon which the derivative is based
-        :param rfr: currently a float. this needs to become a class that can handle forward curves, get data, etc
+        :param rfr: continuously-compounded risk-free rate (float) or YieldCurve
+        :param vol: optional volatility override (defaults to underlying.vol)
         :param greeks: boolean where True returns price and the greeks and false returns price.
         :param save: to be implemented later; boolean where True saves to a database.
         :param valuation_date: optional valuation_date override
@@ -48,56 +183,265 @@ class LatticeOptionPricer(Pricer):
         """
         if not valuation_date: valuation_date = datetime.date.today()
         T = (asset.maturity - valuation_date).days / 365.
-        tree = Tree(underlying, T=T,num_nodes=self.n, rfr=rfr)
+        tree, slices = self.rollback(asset, underlying, T, rfr, vol)
+        value = float(slices[0][0])
+        greek = self.greeks(tree, slices) if greeks else None
+        if self.richardson:
+            coarse_tree, coarse_slices = self.rollback(asset, underlying, T, rfr, vol, n=max(self.n // 2, 3))
+            # early exercise brings every tree family back to first-order convergence
+            order = 1 if asset.American else tree.order
+            value = self.extrapolate(tree, coarse_tree, value, coarse_slices[0][0], order)
+            if greeks:
+                coarse_greek = self.greeks(coarse_tree, coarse_slices)
+                greek = dict((k, self.extrapolate(tree, coarse_tree, v, coarse_greek[k], order))
+                             for k, v in greek.items())
+        if greeks:
+            if self.bump_greeks:
+                greek.update(self.bumped_greeks(asset, underlying, T, rfr, vol))
+            return round(value, 3), greek
+        return round(value, 3)
+
+    def rollback(self, asset, underlying, T, rfr, vol=None, n=None):
+        """ Builds the tree and runs the backward induction
+        :param n: optional number of time steps (defaults to self.n)
+        :return: (tree, list of value slices for time steps 0, 1 and 2)
+        """
+        tree = TREES[self.tree](underlying, T=T, num_nodes=n or self.n, rfr=rfr, vol=vol,
+                                strike=getattr(asset, 'strike', None))
         tree.initialize()
+        if self.rolling:
+            return tree, self.backpropagate(asset, tree, keep=3)
         value_tree = self.backpropagate(asset, tree)
-        if greeks:
-            return round(value_tree[0, 0], 3), self.greeks(asset)
-        return round(value_tree[0, 0], 3)
+        return tree, [value_tree[:len(tree.prices(i)), i] for i in range(min(3, tree.num_nodes + 1))]
 
     @staticmethod
-    def backpropagate(asset, tree):
-        value_tree = np.zeros(tree.lattice.shape)
-        for ix in range(0, tree.lattice.shape[0]):
-            value_tree[ix, -1] = asset.parity(tree.lattice[ix, -1])
-        for n in range(tree.lattice.shape[1]-2, -1, -1):
-            for m in range(n, -1, -1):
-                value_tree[m, n] = tree.disc(value_tree[m, n+1] * tree.p + value_tree[m+1, n+1] * (1 - tree.p), per=1)
+    def extrapolate(fine_tree, coarse_tree, fine, coarse, order=1):
+        """ Two-point Richardson extrapolation of a lattice result whose error shrinks like 1/n^order """
+        fine_weight = float(fine_tree.num_nodes) ** order
+        coarse_weight = float(coarse_tree.num_nodes) ** order
+        return _scalar((fine_weight * fine - coarse_weight * coarse) / (fine_weight - coarse_weight))
+
+    def greeks(self, tree, slices):
+        """ Delta, gamma and theta read directly off the first nodes of the lattice used for pricing (steps 1 and 2 of
+        a binomial tree, step 1 of a trinomial tree)
+        :param tree: initialized Tree used for pricing
+        :param slices: value slices for time steps 0, 1 and 2 (as returned by rollback)
+        :return: dict of delta, gamma and theta (per year); arrays with one value per tree on a stacked tree
+        """
+        if tree.branches == 3:
+            spot, values, elapsed = tree.prices(1), slices[1], tree.dt
+            delta = (values[0] - values[2]) / (spot[0] - spot[2])
+        else:
+            if len(slices) < 3:
+                raise ValueError('Lattice greeks require at least 2 time steps')
+            spot, values, elapsed = tree.prices(2), slices[2], 2 * tree.dt
+            delta = (slices[1][0] - slices[1][1]) / (tree.prices(1)[0] - tree.prices(1)[1])
+        delta_up = (values[0] - values[1]) / (spot[0] - spot[1])
+        delta_down = (values[1] - values[2]) / (spot[1] - spot[2])
+        gamma = (delta_up - delta_down) / (0.5 * (spot[0] - spot[2]))
+        # the middle node only sits at spot when u * d = 1 (CRR, trinomial); otherwise remove the move in the underlying
+        move = spot[1] - tree.prices(0)[0]
+        theta = (values[1] - slices[0][0] - delta * move - 0.5 * gamma * move**2) / elapsed
+        return {'delta': _scalar(delta), 'gamma': _scalar(gamma), 'theta': _scalar(theta)}
+
+    def bumped_greeks(self, asset, underlying, T, rfr, vol=None):
+        """ Vega and rho from paired up/down bumps rolled back on a lattice with the same number of nodes
+        :return: dict of vega (per 1.00 of vol) and rho (per 1.00 of rate)
+        """
+        if not vol: vol = underlying.vol
+
+        def value(rate, sigma):
+            return self.rollback(asset, underlying, T, rate, sigma)[1][0][0]
+
+        curve = as_curve(rfr)
+        return {'vega': float((value(curve, vol + self.vol_bump) - value(curve, vol - self.vol_bump)) /
+                              (2 * self.vol_bump)),
+                'rho': float((value(curve.shift(self.rate_bump), vol) - value(curve.shift(-self.rate_bump), vol)) /
+                             (2 * self.rate_bump))}
+
+
+class LatticeOptionPricer(LatticePricer):
+    def __init__(self, n, rolling=True, bump_greeks=False, vol_bump=0.01, rate_bump=0.0001, tree='crr',
+                 richardson=False, smooth=False):
+        """
+        :param smooth: boolean where True replaces the last step of the lattice with Black-Scholes values (the
+            smoothed binomial of Broadie-Detemple), which removes most of the odd/even oscillation of CRR trees. Only
+            vanilla options (assets with a strike and a call flag) can be smoothed.
+        See LatticePricer for the remaining parameters.
+        """
+        super(LatticeOptionPricer, self).__init__(n, rolling=rolling, bump_greeks=bump_greeks, vol_bump=vol_bump,
+                                                  rate_bump=rate_bump, tree=tree, richardson=richardson,
+                                                  smooth=smooth)
+
+    def backpropagate(self, asset, tree, keep=None):
+        """ Backward induction over the lattice, one vectorized operation per time slice (including the early-exercise
+        max for American options).
+        :param asset: derivative asset with vectorized parity and exercise_value methods
+        :param tree: initialized Tree instance
+        :param keep: optional number of leading time slices to return. When provided, only the current slice of values
+            is held in memory during the rollback, so peak memory grows linearly with the number of nodes.
+        :return: value tree (row = number of down-moves, column = time slice), or a list of the first `keep` value
+            slices when keep is provided
+        """
+        if self.smooth and getattr(asset, 'strike', None) is None:
+            raise ValueError('smooth=True prices the last step with Black-Scholes, which needs a vanilla option with a '
+                             'strike; %s has none' % asset.__class__.__name__)
+        n = tree.num_nodes
+        value_tree = np.zeros((len(tree.prices(n)), n + 1)) if keep is None else None
+        slices = [None] * min(keep or 0, n + 1)
+        values = _parity(asset, tree.prices(n))
+        for i in range(n, -1, -1):
+            if i < n:
+                if self.smooth and i == n - 1:
+                    from .analytic import BlackScholesPricer
+                    values = BlackScholesPricer().price_batch(tree.prices(i), asset.strike, tree.dt,
+                                                              tree.forwards[i], tree.vol, tree.div, asset.call)
+                else:
+                    values = tree.expect(values, i)
                 if asset.American:
-                    value_tree[m, n] = max(value_tree[m, n], asset.parity(tree.lattice[m, n]))
-        return value_tree
+                    values = np.maximum(values, asset.exercise_value(tree.prices(i)))
+            if value_tree is not None:
+                value_tree[:len(values), i] = values
+            elif i < len(slices):
+                slices[i] = values
+        return slices if value_tree is None else value_tree
 
-    def greeks(self, asset):
-        return None
+    def price_batch(self, S, K, T, rfr, vol, div=0., call=True, greeks=False, American=False):
+        """ Prices a whole book of options in one backward induction: every option has its own tree of the pricer's
+        family (spot, strike, maturity, rate, vol and dividend yield can all differ) with the same number of steps. The
+        trees are built together from the parameter arrays as one tree with a column per option, so that each time
+        slice is rolled back for all options at once as a nodes x options matrix. Greeks, smoothing, Richardson
+        extrapolation and bumped greeks are those of LatticeOptionPricer.price, applied column by column.
+        :param S: array of underlying prices
+        :param K: array of strikes
+        :param T: array of times to maturity (in years)
+        :param rfr: array of continuously-compounded risk-free rates
+        :param vol: array of volatilities
+        :param div: array of continuous dividend yields (defaults to 0)
+        :param call: boolean array where True is a call and False is a put
+        :param greeks: boolean where True also returns a dict of greek arrays
+        :param American: boolean array where True allows early exercise
+        :return: unrounded array of prices or (prices, greeks)
+        """
+        S, K, T, rfr, vol, div, call, American = np.broadcast_arrays(
+            *[np.asarray(x, dtype=float) for x in (S, K, T, rfr, vol, div)] +
+            [np.asarray(call, bool), np.asarray(American, bool)])
+        shape = S.shape
+        args = [np.ravel(x) for x in (S, K, T, rfr, vol, div)]
+        book = _OptionColumns(np.ravel(K), np.ravel(call), np.ravel(American))
+        tree, slices = self._batch_rollback(book, *args)
+        value = slices[0][0]
+        greek = self.greeks(tree, slices) if greeks else None
+        if self.richardson:
+            coarse_tree, coarse_slices = self._batch_rollback(book, *args, n=max(self.n // 2, 3))
+            # early exercise brings every tree family back to first-order convergence
+            order = np.where(book.early, 1, tree.order)
+            value = self.extrapolate(tree, coarse_tree, value, coarse_slices[0][0], order)
+            if greeks:
+                coarse_greek = self.greeks(coarse_tree, coarse_slices)
+                greek = dict((k, self.extrapolate(tree, coarse_tree, v, coarse_greek[k], order))
+                             for k, v in greek.items())
+        if not greeks:
+            return np.reshape(value, shape)
+        if self.bump_greeks:
+            def bumped(rate_bump, vol_bump):
+                bumped_args = args[:3] + [args[3] + rate_bump, args[4] + vol_bump, args[5]]
+                return self._batch_rollback(book, *bumped_args)[1][0][0]
+            greek['vega'] = (bumped(0., self.vol_bump) - bumped(0., -self.vol_bump)) / (2 * self.vol_bump)
+            greek['rho'] = (bumped(self.rate_bump, 0.) - bumped(-self.rate_bump, 0.)) / (2 * self.rate_bump)
+        return np.reshape(value, shape), dict((k, np.reshape(v, shape)) for k, v in greek.items())
+
+    def _batch_rollback(self, book, S, K, T, rfr, vol, div, n=None):
+        """ Builds the stacked tree of the whole book from the parameter arrays and runs the backward induction
+        :return: (stacked tree, list of value slices (nodes x options) for time steps 0, 1 and 2)
+        """
+        tree = TREES[self.tree](Equity(None, None, price=S, vol=vol, div=div), T=T, num_nodes=n or self.n, rfr=rfr,
+                                strike=K)
+        tree.initialize()
+        return tree, self.backpropagate(book, tree, keep=3)
 
     def __repr__(self):
         return "<LatticeOptionPricer: N=%d>" % self.n
 
 
 class FDOptionPricer(Pricer):
-    def __init__(self, n):
+    """ Crank-Nicolson finite-difference pricer. The grid of stock prices is concentrated around the strike and early
+    exercise is enforced with a penalty term, so every time step is one tridiagonal solve.
+    """
+    def __init__(self, n, m=200, concentration=0.1, width=5.):
+        """
+        :param n: number of time steps
+        :param m: number of stock prices in the grid
+        :param concentration: width of the region around the strike that the grid is concentrated in, as a fraction of
+            the strike (None gives a uniform grid)
+        :param width: number of standard deviations of the terminal log-price covered above the spot
+        """
         super(FDOptionPricer, self).__init__()
         self.n = n
+        self.m = m
+        self.concentration = concentration
+        self.width = width
 
-    def price(self, asset, underlying, greeks=True, save=False):
+    def price(self, asset, underlying, rfr, vol=None, greeks=False, save=False, valuation_date=None):
         """ calculate the price of an option using a finite-difference matrix to calculate early exercises
         :param asset: derivative asset to be priced with finite-difference model
         :param underlying: underlying asset upon which the derivative is based
-        :param rfr: currently a float. this needs to become a class that can handle forward curves, get data, etc
+        :param rfr: continuously-compounded risk-free rate (float) or YieldCurve
+        :param vol: optional volatility override (defaults to underlying.vol)
         :param greeks: boolean where True returns price and the greeks and false returns price.
         :param save: to be implemented later; boolean where True saves to a database.
         :param valuation_date: optional valuation_date override
         :return: price or (price & greeks)
         """
-        pass
+        if not valuation_date: valuation_date = datetime.date.today()
+        T = (asset.maturity - valuation_date).days / 365.
+        grid = FiniteDifference(underlying, T, s0=underlying.price, vol=vol, rfr=rfr)
+        grid.initialize(M=self.m, N=self.n, centre=getattr(asset, 'strike', None), concentration=self.concentration,
+                        width=self.width)
+        payoff = _parity(asset, grid.prices)
+        grid.solve(payoff, exercise=asset.exercise_value(grid.prices) if asset.American else None)
+        value, delta, gamma = grid.interpolate(grid.values)
+        if greeks:
+            # theta from the last time step, which ends one dt before the valuation date
+            theta = (grid.interpolate(grid.previous)[0] - value) / grid.dt
+            return round(float(value), 3), {'delta': float(delta), 'gamma': float(gamma), 'theta': float(theta)}
+        return round(float(value), 3)
 
     def __repr__(self):
-        return "<FDOptionPricer: N=%d>" % self.n
+        return "<FDOptionPricer: N=%d, M=%d>" % (self.n, self.m)
 
 
 class MCOptionPricer(Pricer):
     """ Monte Carlo Simulation for option pricing. Based on Longstaff-Schwartz 2001 """
-    def __init__(self, m, n=None, dt=None):
+    def __init__(self, m, n=None, dt=None, block_size=50000, dtype=np.float64, seed=None, workers=1, antithetic=False,
+                 control_variate=False, moment_matching=False, quasi_random=False, likelihood_ratio=False,
+                 target_std_err=None, target_bp=None, time_budget=None):
+        """
+        :param m: number of paths to simulate (the most paths simulated when a target or time budget is given)
+        :param n: Optional (xor with dt) number of time steps
+        :param dt: Optional (xor with n) length of a time step
+        :param block_size: number of paths simulated and valued at a time. Memory use is bounded by the block size
+            rather than m; American options run the least-squares regression within each block.
+        :param dtype: floating point type of the simulated paths (np.float64 or np.float32)
+        :param seed: Optional seed. Each block of paths uses its own child stream of the seed, so a fixed seed gives
+            bit-identical results for any number of workers.
+        :param workers: number of processes the blocks of paths are sharded across
+        :param antithetic: boolean where True pairs each path with its antithetic path
+        :param control_variate: boolean where True uses the discounted European payoff of the same option, whose mean
+            is known from BlackScholesPricer, as a control variate (Option assets only)
+        :param moment_matching: boolean where True matches the mean and variance of the normal draws of each time step
+        :param quasi_random: boolean where True uses scrambled Sobol draws with Brownian-bridge construction. Standard
+            errors for moment matching and quasi-random draws come from the spread of the block estimates, so use
+            power-of-two block sizes and at least ~10 blocks.
+        :param likelihood_ratio: boolean where True estimates every greek with likelihood-ratio weights, which do not
+            differentiate the payoff (use for digital-like payoffs). Otherwise delta and vega are pathwise and gamma is
+            the mixed likelihood-ratio/pathwise estimator, which need a payoff that is continuous in the spot.
+        :param target_std_err: Optional (xor with target_bp) standard error of the price at which the simulation stops.
+            Blocks of paths are simulated until the running (Welford) standard error meets the target, so the block
+            size sets the granularity of the stopping rule.
+        :param target_bp: Optional (xor with target_std_err) target standard error in basis points of the price
+        :param time_budget: Optional number of seconds after which no further block of paths is started
+        """
         super(MCOptionPricer, self).__init__()
         self.m = m
         try:
@@ -106,18 +450,36 @@ class MCOptionPricer(Pricer):
             raise KeyError('One and only one of num_steps or dt must be provided in initialization')
         self.n = n
         self.dt = dt
+        self.block_size = block_size
+        self.dtype = dtype
+        self.seed = seed
+        self.workers = workers
+        self.antithetic = antithetic
+        self.control_variate = control_variate
+        self.moment_matching = moment_matching
+        self.quasi_random = quasi_random
+        self.likelihood_ratio = likelihood_ratio
+        try:
+            assert target_std_err is None or target_bp is None
+        except AssertionError:
+            raise ValueError('At most one of target_std_err or target_bp can be provided in initialization')
+        self.target_std_err = target_std_err
+        self.target_bp = target_bp
+        self.time_budget = time_budget
+        self.last_result = None
 
-    def price(self, asset, underlying, rfr, greeks=True, save=False, valuation_date=None):
+    def price(self, asset, underlying, rfr, greeks=False, save=False, valuation_date=None):
         """ Calculate price subject to early exercise boundary (for American options, only) - This model uses a
         Longstaff-Schwartz-style least-squares regression model to estimate continuation value @ points in which
         early-exercise is allowed.
         :param asset: 
         :param underlying:
         :param rfr:
-        :param greeks:
+        :param greeks: boolean where True also returns delta, gamma and vega estimated from the same paths (see
+            MCOptionPricer.path_greeks); their standard errors are in last_result['greeks_std_err']
         :param save:
         :param valuation_date:
-        :return:
+        :return: price or (price & greeks)
         """
         if not valuation_date: valuation_date = datetime.date.today()
         T = (asset.maturity - valuation_date).days / 365.
@@ -127,41 +489,205 @@ class MCOptionPricer(Pricer):
         else:
             n = int(round(T / self.dt))
             dt = self.dt
-        process = MonteCarlo(underlying, T, rfr, self.m, n)
-        paths = process.initialize()
-        return self.backpropagate(asset, paths, rfr, n, dt)
+        if self.control_variate and not hasattr(asset, 'strike'):
+            raise TypeError('The Black-Scholes control variate is only available for Options')
+        rfr = as_curve(rfr)
+        process = MonteCarlo(underlying, T, rfr, self.m, n, block_size=self.block_size, dtype=self.dtype,
+                             seed=self.seed, antithetic=self.antithetic, moment_matching=self.moment_matching,
+                             quasi_random=self.quasi_random)
+        self.last_result = self.simulate(asset, process, rfr, n, dt, greeks=greeks)
+        if greeks:
+            return round(self.last_result['price'], 3), dict(self.last_result['greeks'])
+        return round(self.last_result['price'], 3)
+
+    def simulate(self, asset, process, rfr, n, dt, greeks=False):
+        """ Values every block of paths of the process, across a pool of worker processes if self.workers > 1. Blocks
+        are merged in block order, so the estimate only depends on the seed. When a target standard error or a time
+        budget is set the blocks are merged one at a time and the simulation stops at the first block that meets the
+        target (the blocks already running on other workers are discarded), so the stopping point does not depend on
+        the number of workers either, unless the time budget runs out first.
+        :param greeks: boolean where True also estimates delta, gamma and vega from the same paths
+        :return: dict of price, std_err, paths (number of simulated paths), wall_time (seconds) and vr_factor (squared
+            ratio of the standard error plain Monte Carlo would have had with as many paths to the achieved standard
+            error), plus converged (whether the target was met) if a target is set and dicts of greeks and
+            greeks_std_err if greeks
+        """
+        start = time.perf_counter()
+        tasks = [(self, asset, process, rfr, n, dt, i, greeks) for i in range(process.num_blocks)]
+        adaptive = self.adaptive
+        raw, stats, block_means = RunningStats(), RunningStats(), RunningStats()
+        greek_stats, greek_means = OrderedDict(), OrderedDict()
+        # moment matching and quasi-random draws make the paths within a block dependent, so only the independent
+        # block estimates give an honest standard error
+        blockwise = process.moment_matching or process.quasi_random
+        converged = False
+        for block_raw, block_stats, block_greeks in self._value_blocks(tasks, self.workers if adaptive else len(tasks)):
+            raw.merge(block_raw)
+            stats.merge(block_stats)
+            block_means.update([block_stats.mean])
+            for name, block_greek in block_greeks.items():
+                greek_stats.setdefault(name, RunningStats()).merge(block_greek)
+                greek_means.setdefault(name, RunningStats()).update([block_greek.mean])
+            if adaptive:
+                converged = bool(self.target_met(stats.mean, block_means.std_err if blockwise else stats.std_err))
+                if converged or self.time_budget is not None and time.perf_counter() - start >= self.time_budget:
+                    break
+        std_err = block_means.std_err if blockwise else stats.std_err
+        result = {'price': stats.mean,
+                  'std_err': std_err,
+                  'paths': raw.count,
+                  'wall_time': time.perf_counter() - start,
+                  'vr_factor': raw.variance / raw.count / std_err**2 if std_err else np.inf}
+        if self.target_std_err is not None or self.target_bp is not None:
+            result['converged'] = converged
+        if greeks:
+            result['greeks'] = dict((name, v.mean) for name, v in greek_stats.items())
+            result['greeks_std_err'] = dict((name, (greek_means if blockwise else greek_stats)[name].std_err)
+                                            for name in greek_stats)
+        return result
+
+    @property
+    def adaptive(self):
+        return self.target_std_err is not None or self.target_bp is not None or self.time_budget is not None
+
+    def target_met(self, price, std_err):
+        """ Whether a standard error meets target_std_err, or target_bp of the price (False without a target) """
+        if self.target_std_err is not None:
+            return std_err <= self.target_std_err
+        if self.target_bp is not None:
+            return std_err <= self.target_bp * 1e-4 * abs(price)
+        return False
 
-    def backpropagate(self, asset, paths, rfr, n, dt):
+    def _value_blocks(self, tasks, round_size):
+        """ Generates the valued blocks in block order, valuing round_size blocks at a time across the workers """
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                yield _value_block(task)
+            return
+        with ProcessPoolExecutor(max_workers=min(self.workers, len(tasks))) as pool:
+            for start in range(0, len(tasks), round_size):
+                for block in pool.map(_value_block, tasks[start:start + round_size]):
+                    yield block
+
+    def path_greeks(self, asset, process, paths, values, stop, rfr, n, dt):
+        """ Per-path estimates of delta, gamma and vega from the paths already simulated for the price. Under GBM every
+        price on a path is S0 * exp(drift + vol * W), so its sensitivities to S0 and vol are known in closed form, and
+        the Brownian motion W is recovered from the path itself.
+        - Pathwise: delta and vega differentiate the discounted payoff along each path (payoff slope times dS/dS0 or
+          dS/dvol), and gamma applies a likelihood-ratio weight to the pathwise delta (Glasserman, 2004, 7.3).
+        - Likelihood ratio (self.likelihood_ratio): the discounted payoffs are weighted by the derivative of the log
+          density of the paths, so the payoff is never differentiated.
+        American options are differentiated along the stopping times found by backpropagate, i.e. with the exercise
+        boundary held fixed. The exercise region does not depend on the spot, and its sensitivity to vol has no first
+        order effect on the value, so the estimates stay unbiased up to the error of the regression.
+        :param asset: Derivative being priced
+        :param process: MonteCarlo process that simulated the paths
+        :param paths: block of simulated paths
+        :param values: array of present values, one per path (as returned by backpropagate)
+        :param stop: array of stopping times, one per path (column index, as returned by backpropagate)
+        :param rfr: risk-free rate (float or YieldCurve)
+        :param n: number of steps being simulated
+        :param dt: duration of a "time-step"
+        :return: dict of arrays of delta, gamma and vega (per 1.00 of vol), one per path
+        """
+        underlying = process.asset
+        spot0, vol = float(underlying.price), float(underlying.vol)
+        times = dt * np.arange(1, n + 1)
+        drift = np.cumsum(process.forwards - (underlying.div or 0.) - 0.5 * vol**2) * dt
+        rows = np.arange(len(paths))
+        spot = paths[rows, stop].astype(np.float64)
+        brownian = (np.log(spot / spot0) - drift[stop]) / vol
+        # the spot only moves the density of the paths through the first draw that the value depends on: the first
+        # exercise date of an American option, or maturity of a European one
+        first = 0 if asset.American else n - 1
+        if asset.American:
+            first_brownian = (np.log(paths[:, first].astype(np.float64) / spot0) - drift[first]) / vol
+        else:
+            first_brownian = brownian
+        score = first_brownian / (vol * times[first])
+        if self.likelihood_ratio:
+            if asset.American:
+                # the value at each stopping time depends on every draw up to it
+                log_paths = np.log(paths.astype(np.float64) / spot0)
+                draws = np.diff(log_paths - drift, axis=1, prepend=0.) / (vol * np.sqrt(dt))
+                vega_weight = np.cumsum((draws**2 - 1) / vol - draws * np.sqrt(dt), axis=1)[rows, stop]
+            else:
+                draws = brownian / np.sqrt(times[-1])
+                vega_weight = (draws**2 - 1) / vol - draws * np.sqrt(times[-1])
+            return {'delta': values * score / spot0,
+                    'gamma': values * (score**2 - 1 / (vol**2 * times[first]) - score) / spot0**2,
+                    'vega': values * vega_weight}
+        discount = np.cumprod(as_curve(rfr).steps(n, dt)[1])[stop]
+
+        def payoff(price):
+            return np.where(stop == n - 1, asset.parity(price), asset.exercise_value(price))
+
+        bump = 1e-6 * spot
+        slope = discount * (payoff(spot + bump) - payoff(spot - bump)) / (2 * bump)
+        return {'delta': slope * spot / spot0,
+                'gamma': slope * spot / spot0**2 * (score - 1),
+                'vega': slope * spot * (brownian - vol * times[stop])}
+
+    def control(self, asset, process, paths, values, rfr):
+        """ Applies the European option control variate to a block of path values. The control is the discounted payoff
+        at maturity of each path, whose expectation is the Black-Scholes price; its coefficient is the regression slope
+        of the path values on the control.
+        :param asset: Option being priced
+        :param process: MonteCarlo process that simulated the paths
+        :param paths: block of simulated paths
+        :param values: array of present values, one per path
+        :param rfr: risk-free rate (float or YieldCurve)
+        :return: array of controlled present values
+        """
+        from .analytic import BlackScholesPricer
+        underlying = process.asset
+        rate = as_curve(rfr).zero(process.T)
+        expected = BlackScholesPricer().price_batch(underlying.price, asset.strike, process.T, rate, underlying.vol,
+                                                    underlying.div or 0., asset.call)
+        control = np.exp(-rate * process.T) * asset.parity(paths[:, -1])
+        covariance = np.cov(values, control)
+        if not covariance[1, 1]:
+            return values
+        return values - covariance[0, 1] / covariance[1, 1] * (control - expected)
+
+    def backpropagate(self, asset, paths, rfr, n, dt, stopping=False):
         """
             Uses the least-squares method described in Longstaff-Schwartz [2001] to determine early exercise conditions
-            for in-the-money paths of the Monte Carlo process.
+            for in-the-money paths of the Monte Carlo process. The regression runs at every exercise date (every time
+            step), and the realised cash flows and stopping times are tracked as arrays over the paths.
         :param asset: Asset instance (should be a Derivative)
-        :param paths: integer representing m paths
-        :param rfr: risk-free rate
+        :param paths: block of simulated paths (paths x n matrix)
+        :param rfr: risk-free rate (float or YieldCurve)
         :param n: number of steps being simulated
         :param dt: duration of a "time-step"
+        :param stopping: boolean where True also returns the stopping time of each path (as a column index)
+        :return: array of present values, one per path (and the array of stopping times if stopping)
         """
-        parity = np.zeros(paths.shape)
-        value = np.zeros(paths.shape)
-        parity[:, -1] = asset.parity(paths[:, -1])
-        value[:, -1] = parity[:, -1]
-        lsm = LSM([lambda x: x, lambda x: x**2, lambda x: x**3])
-
-        for col in range(paths.shape[1]-2, -1, -1):
-            if not asset.American:
-                return round(self._disc(parity[:,-1], dt, per=self.n, rate=rfr).mean(),3)
-            else:
-                parity[:, col] = asset.parity(paths[:, col])
-                itm = parity[:, col] > 0
-                y = parity[itm, -1]
-                x = parity[itm, col]
-                params = lsm.calc(y, x)
-                y_hat = np.ones(parity[:,0].shape) * params[-1]
-                for ix in range(len(params)-2, -1, -1):
-                    y_hat += params[ix] * parity[:,col]
-                value[:,0] = self._disc(parity[:,-1], dt, per=1, rate=rfr)
-                value[itm, 0] = np.maximum(self._disc(y_hat[itm], dt, per=1,rate=rfr), parity[itm, col])
-                return round(value[:,0].mean(),3)
+        stop = np.full(len(paths), n - 1)
+        value = _parity(asset, paths[:, -1]).astype(np.float64)
+        # column col of the paths is the end of time step col, discounted back to its start by discounts[col]
+        discounts = as_curve(rfr).steps(n, dt)[1]
+        if asset.American:
+            lsm = LSM([lambda x: x, lambda x: x**2, lambda x: x**3])
+            scale = float(np.mean(paths[:, 0]))
+            for col in range(n - 2, -1, -1):
+                # value holds each path's realised cash flow discounted back to the current exercise date
+                value *= discounts[col + 1]
+                exercise = asset.exercise_value(paths[:, col])
+                itm = np.flatnonzero(exercise > 0)
+                if len(itm) <= len(lsm.lambdas):
+                    continue
+                X = lsm.basis(paths[itm, col] / scale)
+                continuation = np.dot(X, lsm.solve(X, value[itm]))
+                early = itm[exercise[itm] > continuation]
+                value[early] = exercise[early]
+                stop[early] = col
+            value *= discounts[0]
+        else:
+            value *= np.prod(discounts)
+        if stopping:
+            return value, stop
+        return value
 
     @staticmethod
     def _disc(value_array, dt, per=1, rate=0):
@@ -169,64 +695,129 @@ class MCOptionPricer(Pricer):
         :param value_array: numpy array of values to be discounted
         :param dt: time step (in years - one day = 1/252 or 0.004)
         :param per: number of time steps over which the discounting applied (int or array of ints - defaults to 1)
-        :param rate: discount rate to use in the discounting (float - defaults to 0, but you shouldn't use this)
+        :param rate: continuously-compounded discount rate (float - defaults to 0, but you shouldn't use this)
         :return: array of discounted values
         """
-        disc = (1+rate)**(dt * per)
-        return value_array / disc
+        return value_array * np.exp(-rate * dt * per)
 
 
-class LatticeMandyPricer(Pricer):
-    def __init__(self, n):
-        super(LatticeMandyPricer, self).__init__()
-        self.n = n
+def _scalar(value):
+    """ float of a 0-d result, or the array of results of a stacked tree """
+    return float(value) if np.ndim(value) == 0 else np.asarray(value)
 
-    def price(self, asset, underlying, rfr, greeks=False, save=False, valuation_date=None):
-        """ calculate the price of an option using a binomial lattice to calculate early exercises
-        :param asset: derivative asset to be priced with lattice model
-        :param underlying: underlying asset upon which the derivative is based
-        :param rfr: currently a float. this needs to become a class that can handle forward curves, get data, etc
-        :param greeks: boolean where True returns price and the greeks and false returns price.
-        :param save: to be implemented later; boolean where True saves to a database.
-        :param valuation_date: optional valuation_date override
-        :return: price or (price & greeks)
+
+def _parity(asset, price):
+    """ asset.parity(price), rejecting derivatives that do not define a payoff (Derivative.parity returns None) """
+    value = asset.parity(price)
+    if value is None: raise TypeError('%s does not define a parity payoff' % asset.__class__.__name__)
+    return value
+
+
+class _OptionColumns(object):
+    """ Payoff protocol (parity, exercise_value) of a book of vanilla options, one per column of a stacked tree """
+    def __init__(self, strike, call, American):
+        self.strike = strike
+        self.call = call
+        self.sign = np.where(call, 1., -1.)
+        self.early = American
+        self.American = bool(American.any())
+
+    def parity(self, price):
+        return np.maximum(self.sign * (price - self.strike), 0.)
+
+    def exercise_value(self, price):
+        # zero (never above a continuation value) in the columns that cannot be exercised early
+        if self.early.all(): return self.parity(price)
+        return np.where(self.early, self.parity(price), 0.)
+
+
+def _value_block(task):
+    """ Simulates and values one block of Monte Carlo paths (module level so that it can be sent to worker processes)
+    :param task: tuple of (MCOptionPricer, asset, MonteCarlo, rfr, n, dt, block index, greeks)
+    :return: RunningStats of the raw discounted path values and of the variance-reduced estimator in the block, and a
+        dict of RunningStats of each greek (empty unless greeks)
+    """
+    pricer, asset, process, rfr, n, dt, i, greeks = task
+    paths = process.block(i)
+    values, stop = pricer.backpropagate(asset, paths, rfr, n, dt, stopping=True)
+    greek = pricer.path_greeks(asset, process, paths, values, stop, rfr, n, dt) if greeks else {}
+    raw = RunningStats.from_values(values)
+    if pricer.control_variate:
+        values = pricer.control(asset, process, paths, values, rfr)
+    if process.antithetic:
+        half = len(values) // 2
+        values = 0.5 * (values[:half] + values[half:])
+        greek = dict((name, 0.5 * (v[:half] + v[half:])) for name, v in greek.items())
+    return raw, RunningStats.from_values(values), dict((name, RunningStats.from_values(v)) for name, v in greek.items())
+
+
+class LatticeMandyPricer(LatticePricer):
+    """ Tsiveriotis-Fernandes lattice for mandatory convertibles. The value of each node is split into an equity
+    component, received in shares and discounted at the risk-free rate, and a cash component holding the coupons still
+    to be paid, discounted at the risk-free rate plus the credit spread of the issuer. Both components are rolled back
+    one time slice at a time as arrays. Early conversion (at Mandatory.exercise_value, so including any EEPenalty
+    feature) moves a node's value into the equity component and forfeits the coupons that follow.
+    """
+    def __init__(self, n, rolling=True, bump_greeks=False, vol_bump=0.01, rate_bump=0.0001, tree='crr',
+                 richardson=False):
         """
-        if not valuation_date: valuation_date = datetime.date.today()
-        T = (asset.maturity_date - valuation_date).days / 365.
-        tree = Tree(underlying, T=T,num_nodes=self.n, rfr=rfr)
-        tree.initialize()
-        value_tree = self.backpropagate(asset, tree)
-        if greeks:
-            return round(value_tree[0, 0], 3), self.greeks(asset)
-        return round(value_tree[0, 0], 3)
-
-    def backpropagate(self, asset, tree):
-        value_tree = np.zeros(tree.lattice.shape)
-        # TODO: does final coupon usually pay on maturity date at the same time conversion happens?
-        # TODO (cont): if so, this needs to handle final coupon @ last node.
-        for ix in range(0, tree.lattice.shape[0]):
-            value_tree[ix, -1] = asset.parity(tree.lattice[ix, -1])
-
-        # this is currently calculating the conversion value @ each node and ignoring coupon payment
-        # TODO: need to incorporate coupon value in the value nodes somehow. perhaps each node should be a tuple
-        # Issues:
-        #   1)  If you just do conversion values in the value tree, you miss out on incorporating future coupons @ each
-        #       decision node.
-        #   2)  If you try to incorporate both future coupons and conversion value in same decision node, you have to
-        #       blend the discount rate based on how much value comes from coupon vs equity conversion. At least par
-        #       value isn't part of the mix in mandies. Converts will be worse.
-        # Each node is max(conversion value, prob-weighted pv of next two value nodes + any coupon between them)
-        #   -   IF no future nodes contain a coupon payment, the next nodes should be discounted @ RFR.
-        #   -   HOWEVER, IF some future nodes receive coupons, that portion of value should be discounted @ asset yield.
-        for n in range(tree.lattice.shape[1]-2, -1, -1):
-            for m in range(n, -1, -1):
-                value_tree[m, n] = tree._disc(value_tree[m, n+1] * tree.p + value_tree[m+1, n+1] * (1 - tree.p), per=1)
+        :param tree: tree family, one of processes.TREES except 'lr': a Mandatory has two conversion thresholds
+            (par / r1 and par / r2) rather than a strike, so there is no single price to centre a Leisen-Reimer tree on
+        See LatticePricer for the remaining parameters.
+        """
+        super(LatticeMandyPricer, self).__init__(n, rolling=rolling, bump_greeks=bump_greeks, vol_bump=vol_bump,
+                                                 rate_bump=rate_bump, tree=tree, richardson=richardson)
+        try:
+            assert tree != 'lr'
+        except AssertionError:
+            raise ValueError('LatticeMandyPricer does not support Leisen-Reimer trees, which are centred on a strike; '
+                             'use one of %s' % ', '.join(sorted(t for t in TREES if t != 'lr')))
+
+    def backpropagate(self, asset, tree, keep=None):
+        """ Backward induction of the equity and cash components of a Mandatory
+        :param asset: Mandatory instance
+        :param tree: initialized Tree instance
+        :param keep: optional number of leading time slices to return (see LatticeOptionPricer.backpropagate)
+        :return: value tree of total values (equity + cash), or a list of the first `keep` value slices
+        """
+        n = tree.num_nodes
+        coupons = self.coupon_slices(asset, tree)
+        credit = np.exp(-(asset.spread or 0.) * tree.dt)
+        value_tree = np.zeros((len(tree.prices(n)), n + 1)) if keep is None else None
+        slices = [None] * min(keep or 0, n + 1)
+        equity = _parity(asset, tree.prices(n))
+        cash = np.full(np.shape(equity), coupons[n])
+        for i in range(n, -1, -1):
+            if i < n:
+                equity = tree.expect(equity, i)
+                cash = tree.expect(cash, i) * credit
                 if asset.American:
-                    value_tree[m, n] = max(value_tree[m, n], asset.ee_parity(tree.lattice[m, n]))
-        return value_tree
+                    exercise = asset.exercise_value(tree.prices(i))
+                    convert = exercise > equity + cash
+                    equity = np.where(convert, exercise, equity)
+                    cash = np.where(convert, 0., cash)
+                # a coupon paid on slice i goes to the holder of record, who may then convert
+                cash = cash + coupons[i]
+            values = equity + cash
+            if value_tree is not None:
+                value_tree[:len(values), i] = values
+            elif i < len(slices):
+                slices[i] = values
+        return slices if value_tree is None else value_tree
 
-    def greeks(self, asset):
-        return None
+    @staticmethod
+    def coupon_slices(asset, tree):
+        """ Coupons of a Mandatory summed onto the nearest time slice of the tree. Pay dates are placed relative to
+        maturity, and coupons paid on or before the valuation date are dropped.
+        :return: array of coupon cash amounts, one per time slice
+        """
+        coupons = np.zeros(tree.num_nodes + 1)
+        if asset.coupons:
+            times = tree.T - np.array([(asset.maturity - d).days for d in asset.pay_dates]) / 365.
+            future = times > 0
+            index = np.clip(np.rint(times[future] / tree.dt).astype(int), 1, tree.num_nodes)
+            np.add.at(coupons, index, np.asarray(asset.coupons, dtype=float)[future])
+        return coupons
 
     def __repr__(self):
         return "<LatticeMandyPricer: N=%d>" % self.n
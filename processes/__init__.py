@@ -1,3 +1,2 @@
-
-from .trees import Tree
-from .simulations import MonteCarlo
\ No newline at end of file
+from .trees import Tree, TianTree, LeisenReimerTree, TrinomialTree, TREES
+from .simulations import MonteCarlo
@@ -1,20 +1,32 @@
 
 import numpy as np
-import matplotlib.pyplot as plt
+from scipy.special import ndtri
+
+from ..curves import as_curve
 
 class MonteCarlo(object):
     """ Monte Carlo simulation - this class generates an m*n matrix following a GBM process """
-    def __init__(self, asset, T, rfr, num_paths, num_steps=None, dt=None, antithetic=False):
+    def __init__(self, asset, T, rfr, num_paths, num_steps=None, dt=None, antithetic=False, block_size=None,
+                 dtype=np.float64, seed=None, moment_matching=False, quasi_random=False):
         """ MonteCarlo simulations are the building block of path-dependent pricers and are based on a GBM stochastic
         process.
         :param asset: The underlying asset whose process is being simulated
         :param T: Time to maturity of the derivative
-        :param rfr: Risk-free rate (either a term-structure or a forward curve)
+        :param rfr: Risk-free rate, either a continuously-compounded float or a YieldCurve (each time step drifts at its
+            own forward rate)
         :param vol: Volatility of the underlying asset
         :param num_paths: number of paths to simulate
         :param num_steps: Optional (xor with dt) number of nodes to fit between now and T
         :param dt: Optional (xor with num_nodes) time-step between nodes
         :param antithetic: value of True pairs each path with its antithetic path improving convergence
+        :param block_size: Optional number of paths generated per block by MonteCarlo.blocks (defaults to all paths)
+        :param dtype: floating point type of the simulated paths (np.float64 or np.float32)
+        :param seed: Optional seed (int or numpy.random.SeedSequence). Every block of paths draws from its own child
+            stream of the seed, so a block can be simulated on any worker and still be reproducible.
+        :param moment_matching: value of True rescales the draws of each time step (within a block) to exactly zero
+            mean and unit variance
+        :param quasi_random: value of True replaces pseudo-random draws with a scrambled Sobol sequence (one independent
+            scrambling per block) assigned to the time steps by Brownian-bridge construction
         :return: None
         """
         self.asset = asset
@@ -22,6 +34,11 @@ class MonteCarlo(object):
         self.num_paths = num_paths
         self.rfr = rfr
         self.antithetic = antithetic
+        self.moment_matching = moment_matching
+        self.quasi_random = quasi_random
+        self.block_size = block_size or num_paths
+        self.dtype = np.dtype(dtype)
+        self.seed = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
 
         try:
             assert bool(dt) != bool(num_steps)
@@ -34,19 +51,105 @@ class MonteCarlo(object):
             num_steps = int(round(T / dt))
         self.num_steps = num_steps
         self.dt = dt
+        self.forwards = as_curve(rfr).steps(num_steps, dt)[0]
 
     def initialize(self):
-        randoms = np.random.randn(self.num_paths, self.num_steps)
+        """ Simulates every path at once
+        :return: num_paths x num_steps matrix of prices (2 * num_paths rows if antithetic)
+        """
+        return np.vstack(list(self.blocks()))
+
+    @property
+    def num_blocks(self):
+        return -(-self.num_paths // self.block_size)
+
+    def blocks(self):
+        """ Generates the paths one block of at most block_size draws at a time, so the memory used by a pricer that
+        consumes the blocks incrementally stays flat regardless of num_paths.
+        :return: generator of block_size x num_steps price matrices (twice as many rows if antithetic)
+        """
+        for i in range(self.num_blocks):
+            yield self.block(i)
+
+    def block(self, i):
+        """ Simulates block i of the paths from its own independent random stream (child i of the seed, as produced by
+        SeedSequence.spawn). The result only depends on the seed and i, not on the order in which blocks are drawn.
+        :param i: index of the block
+        :return: block_size x num_steps price matrix (twice as many rows if antithetic)
+        """
+        size = min(self.block_size, self.num_paths - i * self.block_size)
+        stream = np.random.SeedSequence(self.seed.entropy, spawn_key=self.seed.spawn_key + (i,))
+        if self.quasi_random:
+            randoms = self.sobol_normals(size, stream)
+        else:
+            # drawn time-step-major so that each time step (column) of the block is contiguous in memory, which is how
+            # the backward induction of the pricers reads it
+            randoms = np.random.default_rng(stream).standard_normal((self.num_steps, size), dtype=self.dtype).T
+        if self.moment_matching:
+            randoms -= randoms.mean(axis=0)
+            randoms /= randoms.std(axis=0)
         if self.antithetic:
-            randoms = np.vstack([randoms, -1*randoms])
-        q = self.asset.div
-        sims = np.exp((self.rfr - q - 0.5 * self.asset.vol**2)*self.dt + self.asset.vol*np.sqrt(self.dt)*randoms)
-        sims = self.asset.price * np.cumprod(sims, axis=1)
-
-        # rng = range(0, sims.shape[0])
-        # xval = range(0, sims.shape[1])
-        # for r in rng:
-        #     plt.plot(xval, sims[r, :])
-        # plt.show()
-
-        return sims
+            randoms = np.hstack([randoms.T, -1*randoms.T]).T
+        return self.paths(randoms)
+
+    def paths(self, randoms):
+        """ Turns a matrix of standard normal draws into GBM price paths, in place, by taking the cumulative sum of the
+        log-returns and exponentiating once.
+        :param randoms: paths x num_steps matrix of standard normal draws (overwritten)
+        :return: paths x num_steps matrix of prices at the end of each time step
+        """
+        q = self.asset.div or 0.
+        vol = self.asset.vol
+        randoms *= vol * np.sqrt(self.dt)
+        randoms += (self.forwards - q - 0.5 * vol**2) * self.dt
+        randoms[:, 0] += np.log(self.asset.price)
+        np.cumsum(randoms, axis=1, out=randoms)
+        return np.exp(randoms, out=randoms)
+
+    def sobol_normals(self, size, stream):
+        """ Standard normal increments from a scrambled Sobol sequence. The first (best distributed) Sobol dimensions
+        drive the Brownian motion at maturity and the successive midpoints through a Brownian bridge, so most of the
+        variance of the path is carried by low dimensions.
+        :param size: number of paths
+        :param stream: SeedSequence used to scramble the sequence
+        :return: size x num_steps matrix of standard normal increments
+        """
+        from scipy.stats import qmc
+        sobol = qmc.Sobol(d=self.num_steps, scramble=True, seed=np.random.default_rng(stream))
+        uniforms = sobol.random(size)
+        np.clip(uniforms, 1e-12, 1 - 1e-12, out=uniforms)
+        brownian = self.brownian_bridge(ndtri(uniforms))
+        increments = np.diff(brownian, axis=1, prepend=0.) / np.sqrt(self.dt)
+        return np.asfortranarray(increments, dtype=self.dtype)
+
+    def brownian_bridge(self, randoms):
+        """ Brownian-bridge construction (Jackel, 2002) of Brownian motion at the end of each time step: column 0 of
+        the draws fixes the terminal value, and each following column fills in the midpoint of the widest gap.
+        :param randoms: paths x num_steps matrix of independent standard normal draws
+        :return: paths x num_steps matrix of Brownian motion values
+        """
+        n = self.num_steps
+        times = self.dt * np.arange(1, n + 1)
+        brownian = np.empty_like(randoms)
+        brownian[:, -1] = np.sqrt(times[-1]) * randoms[:, 0]
+        built = np.zeros(n, dtype=bool)
+        built[-1] = True
+        left = 0
+        for i in range(1, n):
+            while built[left]:
+                left += 1
+            right = left
+            while not built[right]:
+                right += 1
+            mid = left + ((right - 1 - left) >> 1)
+            built[mid] = True
+            t_left = times[left - 1] if left else 0.
+            span = times[right] - t_left
+            std = np.sqrt((times[mid] - t_left) * (times[right] - times[mid]) / span)
+            brownian[:, mid] = (times[mid] - t_left) / span * brownian[:, right] + std * randoms[:, i]
+            if left:
+                brownian[:, mid] += (times[right] - times[mid]) / span * brownian[:, left - 1]
+            left = right + 1
+            if left >= n:
+                left = 0
+        return brownian
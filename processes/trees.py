@@ -1,20 +1,43 @@
-
+import copy
 import numpy as np
 
+from ..curves import YieldCurve
+
 
 class Tree(object):
-    def __init__(self, asset, T, rfr, num_nodes=None, dt=None):
+    """ Cox-Ross-Rubinstein binomial tree (u = exp(vol * sqrt(dt)), d = 1/u) """
+    branches = 2
+    order = 1
+    # the error swings with the parity of the number of steps rather than shrinking smoothly like 1/n^order, so the
+    # raw tree cannot be Richardson-extrapolated
+    oscillates = True
+    # u, d and p do not depend on spot, so the sub-tree from any node is the tree that would be built at that node's
+    # price (used by the scenario engine to read a whole spot ladder off one tree)
+    rescalable = True
+
+    def __init__(self, asset, T, rfr, num_nodes=None, dt=None, vol=None, strike=None):
         """ Trees are the building block for Lattice-based pricing models
         :param asset: The underlying asset whose process is being simulated
         :param T: Time to maturity of the derivative
-        :param rfr: Risk-free rate (either a term-structure or a forward curve)
-        :param num_nodes: Optional (xor with dt) number of nodes to fit between now and T
+        :param rfr: Risk-free rate, either a continuously-compounded float or a YieldCurve. The node spacing uses the
+            zero rate to T; the probabilities and discounting of each time step use that step's forward rate.
+        :param num_nodes: Optional (xor with dt) number of time steps to fit between now and T
         :param dt: Optional (xor with num_nodoes) time-step between nodes
+        :param vol: Optional volatility override (defaults to asset.vol)
+        :param strike: Optional strike of the derivative, used by trees that centre their nodes on it (Leisen-Reimer)
         :return:
+
+        With a flat rate, the asset's price, vol and div, T, rfr, vol and strike may also be arrays with one entry per
+        option (and num_nodes given): the tree is then built directly as a stacked tree with one column per option,
+        as Tree.stack would return, for batch pricers.
         """
         self.asset = asset
         self.T = T
-        self.rfr = rfr
+        self.curve = rfr if isinstance(rfr, YieldCurve) else None
+        self.rfr = float(self.curve.zero(T)) if self.curve is not None else _column(rfr)
+        self.vol = _column(asset.vol if vol is None else vol)
+        self.div = _column(asset.div if asset.div is not None else 0.)
+        self.strike = strike
 
         try:
             assert bool(dt) != bool(num_nodes)
@@ -22,26 +45,189 @@ class Tree(object):
             raise KeyError('One and only one of num_nodes or dt must be provided in initialization')
 
         if not dt:
-            dt = float(T) / num_nodes
+            dt = _column(T) / num_nodes
         else:
             num_nodes = int(round(T / dt))
         self.num_nodes = num_nodes
         self.dt = dt
-        self.u = np.exp(asset.vol * np.sqrt(self.dt))
-        self.d = 1 / self.u
-        self.p = (np.exp(self.rfr * self.dt) - self.d) / (self.u - self.d)
-        self.lattice = None
+        if self.curve is not None:
+            self.forwards, self.discounts = self.curve.steps(num_nodes, dt)
+        else:
+            # a flat rate skips building a curve; the per-step rates are read-only views of the one rate
+            shape = (num_nodes,) + np.shape(self.rfr)
+            self.forwards = np.broadcast_to(self.rfr, shape)
+            self.discounts = np.broadcast_to(np.exp(-self.rfr * dt), shape)
+        self.u, self.d, self.p = self.parameters()
+        if self.curve is not None:
+            self.probabilities = self.step_probabilities()
+        else:
+            # every step has the probabilities of the first one
+            first = self.step_probabilities(self.forwards[:1])
+            self.probabilities = np.broadcast_to(first, (num_nodes,) + first.shape[1:])
+        self._up = None
+        self._down = None
+
+    def parameters(self):
+        """ up-move, down-move and risk-neutral up probability for one time step """
+        u = np.exp(self.vol * np.sqrt(self.dt))
+        d = 1 / u
+        return u, d, (self.growth() - d) / (u - d)
+
+    def growth(self, rate=None):
+        """ risk-neutral growth of the underlying over one time step (at the zero rate to T unless rate is given) """
+        if rate is None: rate = self.rfr
+        return np.exp((rate - self.div) * self.dt)
+
+    def step_probabilities(self, forwards=None):
+        """ risk-neutral up probability of each time step, from the forward rate over that step
+        :param forwards: optional forward rates of the steps (defaults to self.forwards)
+        """
+        if forwards is None: forwards = self.forwards
+        return (self.growth(forwards) - self.d) / (self.u - self.d)
 
     def initialize(self):
-        self.lattice = np.zeros((self.num_nodes, self.num_nodes))
-        self.lattice[0,0] = self.asset.price
+        """ Precomputes the powers of u and d used to generate node prices. Node prices are built one time slice at a
+        time by Tree.prices rather than being stored in a dense matrix.
+        """
+        steps = self.by_column(np.arange(self.num_nodes + 1))
+        self._up = self.asset.price * self.u ** steps
+        self._down = self.d ** steps
+
+    def by_column(self, steps):
+        """ steps as a column (nodes x 1) when the tree holds one column per option, unchanged otherwise """
+        return steps.reshape((-1,) + (1,) * np.ndim(self.u))
+
+    def prices(self, i):
+        """ Node prices at time slice i, ordered from the highest node (all up-moves) to the lowest (all down-moves)
+        :param i: index of the time slice (0 is the valuation date, num_nodes is maturity)
+        :return: array of underlying prices (i+1 nodes for binomial trees)
+        """
+        return self._up[i::-1] * self._down[:i+1]
+
+    def expect(self, values, i):
+        """ Discounted risk-neutral expectation of a slice of values, one time step back
+        :param values: array of values at time slice i+1
+        :param i: index of the time slice being computed
+        :return: array of values at time slice i
+        """
+        p = self.probabilities[i]
+        return (values[:-1] * p + values[1:] * (1 - p)) * self.discounts[i]
 
-        for i in range(1, self.num_nodes):
-            for j in range(i+1):
-                if j == 0:
-                    self.lattice[j, i] = self.lattice[j, i-1] * self.u
-                else:
-                    self.lattice[j, i] = self.lattice[j-1, i-1] * self.d
+    @property
+    def lattice(self):
+        """ Dense upper-triangular matrix of node prices (row = number of down-moves, column = time slice). This is
+        only built on request, e.g. for inspection; pricers should use Tree.prices.
+        """
+        lattice = np.zeros((len(self.prices(self.num_nodes)), self.num_nodes + 1))
+        for i in range(self.num_nodes + 1):
+            nodes = self.prices(i)
+            lattice[:len(nodes), i] = nodes
+        return lattice
 
     def disc(self, value, per=1):
-        return value / (1 + self.rfr)**(self.dt * per)
+        return value * np.exp(-self.rfr * self.dt * per)
+
+    @staticmethod
+    def stack(trees):
+        """ Combines initialized trees of the same class and number of steps into one tree whose node prices,
+        probabilities, discounts, forwards, vol and rates carry a trailing axis with one column per tree (as do T, dt,
+        div and strike when they differ between the trees). A pricer's backpropagate then rolls every tree back in the
+        same vectorized operations.
+        :param trees: list of initialized trees
+        :return: stacked tree
+        """
+        stacked = copy.copy(trees[0])
+        for name in ('probabilities', 'discounts', 'forwards', 'vol', 'rfr', 'u', 'd', 'p', '_up', '_down'):
+            if getattr(stacked, name) is not None:
+                setattr(stacked, name, np.stack([np.asarray(getattr(tree, name)) for tree in trees], axis=-1))
+        for name in ('T', 'dt', 'div', 'strike'):
+            values = [getattr(tree, name) for tree in trees]
+            if any(v != values[0] for v in values[1:]):
+                setattr(stacked, name, np.array(values, dtype=float))
+        return stacked
+
+
+class TianTree(Tree):
+    """ Tian (1993) binomial tree, which matches the first three moments of the lognormal distribution """
+
+    def parameters(self):
+        m = self.growth()
+        v = np.exp(self.vol**2 * self.dt)
+        root = np.sqrt(v**2 + 2 * v - 3)
+        u = 0.5 * m * v * (v + 1 + root)
+        d = 0.5 * m * v * (v + 1 - root)
+        return u, d, (m - d) / (u - d)
+
+
+class LeisenReimerTree(Tree):
+    """ Leisen-Reimer (1996) binomial tree. Nodes are centred on the strike using the Peizer-Pratt inversion of d1 and
+    d2, which removes the odd/even oscillation of CRR and converges at order 1/n^2. Requires an odd number of steps
+    (an even num_nodes is rounded up) and a strike.
+    """
+    order = 2
+    oscillates = False
+    rescalable = False
+
+    def __init__(self, asset, T, rfr, num_nodes=None, dt=None, vol=None, strike=None):
+        if strike is None or not np.all(strike):
+            raise ValueError('LeisenReimerTree requires the strike of the derivative')
+        if num_nodes and num_nodes % 2 == 0:
+            num_nodes += 1
+        super(LeisenReimerTree, self).__init__(asset, T, rfr, num_nodes=num_nodes, dt=dt, vol=vol, strike=strike)
+
+    def parameters(self):
+        vol_t = self.vol * np.sqrt(self.T)
+        d1 = (np.log(self.asset.price / self.strike) + (self.rfr - self.div + 0.5 * self.vol**2) * self.T) / vol_t
+        d2 = d1 - vol_t
+        p = self.peizer_pratt(d2, self.num_nodes)
+        m = self.growth()
+        u = m * self.peizer_pratt(d1, self.num_nodes) / p
+        d = (m - p * u) / (1 - p)
+        return u, d, p
+
+    @staticmethod
+    def peizer_pratt(z, n):
+        """ Peizer-Pratt method 2 inversion of the normal cdf onto a binomial probability """
+        return 0.5 + np.copysign(0.5, z) * np.sqrt(1 - np.exp(-(z / (n + 1. / 3 + 0.1 / (n + 1)))**2 * (n + 1. / 6)))
+
+
+class TrinomialTree(Tree):
+    """ Boyle (1986) trinomial tree with u = exp(vol * sqrt(2dt)), m = 1 and d = 1/u. Time slice i holds 2i+1 nodes. """
+    branches = 3
+    oscillates = False
+
+    def parameters(self):
+        u = np.exp(self.vol * np.sqrt(2 * self.dt))
+        self.pu, self.pm, self.pd = self.branch_probabilities(self.rfr)
+        return u, 1 / u, self.pu
+
+    def branch_probabilities(self, rate):
+        """ up, middle and down probabilities of one time step at the given rate (float or array of rates) """
+        half_up = np.exp(self.vol * np.sqrt(self.dt / 2))
+        half_growth = np.exp((rate - self.div) * self.dt / 2)
+        pu = ((half_growth - 1 / half_up) / (half_up - 1 / half_up))**2
+        pd = ((half_up - half_growth) / (half_up - 1 / half_up))**2
+        return pu, 1 - pu - pd, pd
+
+    def step_probabilities(self, forwards=None):
+        if forwards is None: forwards = self.forwards
+        return np.stack(self.branch_probabilities(forwards), axis=1)
+
+    def initialize(self):
+        self._up = self.asset.price * self.u ** self.by_column(np.arange(-self.num_nodes, self.num_nodes + 1))
+
+    def prices(self, i):
+        centre = self.num_nodes
+        return self._up[centre + i:centre - i - 1 if centre - i > 0 else None:-1]
+
+    def expect(self, values, i):
+        pu, pm, pd = self.probabilities[i]
+        return (values[:-2] * pu + values[1:-1] * pm + values[2:] * pd) * self.discounts[i]
+
+
+def _column(value):
+    """ float of a scalar parameter, or the float array of a parameter given per option """
+    return float(value) if np.ndim(value) == 0 else np.asarray(value, dtype=float)
+
+
+TREES = {'crr': Tree, 'tian': TianTree, 'lr': LeisenReimerTree, 'trinomial': TrinomialTree}
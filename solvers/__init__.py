@@ -1,2 +1,2 @@
-
-from .regressions import LSM
\ No newline at end of file
+from .regressions import LSM
+from .statistics import RunningStats
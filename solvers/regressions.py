@@ -1,16 +1,42 @@
-
-import statsmodels.api as sm
 import numpy as np
 
 
 class LSM(object):
+    """ Least-squares regression of continuation values on a basis of functions of the state, as used by the
+    Longstaff-Schwartz algorithm. Solves the (small) normal equations with NumPy instead of fitting a full OLS model,
+    which keeps the per-exercise-date overhead negligible.
+    """
     def __init__(self, lambdas):
         self.lambdas = lambdas
 
-    def calc(self, y, x):
-        X = np.zeros((len(x), len(self.lambdas)))
+    def basis(self, x):
+        """ Basis matrix with one column per basis function followed by a constant column
+        :param x: array of states
+        :return: len(x) x (len(lambdas) + 1) matrix
+        """
+        X = np.empty((len(x), len(self.lambdas) + 1), order='F')
         for i in range(0, len(self.lambdas)):
             X[:, i] = self.lambdas[i](x)
+        X[:, -1] = 1.
+        return X
+
+    def calc(self, y, x):
+        """ Regression parameters of y on the basis functions of x (constant last)
+        :param y: array of observations
+        :param x: array of states
+        :return: array of parameters
+        """
+        return self.solve(self.basis(x), y)
 
-        ols = sm.OLS(y, sm.add_constant(X, prepend=False)).fit()
-        return ols.params
+    @staticmethod
+    def solve(X, y):
+        """ Least-squares parameters for a precomputed basis matrix, from the normal equations when they are well
+        conditioned and from an SVD-based solve otherwise
+        :param X: basis matrix
+        :param y: array of observations
+        :return: array of parameters
+        """
+        gram = np.dot(X.T, X)
+        if np.linalg.cond(gram) < 1e10:
+            return np.linalg.solve(gram, np.dot(X.T, y))
+        return np.linalg.lstsq(X, y, rcond=None)[0]
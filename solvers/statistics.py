@@ -0,0 +1,54 @@
+import numpy as np
+
+
+class RunningStats(object):
+    """ Streaming mean and variance (Welford) that can be merged across blocks of paths or worker processes using the
+    pairwise update of Chan, Golub & LeVeque. Merging the same blocks in the same order is bit-for-bit reproducible.
+    """
+    def __init__(self, count=0, mean=0., m2=0.):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    @classmethod
+    def from_values(cls, values):
+        """ Statistics of a block of samples
+        :param values: array of samples
+        :return: RunningStats instance
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return cls()
+        mean = values.mean()
+        return cls(len(values), float(mean), float(((values - mean)**2).sum()))
+
+    def update(self, values):
+        """ Adds a block of samples
+        :param values: array of samples
+        :return: self
+        """
+        return self.merge(RunningStats.from_values(values))
+
+    def merge(self, other):
+        """ Combines the statistics of another (disjoint) set of samples into this one
+        :param other: RunningStats instance
+        :return: self
+        """
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta**2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else np.nan
+
+    @property
+    def std_err(self):
+        return np.sqrt(self.variance / self.count) if self.count > 1 else np.nan
+
+    def __repr__(self):
+        return "<RunningStats: N=%d mean=%.6g se=%.3g>" % (self.count, self.mean, self.std_err)
@@ -1,8 +1,12 @@
 
 import unittest
 import datetime
-from simpaq.assets.standard import Equity, Option
+import numpy as np
+from simpaq.assets.standard import Equity, Option, Mandatory
+from simpaq.curves import YieldCurve
 from simpaq.pricers import BlackScholesPricer, DCF
+from simpaq.pricers.analytic import BlackScholesMandyPricer
+from simpaq.pricers.numerical import LatticeMandyPricer
 
 
 class TestBlackScholesOptionPricer(unittest.TestCase):
@@ -35,14 +39,90 @@ class TestBlackScholesOptionPricer(unittest.TestCase):
         with self.assertRaises(TypeError):
             self.american.calc_price(self.pricer)
 
-    @unittest.skip("Not yet implemented")
     def test_BlackScholes_greeks(self):
         """ BlackScholesPricer returns tuple of correct types for option greeks """
-        #TODO: Test greeks as correct length tuple of floats
-        pass
+        price, greeks = self.call.calc_price(self.pricer, greeks=True)
+        self.assertTrue(type(price) == float)
+        self.assertEqual(sorted(greeks), ['delta', 'div_rho', 'gamma', 'rho', 'theta', 'vega'])
+        self.assertTrue(all(type(v) == float for v in greeks.values()))
+
+    def test_greeks_match_bumps(self):
+        """ Analytic greeks agree with central-difference bumps of price_batch """
+        args = dict(S=10., K=12., T=1., rfr=0.01, vol=0.25, div=0.02, call=np.array([True, False]))
+        _, greeks = self.pricer.price_batch(greeks=True, **args)
+        h = 1e-4
+        for name, key, scale in (('delta', 'S', 1.), ('vega', 'vol', 1.), ('rho', 'rfr', 1.),
+                                 ('div_rho', 'div', 1.), ('theta', 'T', -1.)):
+            up = self.pricer.price_batch(**dict(args, **{key: args[key] + h}))
+            down = self.pricer.price_batch(**dict(args, **{key: args[key] - h}))
+            np.testing.assert_allclose(greeks[name], scale * (up - down) / (2 * h), atol=1e-5)
 
     def test_PutCallParity(self):
         """ Put-Call Parity holds for a basket of (+1 Call, -1 Put) = Forward contract """
         parity = self.underlying.price - DCF().price(self.valuation_date, [self.call.strike], [self.maturity], 0.01)
         synthetic = self.call.calc_price(self.pricer)-self.put.calc_price(self.pricer)
         self.assertAlmostEqual(parity, synthetic, 2)
+
+    def test_batch_matches_scalar(self):
+        """ BlackScholesPricer.price_batch matches the scalar path for a mixed book of calls and puts """
+        prices = self.pricer.price_batch(S=10., K=np.array([12., 12.]), T=1., rfr=0.01, vol=0.25,
+                                         call=np.array([True, False]))
+        self.assertEqual(prices.shape, (2,))
+        self.assertAlmostEqual(prices[0], self.call.calc_price(self.pricer), 3)
+        self.assertAlmostEqual(prices[1], self.put.calc_price(self.pricer), 3)
+
+    def test_batch_greeks(self):
+        """ BlackScholesPricer.price_batch returns greek arrays aligned with the prices """
+        prices, greeks = self.pricer.price_batch(S=np.linspace(8, 12, 5), K=10., T=0.5, rfr=0.01, vol=0.25,
+                                                 greeks=True)
+        for name in ('delta', 'gamma', 'vega'):
+            self.assertEqual(greeks[name].shape, prices.shape)
+        self.assertTrue(np.all(np.diff(greeks['delta']) > 0))
+
+
+class TestBlackScholesMandyPricer(unittest.TestCase):
+
+    def setUp(self):
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0.03)
+        self.valuation_date = datetime.date.today()
+        self.maturity = self.valuation_date + datetime.timedelta(days=730)
+        pay_dates = [self.maturity - datetime.timedelta(days=91 * k) for k in range(8)]
+        self.mandies = [Mandatory('AAA %d' % i, 'AAA Mandatory', self.underlying, par=50., r1=par / 50. * 5.,
+                                  r2=par / 50. * 4., rfr=0.05, spread=0.03, maturity=self.maturity, American=False,
+                                  coupons=[par * 0.065 / 4] * 8 if i else [], pay_dates=pay_dates if i else [])
+                        for i, par in enumerate((50., 50., 25.))]
+        self.pricer = BlackScholesMandyPricer()
+
+    def test_matches_lattice_and_coupons(self):
+        """ Without coupons the analytic price matches the European lattice; coupons add their discounted value """
+        plain, coupon, _ = self.pricer.price_portfolio(self.mandies, valuation_date=self.valuation_date)
+        self.assertAlmostEqual(plain, self.mandies[0].calc_price(LatticeMandyPricer(n=1000)), 2)
+        self.assertAlmostEqual(coupon, self.mandies[1].calc_price(LatticeMandyPricer(n=1000)), 2)
+        times = DCF.year_fractions(self.valuation_date, self.mandies[1].pay_dates)
+        annuity = np.sum(np.asarray(self.mandies[1].coupons) * np.exp(-0.08 * times))
+        self.assertAlmostEqual(coupon - plain, annuity, 10)
+
+    def test_flat_curve_coupons(self):
+        """ A float rate and the flat YieldCurve at the same rate discount the coupons identically """
+        flat = self.pricer.price_portfolio(self.mandies, valuation_date=self.valuation_date)
+        curve = self.pricer.price_portfolio(self.mandies, rfr=YieldCurve.flat(0.05), valuation_date=self.valuation_date)
+        np.testing.assert_allclose(curve, flat, rtol=1e-12)
+        legs = [self.pricer.coupon_leg(self.mandies, [rate] * 3, np.full(3, 0.03), self.valuation_date)
+                for rate in (0.05, YieldCurve.flat(0.05))]
+        for float_leg, curve_leg in zip(*legs):
+            np.testing.assert_allclose(curve_leg, float_leg, rtol=1e-12)
+
+    def test_portfolio_greeks(self):
+        """ The portfolio matches the scalar pricer and its combined greeks match finite differences """
+        prices, greeks = self.pricer.price_portfolio(self.mandies, greeks=True, valuation_date=self.valuation_date)
+        for price, mandy in zip(prices, self.mandies):
+            self.assertAlmostEqual(round(price, 3), mandy.calc_price(self.pricer), 10)
+        h = 1e-4
+        for name, bump in (('delta', dict(price=10 + h)), ('vega', dict(vol=0.25 + h))):
+            for key, value in bump.items():
+                setattr(self.underlying, key, value)
+            up = self.pricer.price_portfolio(self.mandies, valuation_date=self.valuation_date)
+            self.underlying.price, self.underlying.vol = 10, 0.25
+            np.testing.assert_allclose(greeks[name], (up - prices) / h, rtol=1e-3)
+        up = self.pricer.price_portfolio(self.mandies, rfr=0.05 + h, valuation_date=self.valuation_date)
+        np.testing.assert_allclose(greeks['rho'], (up - prices) / h, rtol=1e-3)
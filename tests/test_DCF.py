@@ -0,0 +1,37 @@
+import unittest
+import datetime
+import numpy as np
+from simpaq.pricers import DCF
+
+
+class TestDCF(unittest.TestCase):
+
+    def setUp(self):
+        self.valuation_date = datetime.date(2024, 1, 1)
+        self.pay_dates = [self.valuation_date + datetime.timedelta(days=91 * i) for i in range(1, 13)]
+        self.cash_flows = [1.5] * 11 + [51.5]
+        DCF.clear_cache()
+
+    def test_matches_cash_flow_loop(self):
+        """ Vectorized price equals discounting each cash flow separately """
+        expected = sum(DCF.discount(cf, (dt - self.valuation_date).days / 365.25, 0.05)
+                       for cf, dt in zip(self.cash_flows, self.pay_dates))
+        self.assertAlmostEqual(DCF().price(self.valuation_date, self.cash_flows, self.pay_dates, 0.05), expected, 10)
+
+    def test_rate_ladder_reuses_year_fractions(self):
+        """ Pricing across a rate ladder computes the schedule's year fractions once """
+        ladder = np.linspace(0.03, 0.07, 5)
+        prices = DCF().price(self.valuation_date, self.cash_flows, self.pay_dates, ladder)
+        for rate in ladder:
+            DCF().price(self.valuation_date, self.cash_flows, self.pay_dates, float(rate))
+        self.assertEqual(len(DCF._times), 1)
+        self.assertTrue((np.diff(prices) < 0).all())
+        self.assertAlmostEqual(prices[2], DCF().price(self.valuation_date, self.cash_flows, self.pay_dates, 0.05), 10)
+
+    def test_portfolio_matches_individual(self):
+        """ Portfolio pricing over merged schedules matches pricing each instrument on its own """
+        flows = [self.cash_flows, [2.] * 4, [10.]]
+        dates = [self.pay_dates, self.pay_dates[1::3], [self.valuation_date + datetime.timedelta(days=200)]]
+        prices = DCF().price_portfolio(self.valuation_date, flows, dates, 0.05)
+        for price, cf, dt in zip(prices, flows, dates):
+            self.assertAlmostEqual(price, DCF().price(self.valuation_date, cf, dt, 0.05), 10)
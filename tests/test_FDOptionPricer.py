@@ -0,0 +1,44 @@
+import unittest
+import datetime
+import numpy as np
+from simpaq.assets.standard import Equity, Option
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer, FDOptionPricer
+from simpaq.fd import FiniteDifference
+
+
+class TestFDOptionPricer(unittest.TestCase):
+
+    def setUp(self):
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0)
+        self.valuation_date = datetime.date.today()
+        self.maturity = self.valuation_date + datetime.timedelta(days=365)
+        self.put_eur = Option('AAA P12', 'PutOption', self.underlying, 12, 0.05, self.maturity, call=False,
+                              American=False)
+        self.put_amer = Option('AAA P12', 'AmPut', self.underlying, 12, 0.05, self.maturity, call=False,
+                               American=True)
+
+    def test_grid_concentrated_at_strike(self):
+        """ Grid starts at zero, is increasing, and is finest around the strike """
+        grid = FiniteDifference(self.underlying, T=1., rfr=0.05)
+        grid.initialize(M=200, N=100, centre=12.)
+        spacing = np.diff(grid.prices)
+        self.assertEqual(grid.prices[0], 0.)
+        self.assertTrue((spacing > 0).all())
+        self.assertEqual(np.argmin(spacing), np.searchsorted(grid.prices, 12.) - 1)
+
+    def test_european_matches_black_scholes(self):
+        """ European price and greeks agree with Black-Scholes """
+        price, greeks = FDOptionPricer(n=500, m=500).price(self.put_eur, self.underlying, 0.05, greeks=True)
+        bsprice, bsgreeks = BlackScholesPricer().price(self.put_eur, self.underlying, 0.05, greeks=True)
+        self.assertAlmostEqual(price, bsprice, 3)
+        for greek in ('delta', 'gamma', 'theta'):
+            self.assertAlmostEqual(greeks[greek], bsgreeks[greek], delta=0.01 * abs(bsgreeks[greek]))
+
+    def test_american_matches_lattice(self):
+        """ American put price and greeks agree with a fine binomial lattice """
+        price, greeks = FDOptionPricer(n=500, m=500).price(self.put_amer, self.underlying, 0.05, greeks=True)
+        lprice, lgreeks = LatticeOptionPricer(n=2000).price(self.put_amer, self.underlying, 0.05, greeks=True)
+        self.assertAlmostEqual(price, lprice, 2)
+        self.assertAlmostEqual(greeks['delta'], lgreeks['delta'], 3)
+        self.assertAlmostEqual(greeks['gamma'], lgreeks['gamma'], delta=0.01 * lgreeks['gamma'])
+        self.assertGreaterEqual(price, 2.)
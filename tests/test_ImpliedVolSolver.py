@@ -0,0 +1,45 @@
+import unittest
+import numpy as np
+from simpaq.curves import YieldCurve
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer, ImpliedVolSolver
+
+
+class TestImpliedVolSolver(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        self.S, self.r, self.q = 100., 0.03, 0.01
+        self.K = rng.uniform(60, 140, 400)
+        self.T = rng.uniform(0.1, 2., 400)
+        self.vol = rng.uniform(0.1, 0.9, 400)
+        self.call = rng.random(400) < 0.5
+
+    def test_black_scholes_round_trip(self):
+        """ A book of European quotes is inverted to its vols in a few Halley iterations """
+        prices, greeks = BlackScholesPricer().price_batch(self.S, self.K, self.T, self.r, self.vol, self.q, self.call,
+                                                          greeks=True)
+        result = ImpliedVolSolver().solve(prices, self.S, self.K, self.T, YieldCurve.flat(self.r), self.q, self.call)
+        self.assertTrue(result['converged'].all())
+        self.assertLessEqual(result['iterations'].max(), 10)
+        identified = greeks['vega'] > 0.1
+        np.testing.assert_allclose(result['vol'][identified], self.vol[identified], atol=1e-6)
+
+    def test_arbitrage_quotes(self):
+        """ Quotes outside the no-arbitrage bounds are flagged and return NaN """
+        result = ImpliedVolSolver().solve([0.5, 120., 5.], 100., [50., 100., 100.], 1., 0.03, call=True)
+        np.testing.assert_array_equal(result['converged'], [False, False, True])
+        self.assertTrue(np.isnan(result['vol'][:2]).all())
+
+    def test_american_round_trip(self):
+        """ American quotes are inverted against the batched lattice, warm-started from the European vols """
+        lattice = LatticeOptionPricer(n=100)
+        rows = slice(0, 100)
+        args = (self.S, self.K[rows], self.T[rows], self.r)
+        prices = lattice.price_batch(*args + (self.vol[rows], self.q, self.call[rows]), American=True)
+        result = ImpliedVolSolver(lattice=lattice, tol=1e-7).solve(prices, *args, div=self.q, call=self.call[rows],
+                                                                   American=True)
+        self.assertTrue(result['converged'].all())
+        # deep in-the-money quotes priced at immediate exercise do not identify a vol
+        exercised = prices - np.maximum(np.where(self.call[rows], self.S - self.K[rows], self.K[rows] - self.S), 0.)
+        identified = exercised > 1e-3
+        np.testing.assert_allclose(result['vol'][identified], self.vol[rows][identified], atol=1e-4)
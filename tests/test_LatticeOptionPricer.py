@@ -0,0 +1,177 @@
+import unittest
+import datetime
+import tracemalloc
+import numpy as np
+from simpaq.assets.standard import Equity, Option, Mandatory, Derivative
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer
+from simpaq.pricers.numerical import LatticeMandyPricer
+from simpaq.features import EEPenalty
+from simpaq.processes import Tree, TREES
+
+
+class TestLatticeOptionPricer(unittest.TestCase):
+
+    def setUp(self):
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0)
+        self.valuation_date = datetime.date.today()
+        self.maturity = self.valuation_date + datetime.timedelta(days=365)
+        self.put_eur = Option('AAA P12', 'PutOption', self.underlying, 12, 0.05, self.maturity, call=False,
+                              American=False)
+        self.put_amer = Option('AAA P12', 'AmPut', self.underlying, 12, 0.05, self.maturity, call=False,
+                               American=True)
+
+    def test_tree_prices(self):
+        """ Tree.prices generates the same node prices as repeated up/down moves """
+        tree = Tree(self.underlying, T=1., rfr=0.05, num_nodes=5)
+        tree.initialize()
+        np.testing.assert_allclose(tree.prices(3), 10 * tree.u ** np.array([3, 1, -1, -3]))
+        self.assertEqual(tree.lattice.shape, (6, 6))
+
+    def test_column_trees_match_stack(self):
+        """ A tree built from per-option parameter arrays equals the stack of the trees built one option at a time """
+        S, K, T = np.array([9., 10., 12.]), np.array([10., 12., 11.]), np.array([0.5, 1., 2.])
+        rfr, vol, div = np.array([0.01, 0.05, 0.03]), np.array([0.2, 0.25, 0.4]), np.array([0., 0.01, 0.02])
+        for name, tree_class in TREES.items():
+            tree = tree_class(Equity(None, None, price=S, vol=vol, div=div), T=T, rfr=rfr, num_nodes=21, strike=K)
+            tree.initialize()
+            trees = [tree_class(Equity(None, None, price=S[j], vol=vol[j], div=div[j]), T=T[j], rfr=rfr[j],
+                                num_nodes=21, strike=K[j]) for j in range(3)]
+            for single in trees:
+                single.initialize()
+            stacked = Tree.stack(trees)
+            for i in (0, 1, 21):
+                np.testing.assert_allclose(tree.prices(i), stacked.prices(i), rtol=1e-12, err_msg=name)
+                np.testing.assert_allclose(tree.probabilities[min(i, 20)], stacked.probabilities[min(i, 20)],
+                                           rtol=1e-12, err_msg=name)
+
+    def test_european_converges_to_black_scholes(self):
+        """ European lattice price is within a cent of Black-Scholes """
+        bsprice = self.put_eur.calc_price(BlackScholesPricer())
+        lprice = self.put_eur.calc_price(LatticeOptionPricer(n=500))
+        self.assertAlmostEqual(bsprice, lprice, 2)
+
+    def test_early_exercise_premium(self):
+        """ American put is worth at least its European counterpart and its intrinsic value """
+        pricer = LatticeOptionPricer(n=200)
+        amer = self.put_amer.calc_price(pricer)
+        self.assertGreater(amer, self.put_eur.calc_price(pricer))
+        self.assertGreaterEqual(amer, 2.)
+
+    def test_rolling_matches_dense(self):
+        """ Rolling lattice mode returns the same price and leading slices as the dense value tree """
+        tree = Tree(self.underlying, T=1., rfr=0.05, num_nodes=50)
+        tree.initialize()
+        dense = LatticeOptionPricer(n=50).backpropagate(self.put_amer, tree)
+        slices = LatticeOptionPricer(n=50).backpropagate(self.put_amer, tree, keep=3)
+        for i, values in enumerate(slices):
+            np.testing.assert_allclose(values, dense[:i+1, i])
+        self.assertEqual(self.put_amer.calc_price(LatticeOptionPricer(n=50, rolling=False)),
+                         self.put_amer.calc_price(LatticeOptionPricer(n=50)))
+
+    def test_rolling_memory(self):
+        """ Rolling lattice mode at n=10,000 never holds more than a few slices in memory """
+        tracemalloc.start()
+        self.put_amer.calc_price(LatticeOptionPricer(n=10000))
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(peak, 10 * 10000 * 8)
+
+    def test_greeks_match_black_scholes(self):
+        """ Lattice greeks for a European put agree with the closed-form Black-Scholes greeks """
+        _, bsgreeks = self.put_eur.calc_price(BlackScholesPricer(), greeks=True)
+        _, lgreeks = self.put_eur.calc_price(LatticeOptionPricer(n=500, bump_greeks=True), greeks=True)
+        self.assertEqual(sorted(lgreeks), ['delta', 'gamma', 'rho', 'theta', 'vega'])
+        for name, tol in (('delta', 0.02), ('gamma', 0.02), ('theta', 0.02), ('vega', 0.02), ('rho', 0.02)):
+            self.assertAlmostEqual(lgreeks[name], bsgreeks[name], delta=tol * abs(bsgreeks[name]))
+
+    def test_mandy_greeks(self):
+        """ LatticeMandyPricer returns a price and lattice greeks through greeks=True """
+        mandy = Mandatory('AAA 6.5%', 'AAA Mandatory', self.underlying, par=50., r1=5., r2=4., rfr=0.05,
+                          maturity=self.maturity, American=False)
+        price, greeks = mandy.calc_price(LatticeMandyPricer(n=50), greeks=True)
+        self.assertTrue(40. < price < 50.)
+        self.assertTrue(0. < greeks['delta'] < mandy.r1)
+
+    def test_mandy_payoff_protocol(self):
+        """ Mandatory parity and exercise_value work on arrays, so LatticeOptionPricer rolls back whole slices """
+        mandy = Mandatory('AAA 6.5%', 'AAA Mandatory', self.underlying, par=50., r1=5., r2=4., rfr=0.05,
+                          maturity=self.maturity, American=True)
+        mandy.add_feature(EEPenalty(ratio=4., penalty=2.))
+        prices = np.array([5., 9., 11., 12.5, 15.])
+        np.testing.assert_allclose(mandy.parity(prices), [25., 45., 50., 50., 60.])
+        np.testing.assert_allclose(mandy.exercise_value(prices), [18., 34., 42., 50., 60.])
+        self.assertEqual(mandy.calc_price(LatticeOptionPricer(n=100)), mandy.calc_price(LatticeMandyPricer(n=100)))
+
+    def test_smooth_requires_strike(self):
+        """ Smoothing is rejected with a ValueError for derivatives without a strike, such as a Mandatory """
+        mandy = Mandatory('AAA 6.5%', 'AAA Mandatory', self.underlying, par=50., r1=5., r2=4., rfr=0.05,
+                          maturity=self.maturity, American=False)
+        with self.assertRaises(ValueError):
+            mandy.calc_price(LatticeOptionPricer(n=100, smooth=True))
+
+    def test_mandy_rejects_leisen_reimer(self):
+        """ LatticeMandyPricer refuses Leisen-Reimer trees, which need a strike that a Mandatory does not have """
+        with self.assertRaises(ValueError):
+            LatticeMandyPricer(n=101, tree='lr')
+
+    def test_payoff_required(self):
+        """ A derivative without a parity payoff (the Derivative base class) is rejected by the lattice pricers """
+        derivative = Derivative('AAA X', 'Derivative', self.underlying, 0.05, maturity=self.maturity)
+        self.assertIsNone(derivative.parity(10.))
+        with self.assertRaises(TypeError):
+            derivative.calc_price(LatticeOptionPricer(n=50))
+
+    def test_mandy_coupons(self):
+        """ Coupons are carried in the cash component and discounted at the risk-free rate plus the credit spread """
+        pay_dates = [self.maturity - datetime.timedelta(days=91 * k) for k in range(4)]
+        terms = dict(par=50., r1=5., r2=4., rfr=0.05, spread=0.03, maturity=self.maturity, American=False)
+        plain = Mandatory('AAA 0%', 'AAA Mandatory', self.underlying, **terms)
+        paying = Mandatory('AAA 6.5%', 'AAA Mandatory', self.underlying, coupons=[0.8125] * 4, pay_dates=pay_dates,
+                           **terms)
+        pricer = LatticeMandyPricer(n=365)
+        times = np.array([(d - self.valuation_date).days for d in pay_dates]) / 365.
+        self.assertAlmostEqual(paying.calc_price(pricer) - plain.calc_price(pricer),
+                               np.sum(0.8125 * np.exp(-0.08 * times)), 2)
+
+    def test_tree_families_converge(self):
+        """ Leisen-Reimer, Tian, trinomial and smoothed CRR trees all price a European put to a cent at n=100 """
+        bsprice = self.put_eur.calc_price(BlackScholesPricer())
+        for tree in ('crr', 'lr', 'tian', 'trinomial'):
+            lprice = self.put_eur.calc_price(LatticeOptionPricer(n=100, tree=tree, smooth=True))
+            self.assertAlmostEqual(bsprice, lprice, 2)
+
+    def test_tree_families_theta(self):
+        """ Theta matches Black-Scholes on trees whose middle node does not stay at spot (Leisen-Reimer, Tian) """
+        bsgreeks = BlackScholesPricer().price(self.put_eur, self.underlying, 0.05, greeks=True)[1]
+        for tree in ('lr', 'tian'):
+            greeks = LatticeOptionPricer(n=501, tree=tree).price(self.put_eur, self.underlying, 0.05, greeks=True)[1]
+            self.assertAlmostEqual(greeks['theta'], bsgreeks['theta'], delta=0.005)
+
+    def test_richardson_american(self):
+        """ Richardson-extrapolated lattices at n=100 match a 5,000 step Leisen-Reimer tree for an American put """
+        reference = self.put_amer.calc_price(LatticeOptionPricer(n=5000, tree='lr'))
+        for kwargs in (dict(tree='lr'), dict(tree='crr', smooth=True)):
+            lprice = self.put_amer.calc_price(LatticeOptionPricer(n=100, richardson=True, **kwargs))
+            self.assertAlmostEqual(reference, lprice, 2)
+
+    def test_richardson_rejects_oscillating_trees(self):
+        """ Richardson extrapolation is refused on raw CRR and Tian trees, whose error swings with the parity of n """
+        for tree in ('crr', 'tian'):
+            with self.assertRaises(ValueError):
+                LatticeOptionPricer(n=101, tree=tree, richardson=True)
+            with self.assertRaises(ValueError):
+                LatticeMandyPricer(n=101, tree=tree, richardson=True)
+            bsprice = self.put_eur.calc_price(BlackScholesPricer())
+            lprice = self.put_eur.calc_price(LatticeOptionPricer(n=101, tree=tree, richardson=True, smooth=True))
+            self.assertAlmostEqual(bsprice, lprice, delta=0.002)
+
+    def test_trinomial_greeks(self):
+        """ Trinomial lattice greeks agree with the binomial lattice greeks """
+        _, binomial = self.put_amer.calc_price(LatticeOptionPricer(n=400), greeks=True)
+        _, trinomial = self.put_amer.calc_price(LatticeOptionPricer(n=400, tree='trinomial'), greeks=True)
+        for name in ('delta', 'gamma', 'theta'):
+            self.assertAlmostEqual(binomial[name], trinomial[name], delta=0.02 * abs(binomial[name]))
+
+
+if __name__ == '__main__':
+    unittest.main()
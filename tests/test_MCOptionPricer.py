@@ -1,8 +1,11 @@
 
 import unittest
 import datetime
+import tracemalloc
+import numpy as np
 from simpaq.assets.standard import Equity, Option
 from simpaq.pricers import BlackScholesPricer, MCOptionPricer, LatticeOptionPricer
+from simpaq.processes import MonteCarlo
 
 
 class TestMCOptionPricer(unittest.TestCase):
@@ -27,10 +30,116 @@ class TestMCOptionPricer(unittest.TestCase):
     def test_american_options(self):
         """ Lattice and MC return same price for American Call """
         latticepricer = LatticeOptionPricer(n=252)
-        mcpricer = MCOptionPricer(m=500000, n=252)
+        mcpricer = MCOptionPricer(m=500000, n=252, seed=0)
         lprice = self.call_amer.calc_price(latticepricer)
-        mcprice = self.call_amer.calc_price(mcpricer)
-        self.assertAlmostEqual(lprice, mcprice, 2)
+        self.call_amer.calc_price(mcpricer)
+        result = mcpricer.last_result
+        # the least-squares exercise rule is biased by a few tenths of a cent on this option, on top of the noise
+        self.assertAlmostEqual(result['price'], lprice, delta=4 * result['std_err'] + 0.005)
+
+    def test_path_blocks(self):
+        """ MonteCarlo.blocks yields bounded blocks of paths in the requested precision """
+        process = MonteCarlo(self.underlying, 1., 0.01, num_paths=25000, num_steps=12, block_size=10000,
+                             dtype=np.float32, antithetic=True)
+        blocks = list(process.blocks())
+        self.assertEqual([b.shape for b in blocks], [(20000, 12), (20000, 12), (10000, 12)])
+        self.assertTrue(all(b.dtype == np.float32 for b in blocks))
+        self.assertAlmostEqual(np.vstack(blocks)[:, -1].mean(), 10 * np.exp(0.01), 1)
+
+    def test_flat_memory(self):
+        """ MCOptionPricer memory is bounded by the block size rather than the number of paths """
+        mcpricer = MCOptionPricer(m=400000, n=50, block_size=20000, dtype=np.float32)
+        tracemalloc.start()
+        mcprice = self.call_eur.calc_price(mcpricer)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.assertLess(peak, 400000 * 50 * 4 / 4)
+        self.assertAlmostEqual(self.call_eur.calc_price(BlackScholesPricer()), mcprice, 2)
+
+    def test_reproducible_across_workers(self):
+        """ A fixed seed gives bit-identical prices and standard errors for any number of workers """
+        results = []
+        for workers in (1, 3):
+            mcpricer = MCOptionPricer(m=60000, n=50, block_size=10000, seed=42, workers=workers)
+            self.call_amer.calc_price(mcpricer)
+            results.append(dict(mcpricer.last_result, wall_time=None))
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0]['paths'], 60000)
+        self.assertTrue(0 < results[0]['std_err'] < 0.01)
+
+    def test_variance_reduction(self):
+        """ Quasi-random and control-variate estimators report a smaller standard error than plain Monte Carlo """
+        bsprice = BlackScholesPricer().price_batch(10., 12., 1., 0.01, 0.25)
+        plain = MCOptionPricer(m=2**16, n=8, block_size=2**12, seed=7)
+        self.call_eur.calc_price(plain)
+        for kwargs in (dict(quasi_random=True), dict(moment_matching=True, antithetic=True)):
+            mcpricer = MCOptionPricer(m=2**16, n=8, block_size=2**12, seed=7, **kwargs)
+            self.call_eur.calc_price(mcpricer)
+            result = mcpricer.last_result
+            self.assertLess(result['std_err'], plain.last_result['std_err'])
+            self.assertGreater(result['vr_factor'], 1.)
+            self.assertAlmostEqual(result['price'], bsprice, delta=4 * result['std_err'])
+        # an American call without dividends is never exercised early, so Black-Scholes is its reference price; the
+        # paths are regressed in one block, as small LSM regressions are biased high by their foresight
+        mcpricer = MCOptionPricer(m=2**15, n=50, block_size=2**15, seed=7, control_variate=True)
+        self.call_amer.calc_price(mcpricer)
+        result = mcpricer.last_result
+        self.assertGreater(result['vr_factor'], 2.)
+        self.assertAlmostEqual(result['price'], bsprice, delta=4 * result['std_err'])
+
+    def test_longstaff_schwartz_put(self):
+        """ Multi-step LSM prices an American put within a few standard errors of a Leisen-Reimer lattice """
+        underlying = Equity(ticker='CCC', name='TestCCC', price=40, vol=0.2, div=0.)
+        put = Option(ticker='CCC P44', name='TestPut', underlying=underlying, strike=44, rfr=0.06,
+                     maturity=self.maturity, call=False, American=True)
+        lprice = put.calc_price(LatticeOptionPricer(n=1001, tree='lr'))
+        mcpricer = MCOptionPricer(m=100000, n=50, seed=11)
+        put.calc_price(mcpricer)
+        self.assertAlmostEqual(mcpricer.last_result['price'], lprice, delta=4 * mcpricer.last_result['std_err'] + 0.01)
+        values, stop = mcpricer.backpropagate(put, MonteCarlo(underlying, 1., 0.06, 1000, 50, seed=1).initialize(),
+                                              0.06, 50, 1. / 50, stopping=True)
+        self.assertTrue((stop < 49).any())
+
+    def test_path_greeks(self):
+        """ Pathwise and likelihood-ratio greeks from the pricing paths agree with Black-Scholes within their errors """
+        bsprice, bsgreeks = self.call_eur.calc_price(BlackScholesPricer(), greeks=True)
+        for likelihood_ratio in (False, True):
+            mcpricer = MCOptionPricer(m=2**16, n=4, seed=3, antithetic=True, likelihood_ratio=likelihood_ratio)
+            mcprice, greeks = self.call_eur.calc_price(mcpricer, greeks=True)
+            std_err = mcpricer.last_result['greeks_std_err']
+            self.assertEqual(mcpricer.last_result['paths'], 2 * 2**16)
+            for name in ('delta', 'gamma', 'vega'):
+                self.assertGreater(std_err[name], 0)
+                self.assertAlmostEqual(greeks[name], bsgreeks[name], delta=4 * std_err[name])
+
+    def test_american_path_greeks(self):
+        """ Fixed-boundary LSM greeks of an American put are close to lattice greeks """
+        underlying = Equity(ticker='CCC', name='TestCCC', price=40, vol=0.2, div=0.)
+        put = Option(ticker='CCC P44', name='TestPut', underlying=underlying, strike=44, rfr=0.06,
+                     maturity=self.maturity, call=False, American=True)
+        lprice, lgreeks = put.calc_price(LatticeOptionPricer(n=500, bump_greeks=True), greeks=True)
+        mcpricer = MCOptionPricer(m=100000, n=50, seed=11)
+        mcprice, greeks = put.calc_price(mcpricer, greeks=True)
+        self.assertAlmostEqual(greeks['delta'], lgreeks['delta'], delta=0.02)
+        self.assertAlmostEqual(greeks['gamma'], lgreeks['gamma'], delta=0.01)
+        self.assertAlmostEqual(greeks['vega'], lgreeks['vega'], delta=0.5)
+
+    def test_target_std_err(self):
+        """ Adaptive pricers stop at the first block that meets the target, or when the time budget runs out """
+        mcpricer = MCOptionPricer(m=10**7, n=10, block_size=5000, seed=5, target_bp=50)
+        self.call_amer.calc_price(mcpricer)
+        result = mcpricer.last_result
+        self.assertTrue(result['converged'])
+        self.assertLessEqual(result['std_err'], 50e-4 * result['price'])
+        self.assertLess(result['paths'], 10**6)
+        self.assertEqual(result['paths'] % 5000, 0)
+        mcpricer = MCOptionPricer(m=10**7, n=10, block_size=5000, seed=5, target_std_err=1e-6, time_budget=0.2)
+        self.call_amer.calc_price(mcpricer)
+        self.assertFalse(mcpricer.last_result['converged'])
+        self.assertLess(mcpricer.last_result['wall_time'], 2.)
+        with self.assertRaises(ValueError):
+            MCOptionPricer(m=1000, n=10, target_std_err=0.01, target_bp=10)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+import datetime
+import shutil
+import tempfile
+import numpy as np
+from simpaq.assets import Equity, MarketDataStore
+
+
+class TestMarketDataStore(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.tickers = ['AAA', 'BBB', 'CCC']
+        self.dates = np.arange(np.datetime64('2024-01-01'), np.datetime64('2024-12-31'))
+        returns = rng.normal(0., np.array([0.01, 0.02, 0.015]), (len(self.dates), 3))
+        self.close = 50. * np.exp(np.cumsum(returns, axis=0))
+        self.volume = rng.integers(1000, 5000, self.close.shape).astype(float)
+        self.close[-5:, 2] = np.nan
+        self.store = MarketDataStore(self.tickers, self.dates, self.close, self.volume)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_stats_match_single_ticker_calculation(self):
+        """ Vectorized price, vol and ADV match the per-ticker calculation over the lookback window """
+        stats = self.store.stats(lookback=63)
+        for i in range(3):
+            close = self.close[-64:, i][np.isfinite(self.close[-64:, i])]
+            returns = close[1:] / close[:-1] - 1
+            self.assertAlmostEqual(stats['price'][i], close[-1], 10)
+            self.assertAlmostEqual(stats['vol'][i], returns.std(ddof=1) * np.sqrt(252), 10)
+            self.assertAlmostEqual(stats['adv'][i], self.volume[-64:, i].mean(), 10)
+
+    def test_npy_store_is_memory_mapped(self):
+        """ A store saved to .npy files loads memory-mapped and gives the same statistics """
+        self.store.save_npy(self.directory)
+        loaded = MarketDataStore.from_npy(self.directory)
+        self.assertIsInstance(loaded.close, np.memmap)
+        value_date = datetime.date(2024, 6, 28)
+        np.testing.assert_allclose(loaded.stats(value_date=value_date)['vol'],
+                                   self.store.stats(value_date=value_date)['vol'])
+
+    def test_equities_refresh_from_cache(self):
+        """ Equity.set_stock_data and MarketDataStore.refresh read the cache keyed by (ticker, date, lookback) """
+        equities = [Equity(ticker, ticker) for ticker in self.tickers]
+        self.store.refresh(equities, lookback=21)
+        self.assertEqual(len(self.store._cache), 3)
+        single = Equity('BBB', 'BBB')
+        single.set_stock_data(self.store, lookback=21)
+        self.assertEqual(len(self.store._cache), 3)
+        self.assertEqual((single.price, single.vol, single.adv), (equities[1].price, equities[1].vol, equities[1].adv))
+        with self.assertRaises(KeyError):
+            self.store.get('ZZZ')
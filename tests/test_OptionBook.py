@@ -0,0 +1,68 @@
+import unittest
+import datetime
+import numpy as np
+from simpaq.assets import Equity, Option, OptionBook
+from simpaq.curves import YieldCurve
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer
+from simpaq.processes import TREES
+
+
+class TestOptionBook(unittest.TestCase):
+
+    def setUp(self):
+        self.underlyings = [Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0.01),
+                            Equity(ticker='BBB', name='BBB Common', price=40, vol=0.35, div=0.)]
+        today = datetime.date.today()
+        strikes = [8, 36, 10, 44, 12, 40, 9, 38]
+        days = [30, 90, 180, 365, 400, 500, 600, 730]
+        self.options = [Option('OPT%d' % i, 'Option', self.underlyings[i % 2], strikes[i], 0.03,
+                               today + datetime.timedelta(days=days[i]), call=bool(i % 3), American=bool(i % 4 > 1))
+                        for i in range(8)]
+        self.book = OptionBook.from_options(self.options)
+
+    def test_lattice_batch_matches_options(self):
+        """ The batched lattice kernel reproduces per-option lattice prices and greeks on every tree family """
+        for tree in ('crr', 'lr', 'tian', 'trinomial'):
+            pricer = LatticeOptionPricer(n=101, richardson=True, tree=tree, smooth=TREES[tree].oscillates)
+            prices, greeks = self.book.calc_prices(pricer, greeks=True, chunk_size=3)
+            for i, option in enumerate(self.options):
+                price, greek = option.calc_price(pricer, greeks=True)
+                self.assertAlmostEqual(round(prices[i], 3), price, 10)
+                for name in ('delta', 'gamma', 'theta'):
+                    self.assertAlmostEqual(greeks[name][i], greek[name], 8)
+
+    def test_black_scholes_batch(self):
+        """ Black-Scholes prices a European book in one kernel call and rejects American options """
+        european = OptionBook.from_options([o for o in self.options if not o.American])
+        prices = european.calc_prices(BlackScholesPricer())
+        for price, option in zip(prices, [o for o in self.options if not o.American]):
+            self.assertAlmostEqual(round(price, 3), option.calc_price(BlackScholesPricer()), 10)
+        with self.assertRaises(TypeError):
+            self.book.calc_prices(BlackScholesPricer())
+
+    def test_row_views(self):
+        """ Rows are slotted views that price like the Option they were built from """
+        row = self.book[2]
+        self.assertFalse(hasattr(row, '__dict__'))
+        self.assertEqual((row.strike, row.maturity, row.call, row.American),
+                         (10., self.options[2].maturity, True, True))
+        self.assertIs(row.underlying, self.underlyings[0])
+        pricer = LatticeOptionPricer(n=50, tree='lr')
+        self.assertEqual(row.calc_price(pricer), self.options[2].calc_price(pricer))
+        np.testing.assert_allclose(np.round(self.book.calc_prices(pricer), 3),
+                                   [o.calc_price(pricer) for o in self.options])
+
+    def test_curve_rates(self):
+        """ Options discounted on a YieldCurve are held in the book and priced one row at a time on their curve """
+        curve = YieldCurve([0.5, 1., 2.], [0.02, 0.03, 0.035])
+        for option in self.options[1::2]:
+            option.rfr = curve
+        book = OptionBook.from_options(self.options)
+        self.assertEqual(sorted(book.curves), [1, 3, 5, 7])
+        self.assertIs(book[3].rfr, curve)
+        pricer = LatticeOptionPricer(n=100)
+        prices, greeks = book.calc_prices(pricer, greeks=True, chunk_size=3)
+        for i, option in enumerate(self.options):
+            price, greek = option.calc_price(pricer, greeks=True)
+            self.assertAlmostEqual(round(prices[i], 3), price, 10)
+            self.assertAlmostEqual(greeks['delta'][i], greek['delta'], 8)
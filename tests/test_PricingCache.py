@@ -0,0 +1,72 @@
+import unittest
+import datetime
+from simpaq.assets import OptionBook
+from simpaq.assets.standard import Equity, Option
+from simpaq.cache import PricingCache
+from simpaq.curves import YieldCurve
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer
+
+
+class TestPricingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0.01)
+        self.maturity = datetime.date.today() + datetime.timedelta(days=365)
+        self.option = Option('AAA P12', 'AmPut', self.underlying, 12, 0.05, self.maturity, call=False, American=True)
+        self.now = [0.]
+        self.cache = PricingCache(maxsize=2, ttl=5., clock=lambda: self.now[0])
+
+    def test_hits_and_stats(self):
+        """ Repeated calls with unchanged inputs are served from the cache and counted as hits """
+        pricer = LatticeOptionPricer(n=100)
+        price = self.option.calc_price(pricer, cache=self.cache)
+        self.assertEqual(self.option.calc_price(pricer, cache=self.cache), price)
+        self.assertEqual(self.option.calc_price(pricer), price)
+        greeks = self.option.calc_price(pricer, greeks=True, cache=self.cache)
+        self.assertEqual(self.option.calc_price(pricer, greeks=True, cache=self.cache), greeks)
+        self.option.calc_price(LatticeOptionPricer(n=50), cache=self.cache)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (2, 3, 1, 2))
+
+    def test_market_data_invalidates(self):
+        """ set_price, set_vol and set_dividend drop the results of the underlying and the next call reprices """
+        pricer = LatticeOptionPricer(n=100)
+        for setter, value in (('set_price', 11.), ('set_vol', 0.3), ('set_dividend', 0.)):
+            before = self.option.calc_price(pricer, cache=self.cache)
+            self.assertEqual(len(self.cache), 1)
+            getattr(self.underlying, setter)(value)
+            self.assertEqual(len(self.cache), 0)
+            self.assertNotEqual(self.option.calc_price(pricer, cache=self.cache), before)
+            self.cache.clear()
+        self.assertEqual(self.cache.stats()['hits'], 0)
+
+    def test_ttl_and_stable_keys(self):
+        """ Results expire after the time-to-live, and keys depend on values rather than object identity """
+        pricer = BlackScholesPricer()
+        european = Option('AAA C12', 'Call', self.underlying, 12, YieldCurve.flat(0.05), self.maturity,
+                          American=False)
+        twin = Option('AAA C12', 'Call', Equity('AAA', 'AAA Common', price=10, vol=0.25, div=0.01), 12,
+                      YieldCurve.flat(0.05), self.maturity, American=False)
+        self.assertEqual(PricingCache.key(european, BlackScholesPricer()), PricingCache.key(twin, pricer))
+        european.calc_price(pricer, cache=self.cache)
+        twin.calc_price(pricer, cache=self.cache)
+        self.now[0] = 6.
+        european.calc_price(pricer, cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 2))
+
+    def test_book_rows(self):
+        """ OptionRow views of two books with different strikes get different keys and their own prices """
+        pricer = LatticeOptionPricer(n=100)
+        books = [OptionBook.from_options([Option('AAA C', 'Call', self.underlying, strike, 0.05, self.maturity)])
+                 for strike in (9., 11.)]
+        rows = [book[0] for book in books]
+        self.assertNotEqual(PricingCache.key(rows[0]), PricingCache.key(rows[1]))
+        for row in rows:
+            price = self.cache.price(pricer, row, row.underlying, row.rfr)
+            self.assertEqual(price, row.calc_price(pricer))
+        self.assertEqual(self.cache.hits, 0)
+
+    def test_unfingerprintable(self):
+        """ Objects with neither attributes nor __slots__ are refused rather than keyed on their repr """
+        with self.assertRaises(TypeError):
+            PricingCache.key(object())
@@ -0,0 +1,70 @@
+import unittest
+import copy
+import datetime
+import numpy as np
+from simpaq.assets.standard import Equity, Option, Mandatory
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer, MCOptionPricer, ScenarioEngine
+from simpaq.pricers.numerical import LatticeMandyPricer
+
+
+class TestScenarioEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0.01)
+        self.valuation_date = datetime.date.today()
+        self.maturity = self.valuation_date + datetime.timedelta(days=730)
+        self.put = Option('AAA P12', 'AmPut', self.underlying, 12, 0.05, self.maturity, call=False, American=True)
+        self.mandy = Mandatory('AAA 6.5%', 'AAA Mandatory', self.underlying, par=50., r1=5., r2=4., rfr=0.05,
+                               spread=0.03, maturity=self.maturity, American=True, coupons=[0.8125] * 8,
+                               pay_dates=[self.maturity - datetime.timedelta(days=91 * k) for k in range(8)])
+
+    def price(self, pricer, asset, spot, vol, rate=0., days=0):
+        shifted = copy.copy(self.underlying)
+        shifted.price, shifted.vol = self.underlying.price * (1 + spot), self.underlying.vol + vol
+        return pricer.price(asset, shifted, asset.rfr + rate,
+                            valuation_date=self.valuation_date + datetime.timedelta(days=days))
+
+    def test_lattice_ladder(self):
+        """ A spot/vol ladder on stacked trees matches pricing each point, for options and mandatories """
+        spot, vol = np.linspace(-0.2, 0.2, 5), [-0.05, 0., 0.05]
+        for pricer, asset in ((LatticeOptionPricer(n=200), self.put), (LatticeMandyPricer(n=200), self.mandy)):
+            cube = ScenarioEngine(pricer).run([asset], spot=spot, vol=vol, rate=[0.01], days=[30],
+                                              valuation_date=self.valuation_date)
+            self.assertEqual(cube.shape, (1, 5, 3, 1, 1))
+            for i, shift in enumerate(spot):
+                for j, bump in enumerate(vol):
+                    self.assertAlmostEqual(round(cube.values[0, i, j, 0, 0], 3),
+                                           self.price(pricer, asset, shift, bump, 0.01, 30), 10)
+        self.assertEqual(cube.sel(asset='AAA 6.5%', spot=0.2, vol=0.).shape, (1, 1))
+
+    def test_interpolated_ladder(self):
+        """ The interpolated ladder is exact at the spot node and within its documented error off the nodes """
+        spot, vol = np.linspace(-0.2, 0.2, 5), [-0.05, 0., 0.05]
+        for pricer, asset, error in ((LatticeOptionPricer(n=200), self.put, 0.005),
+                                     (LatticeMandyPricer(n=200), self.mandy, 0.2)):
+            cube = ScenarioEngine(pricer, interpolate=True).run([asset], spot=spot, vol=vol,
+                                                                valuation_date=self.valuation_date)
+            for i, shift in enumerate(spot):
+                for j, bump in enumerate(vol):
+                    self.assertAlmostEqual(cube.values[0, i, j, 0, 0], self.price(pricer, asset, shift, bump),
+                                           delta=error if shift else 1e-3)
+
+    def test_non_rescalable_trees_and_workers(self):
+        """ Leisen-Reimer trees are stacked one per spot and match per-point prices; workers give the same cube """
+        pricer = LatticeOptionPricer(n=51, tree='lr')
+        grid = dict(spot=[-0.1, 0.1], vol=[0., 0.1], rate=[0., 0.01], valuation_date=self.valuation_date)
+        cube = ScenarioEngine(pricer).run([self.put], **grid)
+        self.assertAlmostEqual(cube.sel(spot=0.1, vol=0.1, rate=0.01)[0, 0],
+                               self.price(pricer, self.put, 0.1, 0.1, 0.01), 3)
+        np.testing.assert_allclose(ScenarioEngine(pricer, workers=2).run([self.put], **grid).values, cube.values)
+
+    def test_common_random_numbers(self):
+        """ Monte Carlo scenarios share their draws, so a fine spot ladder is smooth and the underlying is untouched """
+        european = Option('AAA C10', 'Call', self.underlying, 10, 0.05, self.maturity, American=False)
+        spot = np.linspace(-0.02, 0.02, 5)
+        cube = ScenarioEngine(MCOptionPricer(m=20000, n=20)).run([european], spot=spot,
+                                                                 valuation_date=self.valuation_date)
+        deltas = np.diff(cube.values.ravel()) / (10 * np.diff(spot))
+        bsdelta = BlackScholesPricer().price(european, self.underlying, 0.05, greeks=True)[1]['delta']
+        np.testing.assert_allclose(deltas, bsdelta, atol=0.03)
+        self.assertEqual((self.underlying.price, self.underlying.vol), (10, 0.25))
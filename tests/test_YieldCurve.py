@@ -0,0 +1,54 @@
+import unittest
+import datetime
+import numpy as np
+from simpaq.assets.standard import Equity, Option
+from simpaq.curves import YieldCurve, as_curve
+from simpaq.pricers import BlackScholesPricer, LatticeOptionPricer, FDOptionPricer, MCOptionPricer
+
+
+class TestYieldCurve(unittest.TestCase):
+
+    def setUp(self):
+        self.times = np.array([0.25, 0.5, 1., 2., 5., 10.])
+        self.zeros = np.array([0.01, 0.015, 0.03, 0.05, 0.045, 0.04])
+        self.underlying = Equity(ticker='AAA', name='AAA Common', price=10, vol=0.25, div=0.01)
+        self.maturity = datetime.date.today() + datetime.timedelta(days=730)
+
+    def test_pillars_repriced(self):
+        """ Both interpolators return the pillar zero rates and agree with forward-rate construction """
+        for interpolation in YieldCurve.INTERPOLATIONS:
+            curve = YieldCurve(self.times, self.zeros, interpolation=interpolation)
+            np.testing.assert_allclose(curve.zero(self.times), self.zeros)
+        forwards = YieldCurve(self.times, self.zeros).forwards
+        np.testing.assert_allclose(YieldCurve(self.times, forwards, forward=True).zeros, self.zeros)
+
+    def test_monotone_convex_forwards_continuous(self):
+        """ Monotone-convex forwards are continuous, log-linear forwards jump at the pillars """
+        grid = np.linspace(0.01, 12., 12000)
+        jumps = {}
+        for interpolation in YieldCurve.INTERPOLATIONS:
+            curve = YieldCurve(self.times, self.zeros, interpolation=interpolation)
+            jumps[interpolation] = np.abs(np.diff(curve.forward(grid[:-1], grid[1:]))).max()
+        self.assertLess(jumps['monotone_convex'], 1e-3)
+        self.assertGreater(jumps['log_linear'], 1e-2)
+
+    def test_flat_curve_matches_float(self):
+        """ A flat curve prices exactly like the equivalent float rate """
+        self.assertEqual(as_curve(0.05), YieldCurve.flat(0.05))
+        put = Option('AAA P11', 'AmPut', self.underlying, 11, 0.05, self.maturity, call=False, American=True)
+        for pricer in (LatticeOptionPricer(n=200), MCOptionPricer(m=20000, n=20, seed=5)):
+            self.assertEqual(pricer.price(put, self.underlying, 0.05),
+                             pricer.price(put, self.underlying, YieldCurve.flat(0.05)))
+
+    def test_pricers_agree_on_curve(self):
+        """ Lattice, finite-difference and Monte Carlo prices of a European put on a curve match Black-Scholes at the
+        zero rate to maturity """
+        curve = YieldCurve(self.times, self.zeros, interpolation='monotone_convex')
+        put = Option('AAA P11', 'PutOption', self.underlying, 11, curve, self.maturity, call=False, American=False)
+        bsprice = BlackScholesPricer().price(put, self.underlying, curve)
+        self.assertAlmostEqual(BlackScholesPricer().price(put, self.underlying, float(curve.zero(2.))), bsprice, 3)
+        for pricer in (LatticeOptionPricer(n=500, tree='lr'), FDOptionPricer(n=200, m=300)):
+            self.assertAlmostEqual(pricer.price(put, self.underlying, curve), bsprice, 2)
+        mcpricer = MCOptionPricer(m=50000, n=8, seed=2)
+        mcpricer.price(put, self.underlying, curve)
+        self.assertAlmostEqual(mcpricer.last_result['price'], bsprice, delta=4 * mcpricer.last_result['std_err'] + 0.001)
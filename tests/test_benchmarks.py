@@ -0,0 +1,38 @@
+import unittest
+import os
+import json
+import tempfile
+from simpaq.benchmarks import BENCHMARKS, run, save, load, compare, convergence
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_records_round_trip(self):
+        """ A quick run records time, memory and error for every size and reloads from a JSON baseline """
+        records = run(['DCF.price', 'LSM.calc', 'Tree.initialize'], quick=True, repeat=1)
+        self.assertEqual(len(records), sum(len(BENCHMARKS[name].quick_sizes)
+                                           for name in ('DCF.price', 'LSM.calc', 'Tree.initialize')))
+        for record in records:
+            self.assertGreater(record['wall_time'], 0)
+            self.assertGreater(record['peak_memory'], 0)
+            self.assertLess(record['error'], 1e-8)
+        self.assertEqual([size for size, _, _ in convergence(records)['LSM.calc']], BENCHMARKS['LSM.calc'].quick_sizes)
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        save(records, path)
+        self.assertIn('machine', json.load(open(path)))
+        self.assertEqual(load(path), records)
+
+    def test_compare_flags_regressions(self):
+        """ Slower, larger or less accurate results than the baseline are reported as regressions """
+        baseline = [{'benchmark': 'LSM.calc', 'size': 100, 'size_name': 'samples', 'wall_time': 0.1,
+                     'peak_memory': 1000, 'error': 1e-3}]
+        self.assertEqual(compare(baseline, baseline), [])
+        noisy = [dict(baseline[0], wall_time=0.12, peak_memory=1100, error=1.05e-3)]
+        self.assertEqual(compare(noisy, baseline), [])
+        worse = [dict(baseline[0], wall_time=0.2, peak_memory=2000, error=2e-3)]
+        self.assertEqual(len(compare(worse, baseline)), 3)
+        self.assertEqual(compare([dict(worse[0], size=200)], baseline), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import os
+import sys
+import json
+import subprocess
+import simpaq
+
+
+class TestImports(unittest.TestCase):
+    """ Importing the pricers must stay light: plotting, data-access and statistics packages are only imported on the
+    code paths that use them. Each check runs in a fresh interpreter so that modules imported by other tests do not
+    leak in.
+    """
+    heavy = ('matplotlib', 'pandas', 'pandas_datareader', 'statsmodels', 'scipy.stats')
+
+    def imported(self, statement):
+        script = ('import sys, time, json\n'
+                  'start = time.perf_counter()\n'
+                  '%s\n'
+                  'print(json.dumps({"seconds": time.perf_counter() - start, "modules": sorted(sys.modules)}))'
+                  % statement)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(os.path.abspath(simpaq.__file__))))
+        output = subprocess.check_output([sys.executable, '-c', script], env=env)
+        return json.loads(output.decode().strip().splitlines()[-1])
+
+    def test_pricers_skip_heavy_modules(self):
+        """ Importing the pricers, assets, curves and processes does not import any heavy optional dependency """
+        result = self.imported('import simpaq.pricers, simpaq.assets, simpaq.curves, simpaq.processes')
+        self.assertEqual([m for m in self.heavy if m in result['modules']], [])
+
+    def test_import_time_budget(self):
+        """ Importing the pricers stays within a (loose) time budget """
+        result = self.imported('import simpaq.pricers')
+        self.assertLess(result['seconds'], 2.)